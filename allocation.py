@@ -0,0 +1,380 @@
+"""Assign bookings to concrete beds.
+
+A homestay's ``beds`` are split as evenly as possible over its ``rooms``
+(7 beds in 3 rooms: 3, 2 and 2), labelled ``R<room>-B<bed>``. Each
+booking that holds beds (approved or pending) gets ``beds_booked`` of them
+for its whole stay; the labels are saved on the booking
+(``bed_assignment``) so staff see the same beds every time.
+
+Index: per homestay, one ``BedTimeline`` per bed holding that bed's stays
+as sorted, non-overlapping ``[start, end)`` day ranges. Because a bed's
+stays never overlap, their starts and ends are both sorted and a bisect
+finds the stays next to any range, so "is this bed free" and "how tight
+does this stay fit" are ``O(log n)`` per bed.
+
+Placement is best fit:
+
+* if one room can take the whole party, use the room with the fewest free
+  beds that can, and within it the beds whose free gap the stay fills most
+  tightly, which leaves fewer unusable one- or two-night gaps
+* otherwise split the party over as few rooms as possible
+
+``can_stay_together`` answers the first question without booking.
+
+The index of a homestay is built from its bookings the first time it is
+needed and again by ``rebuild`` (at startup and periodically, so bookings
+placed by other workers show up). Bookings whose saved beds are still free
+keep them; the rest are placed in check-in order. Labels are saved with a
+compare-and-set on the previous value, so when two workers place the same
+booking differently the first write wins and the other worker reloads the
+homestay instead of overwriting it. Imported external holds
+(``ical_import.py``) reduce the bed count but are not tied to beds.
+"""
+
+import logging
+import re
+import threading
+from bisect import bisect_right
+from datetime import date
+
+log = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ('approved', 'pending')
+HORIZON_DAYS = 365  # gaps longer than this count as open-ended
+
+_LABEL = re.compile(r'^R(\d+)-B(\d+)$')
+
+
+def room_layout(rooms, beds):
+    """Beds per room, spread as evenly as possible."""
+    beds = max(0, int(beds or 0))
+    rooms = max(1, min(int(rooms or 1), beds or 1))
+    return [beds // rooms + (1 if i < beds % rooms else 0) for i in range(rooms)]
+
+
+def _day(value):
+    return date.fromisoformat(str(value)[:10]).toordinal()
+
+
+def parse_assignment(text):
+    """``'R1-B1,R1-B2'`` -> ``[(1, 1), (1, 2)]``; unreadable labels are dropped."""
+    labels = []
+    for part in str(text or '').split(','):
+        match = _LABEL.match(part.strip())
+        if match:
+            labels.append((int(match.group(1)), int(match.group(2))))
+    return labels
+
+
+def format_assignment(labels):
+    return ','.join(f"R{room}-B{bed}" for room, bed in labels)
+
+
+class BedTimeline:
+    """Non-overlapping stays of one bed, sorted by start day."""
+
+    __slots__ = ('starts', 'ends', 'owners')
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.owners = []
+
+    def _next(self, start):
+        # First stay ending after ``start``; every stay before it ends by ``start``
+        return bisect_right(self.ends, start)
+
+    def is_free(self, start, end):
+        i = self._next(start)
+        return i == len(self.starts) or self.starts[i] >= end
+
+    def slack(self, start, end):
+        """Free days left on both sides of ``[start, end)`` in its gap (smaller is a tighter fit)."""
+        i = self._next(start)
+        before = start - self.ends[i - 1] if i else HORIZON_DAYS
+        after = self.starts[i] - end if i < len(self.starts) else HORIZON_DAYS
+        return min(before, HORIZON_DAYS) + min(after, HORIZON_DAYS)
+
+    def add(self, start, end, owner):
+        i = self._next(start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.owners.insert(i, owner)
+
+    def remove(self, owner):
+        for i, current in enumerate(self.owners):
+            if current == owner:
+                del self.starts[i], self.ends[i], self.owners[i]
+                return
+
+    def stays(self, start, end):
+        i = self._next(start)
+        while i < len(self.starts) and self.starts[i] < end:
+            yield self.starts[i], self.ends[i], self.owners[i]
+            i += 1
+
+
+class HomestayBeds:
+    """Bed timelines of one homestay and where each booking sleeps."""
+
+    def __init__(self, rooms, beds):
+        self.layout = room_layout(rooms, beds)
+        self.labels = [(room + 1, bed + 1) for room, count in enumerate(self.layout) for bed in range(count)]
+        self.timelines = {label: BedTimeline() for label in self.labels}
+        self.bookings = {}  # booking id -> (start, end, labels)
+
+    def _free(self, start, end):
+        """``{room: [(slack, label), ...]}`` of beds free for the whole range, tightest first."""
+        rooms = {}
+        for label in self.labels:
+            timeline = self.timelines[label]
+            if timeline.is_free(start, end):
+                rooms.setdefault(label[0], []).append((timeline.slack(start, end), label))
+        for beds in rooms.values():
+            beds.sort()
+        return rooms
+
+    def choose(self, start, end, count):
+        """Best-fit labels for ``count`` beds over ``[start, end)``, or None if they do not fit."""
+        rooms = self._free(start, end)
+        whole = [(len(beds), sum(s for s, _ in beds[:count]), room) for room, beds in rooms.items() if len(beds) >= count]
+        if whole:
+            _, _, room = min(whole)
+            return [label for _, label in rooms[room][:count]]
+        if sum(len(beds) for beds in rooms.values()) < count:
+            return None
+        chosen = []
+        for room in sorted(rooms, key=lambda r: (-len(rooms[r]), r)):
+            chosen.extend(label for _, label in rooms[room][:count - len(chosen)])
+            if len(chosen) == count:
+                return chosen
+        return None
+
+    def together(self, start, end, count):
+        """Room number that has ``count`` free beds for the whole range (tightest such room), or None."""
+        rooms = self._free(start, end)
+        fits = [(len(beds), room) for room, beds in rooms.items() if len(beds) >= count]
+        return min(fits)[1] if fits else None
+
+    def place(self, booking_id, start, end, labels):
+        for label in labels:
+            self.timelines[label].add(start, end, booking_id)
+        self.bookings[booking_id] = (start, end, list(labels))
+
+    def release(self, booking_id):
+        placed = self.bookings.pop(booking_id, None)
+        if placed:
+            for label in placed[2]:
+                self.timelines[label].remove(booking_id)
+        return placed
+
+    def fits(self, start, end, labels):
+        return bool(labels) and len(set(labels)) == len(labels) and all(
+            label in self.timelines and self.timelines[label].is_free(start, end) for label in labels
+        )
+
+
+def _stay(booking):
+    try:
+        start, end = _day(booking['from_date']), _day(booking['till_date'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return (start, end) if end > start else None
+
+
+class BedAllocator:
+    def __init__(self, get_store):
+        self._get_store = get_store
+        self._lock = threading.Lock()
+        self._homestays = {}
+        self._versions = {}
+        self.assigned = 0
+        self.unplaced = 0
+        self.released = 0
+        self.loads = 0
+        self.persist_errors = 0
+        self.conflicts = 0
+
+    # --- Index ---
+
+    def _build(self, homestay_id):
+        """Build a homestay's index from its bookings; returns (HomestayBeds or None, assignments to save)."""
+        store = self._get_store()
+        homestay = store.homestays.get(homestay_id)
+        if not homestay:
+            return None, {}
+        index = HomestayBeds(homestay.get('rooms'), homestay.get('beds'))
+        bookings = store.bookings.list_active_for_homestay(homestay_id, ACTIVE_STATUSES,
+                                                           from_date=date.today().isoformat())
+        changed = {}
+        unplaced = []
+        for booking in sorted(bookings, key=lambda b: (str(b.get('from_date')), b.get('id') or 0)):
+            stay = _stay(booking)
+            if stay is None:
+                continue
+            labels = parse_assignment(booking.get('bed_assignment'))
+            if len(labels) == int(booking.get('beds_booked') or 1) and index.fits(*stay, labels):
+                index.place(booking['id'], *stay, labels)
+            else:
+                unplaced.append((booking, stay))
+        for booking, stay in unplaced:
+            labels = index.choose(*stay, int(booking.get('beds_booked') or 1))
+            if labels is None:
+                log.warning("No bed assignment fits booking %s of homestay %s", booking['id'], homestay_id)
+                continue
+            index.place(booking['id'], *stay, labels)
+            changed[booking['id']] = (labels, booking.get('bed_assignment'))
+        return index, changed
+
+    def _index(self, homestay_id):
+        with self._lock:
+            index = self._homestays.get(homestay_id)
+            if index is not None:
+                return index
+            version = self._versions.get(homestay_id, 0)
+        index, changed = self._build(homestay_id)
+        with self._lock:
+            self.loads += 1
+            if index is not None and self._versions.get(homestay_id, 0) == version:
+                index = self._homestays.setdefault(homestay_id, index)
+            else:
+                changed = {}
+        self._persist(homestay_id, changed)
+        return index
+
+    def _persist(self, homestay_id, assignments):
+        """Save ``{booking_id: (labels, previous saved text)}``; reload the homestay if another worker won."""
+        if not assignments:
+            return
+        store = self._get_store()
+        lost = False
+        for booking_id, (labels, expected) in assignments.items():
+            text = format_assignment(labels)
+            try:
+                saved = store.bookings.set_bed_assignment(booking_id, text, expected or None)
+                # Lost the compare-and-set: fine if the winner saved the same beds
+                if saved is None and (store.bookings.get(booking_id) or {}).get('bed_assignment') != text:
+                    lost = True
+            except Exception:
+                with self._lock:
+                    self.persist_errors += 1
+                log.exception("Could not save bed assignment of booking %s", booking_id)
+        if lost:
+            with self._lock:
+                self.conflicts += 1
+            self.invalidate(homestay_id)
+
+    def rebuild(self, homestay_ids=None):
+        """Rebuild the index of every homestay (or ``homestay_ids``) from the bookings."""
+        if homestay_ids is None:
+            homestay_ids = [h['id'] for h in self._get_store().homestays.list_all()]
+        for homestay_id in homestay_ids:
+            self.invalidate(homestay_id)
+            self._index(homestay_id)
+        return {'homestays': len(homestay_ids)}
+
+    def invalidate(self, homestay_id=None):
+        with self._lock:
+            if homestay_id is None:
+                for key in self._homestays:
+                    self._versions[key] = self._versions.get(key, 0) + 1
+                self._homestays.clear()
+            else:
+                self._homestays.pop(homestay_id, None)
+                self._versions[homestay_id] = self._versions.get(homestay_id, 0) + 1
+
+    # --- Bookings ---
+
+    def assign(self, booking):
+        """Place an active booking on beds (keeping its current beds if unchanged); returns the labels or None."""
+        homestay_id = booking.get('homestay_id')
+        stay = _stay(booking)
+        if homestay_id is None or stay is None:
+            return None
+        index = self._index(int(homestay_id))
+        if index is None:
+            return None
+        count = int(booking.get('beds_booked') or 1)
+        saved = parse_assignment(booking.get('bed_assignment'))
+        with self._lock:
+            placed = index.bookings.get(booking['id'])
+            if placed and placed[:2] == stay and len(placed[2]) == count:
+                labels, changed = placed[2], placed[2] != saved
+            else:
+                index.release(booking['id'])
+                labels = saved if len(saved) == count and index.fits(*stay, saved) else index.choose(*stay, count)
+                if labels is None:
+                    self.unplaced += 1
+                    log.warning("No bed assignment fits booking %s of homestay %s", booking['id'], homestay_id)
+                    return None
+                index.place(booking['id'], *stay, labels)
+                self.assigned += 1
+                changed = labels != saved
+            self._versions[int(homestay_id)] = self._versions.get(int(homestay_id), 0) + 1
+        if changed:
+            self._persist(int(homestay_id), {booking['id']: (labels, booking.get('bed_assignment'))})
+        return labels
+
+    def release(self, booking_id, homestay_id=None):
+        with self._lock:
+            indexes = [self._homestays.get(int(homestay_id))] if homestay_id is not None else list(self._homestays.values())
+            for index in indexes:
+                if index is not None and index.release(booking_id):
+                    self.released += 1
+                    return True
+        return False
+
+    def can_stay_together(self, homestay_id, from_date, till_date, beds):
+        """``{'fits', 'together', 'room'}`` for a party of ``beds`` over the stay.
+
+        ``fits`` is False when no set of beds stays free for every night,
+        even if enough beds are free on each night taken separately.
+        """
+        index = self._index(int(homestay_id))
+        if index is None:
+            return None
+        start, end = _day(from_date), _day(till_date)
+        with self._lock:
+            room = index.together(start, end, int(beds))
+            fits = room is not None or index.choose(start, end, int(beds)) is not None
+        return {'fits': fits, 'together': room is not None, 'room': room}
+
+    def plan(self, homestay_id, from_date, till_date):
+        """Rooms and beds with the bookings sleeping in each over ``[from_date, till_date)``."""
+        index = self._index(int(homestay_id))
+        if index is None:
+            return None
+        start, end = _day(from_date), _day(till_date)
+        with self._lock:
+            beds = []
+            for label in index.labels:
+                stays = [{'booking_id': owner, 'from_date': date.fromordinal(s).isoformat(),
+                          'till_date': date.fromordinal(e).isoformat()}
+                         for s, e, owner in index.timelines[label].stays(start, end)]
+                beds.append({'bed': format_assignment([label]), 'room': label[0], 'stays': stays})
+            return {'homestay_id': int(homestay_id), 'layout': list(index.layout), 'beds': beds}
+
+    def on_store_change(self, table, operation, rows, args):
+        if table == 'homestays' and operation in ('update', 'delete') and args:
+            self.invalidate(int(args[0]))
+        elif table == 'bookings':
+            for row in rows:
+                if row.get('id') is None:
+                    continue
+                if operation != 'delete_many' and row.get('status') in ACTIVE_STATUSES:
+                    self.assign(row)
+                else:
+                    self.release(row['id'], row.get('homestay_id'))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'homestays': len(self._homestays),
+                'bookings_placed': sum(len(index.bookings) for index in self._homestays.values()),
+                'assigned': self.assigned,
+                'unplaced': self.unplaced,
+                'released': self.released,
+                'loads': self.loads,
+                'persist_errors': self.persist_errors,
+                'conflicts': self.conflicts,
+            }
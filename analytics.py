@@ -0,0 +1,223 @@
+"""Occupancy and revenue analytics for admins.
+
+Bookings are loaded once as columnar NumPy arrays and every metric is a
+vectorised pass over them:
+
+* per-homestay, per-night occupied beds and revenue via difference arrays
+  (``np.add.at`` at check-in/check-out, then ``cumsum`` along the nights)
+* revenue per check-in month via ``np.bincount``
+* average stay length and booking lead time as array means
+
+Results are cached per query window and dropped whenever bookings or
+homestays change (see ``invalidate``); ``CACHE_SECONDS`` bounds staleness
+from writes made by other worker processes.
+"""
+
+import threading
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+import archive
+
+# Bookings that hold beds, and bookings whose money counts as revenue
+OCCUPYING_STATUSES = ('approved', 'pending', 'paid')
+REVENUE_STATUSES = ('approved', 'paid')
+STATUS_CODES = {status: code for code, status in enumerate(sorted(set(OCCUPYING_STATUSES + REVENUE_STATUSES)), start=1)}
+
+CACHE_SECONDS = 300
+MAX_WINDOW_DAYS = 731
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def _ordinal(value):
+    """Day ordinal of an ISO date/timestamp string, or -1 when missing/invalid."""
+    if not value:
+        return -1
+    try:
+        return date.fromisoformat(str(value)[:10]).toordinal()
+    except ValueError:
+        return -1
+
+
+def _number(value):
+    try:
+        return float(value) if value is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class BookingColumns:
+    """Bookings as parallel arrays, one element per booking."""
+
+    def __init__(self, rows):
+        n = len(rows)
+        self.homestay_id = np.fromiter((int(r.get('homestay_id') or 0) for r in rows), dtype=np.int64, count=n)
+        self.start = np.fromiter((_ordinal(r.get('from_date')) for r in rows), dtype=np.int64, count=n)
+        self.end = np.fromiter((_ordinal(r.get('till_date')) for r in rows), dtype=np.int64, count=n)
+        self.created = np.fromiter((_ordinal(r.get('created_at')) for r in rows), dtype=np.int64, count=n)
+        self.beds = np.fromiter((int(r.get('beds_booked') or 1) for r in rows), dtype=np.int64, count=n)
+        self.amount = np.fromiter((_number(r.get('total_amount')) for r in rows), dtype=np.float64, count=n)
+        self.status = np.fromiter((STATUS_CODES.get(r.get('status'), 0) for r in rows), dtype=np.int64, count=n)
+
+    def __len__(self):
+        return len(self.start)
+
+    def status_mask(self, statuses):
+        codes = [STATUS_CODES[s] for s in statuses]
+        valid = (self.start >= 0) & (self.end > self.start)
+        return valid & np.isin(self.status, codes)
+
+
+def load_booking_columns(store, page_size=2000, include_history=False):
+    """Read every booking (and archived one, with ``include_history``) in keyset pages as columns."""
+    rows = []
+    for page in archive.iter_pages(store, page_size, include_history=include_history):
+        rows.extend(page)
+    return BookingColumns(rows)
+
+
+def _nightly_series(cols, mask, homestay_index, window_start, days, weights):
+    """Sum ``weights`` over every night each masked booking covers, per homestay.
+
+    Returns an array of shape (homestays, days).
+    """
+    series = np.zeros((len(homestay_index), days + 1), dtype=np.float64)
+    if not len(homestay_index):
+        return series[:, :days]
+    ids = cols.homestay_id[mask]
+    rows = np.searchsorted(homestay_index, ids)
+    known = (rows < len(homestay_index)) & (homestay_index[np.minimum(rows, len(homestay_index) - 1)] == ids)
+    start = np.clip(cols.start[mask] - window_start, 0, days)
+    end = np.clip(cols.end[mask] - window_start, 0, days)
+    overlaps = known & (end > start)
+    w = weights[mask][overlaps]
+    np.add.at(series, (rows[overlaps], start[overlaps]), w)
+    np.add.at(series, (rows[overlaps], end[overlaps]), -w)
+    return np.cumsum(series, axis=1)[:, :days]
+
+
+def compute_analytics(cols, homestays, window_start, window_end):
+    """All admin metrics for nights in [window_start, window_end)."""
+    days = (window_end - window_start).days
+    start_ord = window_start.toordinal()
+    homestays = sorted(homestays, key=lambda h: h['id'])
+    homestay_index = np.array([h['id'] for h in homestays], dtype=np.int64)
+    capacity = np.array([int(h.get('beds') or 0) for h in homestays], dtype=np.float64)
+
+    occupying = cols.status_mask(OCCUPYING_STATUSES)
+    earning = cols.status_mask(REVENUE_STATUSES)
+    nights = np.maximum(cols.end - cols.start, 1)
+
+    occupied = _nightly_series(cols, occupying, homestay_index, start_ord, days, cols.beds.astype(np.float64))
+    revenue = _nightly_series(cols, earning, homestay_index, start_ord, days, cols.amount / nights)
+
+    bed_nights = capacity * days
+    occupied_totals = occupied.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        occupancy_rate = np.where(bed_nights > 0, occupied_totals / bed_nights, 0.0)
+        nightly_rate = np.where(capacity[:, None] > 0, occupied / capacity[:, None], 0.0)
+
+    # Revenue by check-in month across all history
+    months = {}
+    if earning.any():
+        days_since_epoch = (cols.start[earning] - EPOCH_ORDINAL).astype('datetime64[D]')
+        keys = days_since_epoch.astype('datetime64[M]').astype(np.int64)
+        base = keys.min()
+        totals = np.bincount(keys - base, weights=cols.amount[earning])
+        counts = np.bincount(keys - base)
+        for offset in np.nonzero(counts)[0]:
+            month = np.datetime64(int(base + offset), 'M')
+            months[str(month)] = {
+                'revenue': round(float(totals[offset]), 2),
+                'bookings': int(counts[offset]),
+            }
+
+    lead = (cols.start - cols.created)[occupying & (cols.created >= 0)]
+    night_labels = [(window_start + timedelta(days=i)).isoformat() for i in range(days)]
+    per_homestay = []
+    for row, homestay_id in enumerate(homestay_index.tolist()):
+        per_homestay.append({
+            'homestay_id': homestay_id,
+            'beds': int(capacity[row]),
+            'occupancy_rate': round(float(occupancy_rate[row]), 4),
+            'occupied_bed_nights': int(occupied_totals[row]),
+            'revenue': round(float(revenue[row].sum()), 2),
+            'nightly_occupancy': [round(float(v), 4) for v in nightly_rate[row]],
+            'nightly_revenue': [round(float(v), 2) for v in revenue[row]],
+        })
+
+    total_bed_nights = float(bed_nights.sum())
+    return {
+        'window': {'from': window_start.isoformat(), 'to': window_end.isoformat(), 'nights': night_labels},
+        'summary': {
+            'bookings': int(len(cols)),
+            'occupancy_rate': round(float(occupied_totals.sum() / total_bed_nights), 4) if total_bed_nights else 0.0,
+            'revenue': round(float(revenue.sum()), 2),
+            'average_stay_nights': round(float(nights[occupying].mean()), 2) if occupying.any() else None,
+            'average_lead_time_days': round(float(lead.mean()), 2) if lead.size else None,
+        },
+        'homestays': per_homestay,
+        'revenue_by_month': months,
+    }
+
+
+class AnalyticsCache:
+    """Results per window, cleared on booking/homestay writes or after ``ttl`` seconds."""
+
+    def __init__(self, ttl=CACHE_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, *_):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def get_or_compute(self, key, compute):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[0] < self.ttl:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            version = self.version
+        result = compute()
+        with self._lock:
+            # Only keep it if nothing changed while it was being computed
+            if version == self.version:
+                self._entries[key] = (now, result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'version': self.version, 'hits': self.hits, 'misses': self.misses}
+
+
+cache = AnalyticsCache()
+
+
+def on_store_change(table, operation, rows, args):
+    if table in ('bookings', 'homestays'):
+        cache.invalidate()
+
+
+def get_analytics(store, window_start, window_end, include_history=False):
+    """Cached analytics for the window; recomputed after any booking change.
+
+    Archived bookings are only read with ``include_history``, for windows
+    reaching back past the archival cutoff.
+    """
+    if (window_end - window_start).days <= 0 or (window_end - window_start).days > MAX_WINDOW_DAYS:
+        raise ValueError(f"window must be between 1 and {MAX_WINDOW_DAYS} nights")
+
+    def compute():
+        cols = load_booking_columns(store, include_history=include_history)
+        return compute_analytics(cols, store.homestays.list_all(), window_start, window_end)
+    return cache.get_or_compute((window_start, window_end, include_history), compute)
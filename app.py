@@ -1,11 +1,40 @@
 
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, Response, stream_with_context
 from flask_mail import Mail, Message
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.http import is_resource_modified
 from datetime import datetime, timedelta, timezone
 from functools import wraps
+import inspect
 from supabase import create_client, Client
+from supabase.lib.client_options import SyncClientOptions
+from datastore import create_datastore
+from async_store import AsyncDataStore, IO_THREADS
+from prefetch import Prefetch
+from scheduler import schedule, tasks
+from reconciliation import reconcile_payments, stats as reconciliation_stats
+from sweeper import expire_stale_bookings, stats as sweeper_stats
+import metrics
+import logs
+import exports
+import analytics
+import pricing
+import idempotency
+import resilience
+import http_transport
+from singleflight import SingleFlight
+import l2cache
+import ratelimit
+import compression
+import calendar_feed
+import archive
+import allocation
+import events
+import ical_import
+import profiling
+from idempotency import idempotent
 from dotenv import load_dotenv
 import os
 import qrcode
@@ -16,6 +45,7 @@ import requests
 import hmac
 import hashlib
 import json
+import logging
 # --- UPI Payment Confirmation Route ---
 from markupsafe import Markup
 
@@ -51,12 +81,18 @@ def generate_qr_code(data, booking_id):
     # Return relative URL for browser
     return f"/static/qr/{filename}"
 
-# In-memory store for UTRs (for demo)
-utr_store = {}
-
 # Load environment variables
 load_dotenv()
 
+# Structured logging (see logs.py), e.g. LOG_LEVELS=datastore=DEBUG,werkzeug=WARNING
+logs.configure(
+    level=os.getenv('LOG_LEVEL', 'INFO'),
+    module_levels=logs.parse_levels(os.getenv('LOG_LEVELS', '')),
+    fmt=os.getenv('LOG_FORMAT', 'json').lower(),
+    debug_sample_rate=float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '1')),
+)
+log = logging.getLogger(__name__)
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-change-this-in-production')
 
@@ -64,12 +100,14 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-change-this-
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=1)
 app.config['SESSION_REFRESH_EACH_REQUEST'] = True  # Refresh session on each request (rolling timeout)
 
+# Data backend: 'supabase' (default) or 'sqlite' for local/offline runs
+app.config['DATA_BACKEND'] = os.getenv('DATA_BACKEND', 'supabase').lower()
+app.config['SQLITE_PATH'] = os.getenv('SQLITE_PATH', 'kangundi_local.db')
+
 # Initialize Supabase client
 supabase_url = os.getenv('SUPABASE_URL')
 supabase_key = os.getenv('SUPABASE_KEY')
 
-supabase: Client = create_client(supabase_url, supabase_key)
-
 # Cashfree configuration
 CASHFREE_APP_ID = os.getenv('CASHFREE_APP_ID', '')
 CASHFREE_SECRET_KEY = os.getenv('CASHFREE_SECRET_KEY', '')
@@ -77,7 +115,193 @@ CASHFREE_BASE_URL = os.getenv('CASHFREE_BASE_URL', 'https://sandbox.cashfree.com
 
 # Service-role client for trusted writes (never expose key to frontend)
 SUPABASE_SERVICE_ROLE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY', '')
-supabase_sr: Client = create_client(supabase_url, SUPABASE_SERVICE_ROLE_KEY) if SUPABASE_SERVICE_ROLE_KEY else supabase
+
+# Resilience of data-store calls (see resilience.py); STORE_RESILIENCE=auto protects Supabase only
+app.config['STORE_RESILIENCE'] = os.getenv('STORE_RESILIENCE', 'auto').lower()
+app.config['STORE_READ_TIMEOUT'] = float(os.getenv('STORE_READ_TIMEOUT', '5'))
+app.config['STORE_WRITE_TIMEOUT'] = float(os.getenv('STORE_WRITE_TIMEOUT', '10'))
+app.config['BREAKER_FAILURE_THRESHOLD'] = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+app.config['BREAKER_RESET_SECONDS'] = float(os.getenv('BREAKER_RESET_SECONDS', '30'))
+app.config['STALE_MAX_AGE_SECONDS'] = float(os.getenv('STALE_MAX_AGE_SECONDS', '3600'))
+# HTTP timeout of the Supabase clients; bounds calls abandoned by the resilience layer
+app.config['SUPABASE_HTTP_TIMEOUT'] = float(os.getenv('SUPABASE_HTTP_TIMEOUT', '20'))
+# Connection pool shared by both Supabase clients (see http_transport.py); by default one
+# connection per thread that can query at once (WEB_THREADS request threads + IO_THREADS)
+app.config['WEB_THREADS'] = int(os.getenv('WEB_THREADS', '8'))
+app.config['SUPABASE_POOL_SIZE'] = int(os.getenv(
+    'SUPABASE_POOL_SIZE', str(http_transport.pool_size(app.config['WEB_THREADS'], IO_THREADS))))
+app.config['SUPABASE_KEEPALIVE_SECONDS'] = float(os.getenv('SUPABASE_KEEPALIVE_SECONDS', str(http_transport.KEEPALIVE_SECONDS)))
+app.config['SUPABASE_HTTP2'] = os.getenv('SUPABASE_HTTP2', '1').lower() in ('1', 'true', 'on')
+app.config['SUPABASE_CONNECT_TIMEOUT'] = float(os.getenv('SUPABASE_CONNECT_TIMEOUT', str(http_transport.CONNECT_TIMEOUT)))
+app.config['SUPABASE_POOL_TIMEOUT'] = float(os.getenv('SUPABASE_POOL_TIMEOUT', str(http_transport.POOL_TIMEOUT)))
+
+if app.config['DATA_BACKEND'] == 'supabase':
+    supabase_transport = http_transport.PooledTransport(
+        max_connections=app.config['SUPABASE_POOL_SIZE'],
+        keepalive_expiry=app.config['SUPABASE_KEEPALIVE_SECONDS'],
+        http2=app.config['SUPABASE_HTTP2'],
+    )
+    # One httpx.Client per Supabase client: postgrest writes each client's apikey and
+    # Authorization into the headers of the httpx.Client it is given, so only the
+    # transport (the connection pool) is shared
+    def supabase_options():
+        return SyncClientOptions(httpx_client=http_transport.create_http_client(
+            supabase_transport,
+            timeout=app.config['SUPABASE_HTTP_TIMEOUT'],
+            connect_timeout=app.config['SUPABASE_CONNECT_TIMEOUT'],
+            pool_timeout=app.config['SUPABASE_POOL_TIMEOUT'],
+        ))
+    supabase: Client = create_client(supabase_url, supabase_key, options=supabase_options())
+    supabase_sr: Client = (
+        create_client(supabase_url, SUPABASE_SERVICE_ROLE_KEY, options=supabase_options())
+        if SUPABASE_SERVICE_ROLE_KEY else supabase
+    )
+else:
+    supabase = None
+    supabase_sr = None
+    supabase_transport = None
+
+# Nightly rates per homestay; quotes every stay (follows ``store`` if it is replaced)
+pricing_engine = pricing.PricingEngine(lambda: store)
+# Concrete beds for each booking (allocation.py)
+bed_allocator = allocation.BedAllocator(lambda: store)
+
+# Shared read cache (see l2cache.py): redis://..., sqlite:///path or memory://; unset disables it
+app.config['CACHE_URL'] = os.getenv('CACHE_URL', '')
+app.config['CACHE_TTL_SECONDS'] = int(os.getenv('CACHE_TTL_SECONDS', str(l2cache.DEFAULT_TTL)))
+shared_cache = (
+    l2cache.SharedCache(l2cache.create_backend(app.config['CACHE_URL']), ttl=app.config['CACHE_TTL_SECONDS'])
+    if app.config['CACHE_URL'] else None
+)
+
+# Identical reads in flight at the same time share one query
+app.config['SINGLE_FLIGHT'] = os.getenv('SINGLE_FLIGHT', '1').lower() in ('1', 'true', 'on')
+read_coalescer = SingleFlight()
+
+store_resilience = resilience.Resilience(
+    read_timeout=app.config['STORE_READ_TIMEOUT'],
+    write_timeout=app.config['STORE_WRITE_TIMEOUT'],
+    failure_threshold=app.config['BREAKER_FAILURE_THRESHOLD'],
+    reset_seconds=app.config['BREAKER_RESET_SECONDS'],
+    stale_max_age=app.config['STALE_MAX_AGE_SECONDS'],
+)
+
+# Called after every write to the store (cache invalidation etc.)
+STORE_LISTENERS = [analytics.on_store_change, pricing_engine.on_store_change, calendar_feed.cache.on_store_change,
+                   ical_import.holds.on_store_change, bed_allocator.on_store_change, events.bus.on_store_change]
+
+
+def use_store(new_store):
+    """Make ``new_store`` the repository layer of the app and attach the change listeners."""
+    global store
+    for listener in STORE_LISTENERS:
+        new_store.on_change(listener)
+    mode = app.config['STORE_RESILIENCE']
+    if mode in ('1', 'true', 'on') or (mode == 'auto' and new_store.backend == 'supabase'):
+        store_resilience.protect(new_store)
+    if app.config['SINGLE_FLIGHT']:
+        read_coalescer.coalesce(new_store)
+    if shared_cache is not None:
+        # Outermost: hits skip coalescing and the breaker; writes bump the shared versions
+        shared_cache.attach(new_store)
+        new_store.on_change(shared_cache.on_store_change)
+    store = new_store
+
+
+# Repository layer used by all routes
+use_store(create_datastore(
+    app.config['DATA_BACKEND'],
+    supabase_client=supabase,
+    supabase_service_client=supabase_sr,
+    sqlite_path=app.config['SQLITE_PATH'],
+))
+# Async facade for ``async def`` views; follows ``store`` if it is replaced
+astore = AsyncDataStore(lambda: store)
+
+# Payment-to-booking reconciliation (0 disables the background worker)
+app.config['RECONCILE_INTERVAL_SECONDS'] = int(os.getenv('RECONCILE_INTERVAL_SECONDS', '60'))
+app.config['RECONCILE_BATCH_SIZE'] = int(os.getenv('RECONCILE_BATCH_SIZE', '100'))
+app.config['RECONCILE_MAX_BATCHES'] = int(os.getenv('RECONCILE_MAX_BATCHES', '10'))
+# Payments with no booking are dropped from the scan after this long
+app.config['RECONCILE_UNMATCHED_GRACE_SECONDS'] = int(os.getenv('RECONCILE_UNMATCHED_GRACE_SECONDS', str(48 * 3600)))
+
+# Expiry of abandoned pending bookings (0 disables the background worker)
+app.config['PENDING_TTL_SECONDS'] = int(os.getenv('PENDING_TTL_SECONDS', str(24 * 3600)))
+app.config['SWEEP_INTERVAL_SECONDS'] = int(os.getenv('SWEEP_INTERVAL_SECONDS', '600'))
+app.config['SWEEP_BATCH_SIZE'] = int(os.getenv('SWEEP_BATCH_SIZE', '200'))
+app.config['SWEEP_MAX_BATCHES'] = int(os.getenv('SWEEP_MAX_BATCHES', '20'))
+
+# Archival of settled stays that ended ARCHIVE_AFTER_DAYS ago (0 disables the background worker)
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.getenv('ARCHIVE_AFTER_DAYS', str(archive.AFTER_DAYS)))
+app.config['ARCHIVE_INTERVAL_SECONDS'] = int(os.getenv('ARCHIVE_INTERVAL_SECONDS', str(24 * 3600)))
+app.config['ARCHIVE_BATCH_SIZE'] = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))
+app.config['ARCHIVE_MAX_BATCHES'] = int(os.getenv('ARCHIVE_MAX_BATCHES', '20'))
+
+# Admin analytics: cached results also expire after this many seconds (other workers' writes)
+analytics.cache.ttl = int(os.getenv('ANALYTICS_CACHE_SECONDS', str(analytics.CACHE_SECONDS)))
+# Rate calendars are rebuilt at least this often so rule changes on other workers show up
+pricing_engine.ttl = int(os.getenv('PRICING_CACHE_SECONDS', str(pricing.CACHE_SECONDS)))
+# iCalendar feeds: rebuilt at least this often; with CALENDAR_FEED_TOKEN set, feeds need ?token=
+calendar_feed.cache.ttl = int(os.getenv('CALENDAR_CACHE_SECONDS', str(calendar_feed.CACHE_SECONDS)))
+app.config['CALENDAR_FEED_TOKEN'] = os.getenv('CALENDAR_FEED_TOKEN', '')
+# Import of other platforms' iCalendar feeds as holds (0 disables the background worker);
+# file sources must be inside CALENDAR_IMPORT_DIR
+app.config['CALENDAR_SYNC_INTERVAL_SECONDS'] = int(os.getenv('CALENDAR_SYNC_INTERVAL_SECONDS', '900'))
+app.config['CALENDAR_IMPORT_DIR'] = os.getenv('CALENDAR_IMPORT_DIR', '')
+ical_import.holds.ttl = int(os.getenv('CALENDAR_HOLDS_CACHE_SECONDS', str(ical_import.INDEX_SECONDS)))
+# Bed assignments: the index is rebuilt from bookings at startup and this often
+# (0 disables the job; each homestay's index is still built when first needed)
+app.config['BED_INDEX_REBUILD_SECONDS'] = int(os.getenv('BED_INDEX_REBUILD_SECONDS', '3600'))
+# Live dashboard updates: each open dashboard holds one request thread, so the clients are capped
+events.bus.max_clients = int(os.getenv('EVENTS_MAX_CLIENTS', str(events.MAX_CLIENTS)))
+events.bus.max_queue = int(os.getenv('EVENTS_QUEUE_SIZE', str(events.MAX_QUEUE)))
+MAX_QUOTES_PER_REQUEST = 500
+
+# Token-bucket limits on the auth endpoints (see ratelimit.POLICIES); buckets in
+# memory://, sqlite:///path or redis://... (shared by every worker)
+app.config['RATE_LIMITS'] = os.getenv('RATE_LIMITS', '1').lower() in ('1', 'true', 'on')
+app.config['RATE_LIMIT_STORAGE'] = os.getenv('RATE_LIMIT_STORAGE', 'memory://')
+# Number of reverse proxies in front of the app whose X-Forwarded-For can be trusted
+app.config['TRUSTED_PROXIES'] = int(os.getenv('TRUSTED_PROXIES', '0'))
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+rate_limiter = ratelimit.RateLimiter(
+    ratelimit.create_buckets(app.config['RATE_LIMIT_STORAGE']),
+    enabled=app.config['RATE_LIMITS'],
+)
+
+# gzip/brotli for HTML and JSON responses of at least COMPRESS_MIN_BYTES (see compression.py)
+app.config['COMPRESS'] = os.getenv('COMPRESS', '1').lower() in ('1', 'true', 'on')
+app.config['COMPRESS_MIN_BYTES'] = int(os.getenv('COMPRESS_MIN_BYTES', str(compression.MIN_BYTES)))
+app.config['COMPRESS_LEVEL'] = int(os.getenv('COMPRESS_LEVEL', str(compression.GZIP_LEVEL)))
+app.config['BROTLI_QUALITY'] = int(os.getenv('BROTLI_QUALITY', str(compression.BROTLI_QUALITY)))
+# Strip template indentation once per template when it is loaded
+app.config['MINIFY_HTML'] = os.getenv('MINIFY_HTML', '0').lower() in ('1', 'true', 'on')
+compressor = compression.Compressor(
+    min_bytes=app.config['COMPRESS_MIN_BYTES'],
+    gzip_level=app.config['COMPRESS_LEVEL'],
+    brotli_quality=app.config['BROTLI_QUALITY'],
+)
+if app.config['COMPRESS']:
+    compressor.init_app(app)
+template_minifier = None
+if app.config['MINIFY_HTML']:
+    template_minifier = compression.MinifyingLoader(app.jinja_env.loader)
+    app.jinja_env.loader = template_minifier
+
+# Admin request profiling (X-Profile: 1 or ?_profile=1) and PROFILE_SAMPLE_PERCENT of all
+# requests; PROFILING is only the initial state, admins switch it at runtime (see profiling.py)
+app.config['PROFILING'] = os.getenv('PROFILING', '0').lower() in ('1', 'true', 'on')
+app.config['PROFILE_SAMPLE_PERCENT'] = float(os.getenv('PROFILE_SAMPLE_PERCENT', '0'))
+app.config['PROFILE_INTERVAL_MS'] = float(os.getenv('PROFILE_INTERVAL_MS', str(profiling.INTERVAL_SECONDS * 1000)))
+app.config['PROFILE_KEEP'] = int(os.getenv('PROFILE_KEEP', str(profiling.KEEP)))
+profiler = profiling.Profiler(
+    sample_percent=app.config['PROFILE_SAMPLE_PERCENT'],
+    interval=app.config['PROFILE_INTERVAL_MS'] / 1000,
+    keep=app.config['PROFILE_KEEP'],
+    enabled=app.config['PROFILING'],
+).init_app(app)
+memory_tracker = profiling.MemoryTracker()
 
 
 
@@ -97,12 +321,9 @@ mail = Mail(app)
 def get_user_by_email(email):
     """Get user by email"""
     try:
-        response = supabase.table('users').select('*').eq('email', email).execute()
-        if response.data and len(response.data) > 0:
-            return response.data[0]
-        return None
-    except Exception as e:
-        print(f"Error getting user by email: {e}")
+        return store.users.get_by_email(email)
+    except Exception:
+        log.exception("Error getting user by email")
     # Make get_or_create_payment_id available in Jinja templates (must be after function definition)
     app.jinja_env.globals['get_or_create_payment_id'] = get_or_create_payment_id
 
@@ -111,12 +332,9 @@ def get_user_by_email(email):
 def get_user_by_username(username):
     """Get user by username"""
     try:
-        response = supabase.table('users').select('*').eq('username', username).execute()
-        if response.data and len(response.data) > 0:
-            return response.data[0]
-        return None
-    except Exception as e:
-        print(f"Error getting user by username: {e}")
+        return store.users.get_by_username(username)
+    except Exception:
+        log.exception("Error getting user by username")
         return None
 
 
@@ -125,16 +343,15 @@ def create_user(name, email, username=None, password_hash=None, is_admin=False):
     try:
         username_to_save = username or email  # keep unique/required column satisfied
         password_hash_to_save = password_hash or ''  # some schemas require non-null
-        response = supabase.table('users').insert({
+        return store.users.create({
             'name': name,
             'email': email,
             'username': username_to_save,
             'password_hash': password_hash_to_save,
             'is_admin': is_admin
-        }).execute()
-        return response.data[0] if response.data else None
-    except Exception as e:
-        print(f"Error creating user: {e}")
+        })
+    except Exception:
+        log.exception("Error creating user")
         return None
 
 def generate_otp():
@@ -150,69 +367,121 @@ def send_otp_via_email(email, otp):
         body = f"Your OTP for login/signup is: {otp}\n\nIf you did not request this, please ignore."
         msg = Message(subject=subject, recipients=[email], body=body)
         mail.send(msg)
-        print(f"Sent OTP {otp} to email: {email}")
+        log.info("Sent OTP to %s", email)
         return True
-    except Exception as e:
-        print(f"Error sending OTP via email: {e}")
+    except Exception:
+        log.exception("Error sending OTP via email")
         return False
 
 
 def get_homestay_by_id(homestay_id):
     """Fetch a single homestay by id."""
     try:
-        response = supabase.table('homestays').select('*').eq('id', homestay_id).execute()
-        if response.data:
-            return response.data[0]
-        return None
-    except Exception as e:
-        print(f"Error fetching homestay by id: {e}")
+        return store.homestays.get(homestay_id)
+    except Exception:
+        log.exception("Error fetching homestay by id")
         return None
 
 
 def create_booking(booking_data):
     """Insert a booking record; returns inserted booking or None on failure."""
     try:
-        response = supabase.table('bookings').insert(booking_data).execute()
-        return response.data[0] if response.data else None
-    except Exception as e:
-        error_msg = str(e)
-        print(f"Error creating booking: {e}")
-        
-        # If error is about missing column, try to find which column and retry without it
-        if "Could not find the" in error_msg and "column of 'bookings'" in error_msg:
-            # Extract column name from error message
-            import re
-            match = re.search(r"Could not find the '(\w+)' column", error_msg)
-            if match:
-                missing_col = match.group(1)
-                print(f"⚠️  Column '{missing_col}' not found in bookings table.")
-                print(f"   Please add it to Supabase or the field will be skipped.")
-                
-                # Remove the problematic column and retry
-                if missing_col in booking_data:
-                    booking_data_filtered = {k: v for k, v in booking_data.items() if k != missing_col}
-                    try:
-                        response = supabase.table('bookings').insert(booking_data_filtered).execute()
-                        return response.data[0] if response.data else None
-                    except Exception as e2:
-                        print(f"Error creating booking (retry): {e2}")
-                        return None
-        
+        return store.bookings.create(booking_data)
+    except Exception:
+        log.exception("Error creating booking")
+        return None
+
+
+def stage_order_booking(pending):
+    """Save the booking in progress as ``pending`` so a Cashfree order can be linked to it.
+
+    Returns the new booking, or None if its beds are no longer free for
+    every night. Raises if it cannot be saved.
+    """
+    beds_booked = int(pending.get('beds_requested') or pending.get('beds') or 1)
+    placement = bed_placement(pending['homestay_id'], pending['from_date'], pending['till_date'], beds_booked)
+    if placement and not placement['fits']:
         return None
+    return store.bookings.create({
+        'homestay_id': pending['homestay_id'],
+        'from_date': pending['from_date'],
+        'till_date': pending['till_date'],
+        'nights': pending['nights'],
+        'beds_booked': beds_booked,
+        'total_amount': pending['total_amount'],
+        'status': 'pending',
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'user_id': session.get('user_id'),
+        'user_phone': session.get('phone_number'),
+        'user_email': session.get('email'),
+        'user_name': session.get('name', 'User'),
+    })
 
 
 def get_booking_by_id(booking_id):
     """Fetch booking by id."""
     try:
-        response = supabase.table('bookings').select('*').eq('id', booking_id).execute()
-        if response.data:
-            return response.data[0]
-        return None
-    except Exception as e:
-        print(f"Error fetching booking: {e}")
+        return store.bookings.get(booking_id)
+    except Exception:
+        log.exception("Error fetching booking")
         return None
 
 
+def normalize_utr(utr):
+    """Canonical form of a UPI reference so spacing/case variants match."""
+    return ''.join(utr.split()).upper()
+
+
+def record_payment_reference(kind, reference, booking_id):
+    """Index a UTR or screenshot hash for a booking; returns other bookings already using it."""
+    try:
+        duplicates = store.payment_refs.register(kind, reference, booking_id, datetime.now(timezone.utc).isoformat())
+        if duplicates:
+            log.warning("Duplicate %s %s on booking %s; already used by %s", kind, reference, booking_id, duplicates)
+        return duplicates
+    except Exception:
+        log.exception("Error recording payment reference")
+        return []
+
+
+def find_duplicate_references(booking_ids):
+    """Map booking id -> other booking ids sharing any UTR or screenshot with it (two queries)."""
+    own = store.payment_refs.list_for_bookings(booking_ids)
+    if not own:
+        return {}
+    holders = {}
+    for kind in {row['kind'] for row in own}:
+        refs = [row['reference'] for row in own if row['kind'] == kind]
+        for reference, rows in store.payment_refs.lookup_many(kind, refs).items():
+            holders[(kind, reference)] = {row['booking_id'] for row in rows}
+    duplicates = {}
+    for row in own:
+        others = holders.get((row['kind'], row['reference']), set()) - {row['booking_id']}
+        if others:
+            duplicates.setdefault(row['booking_id'], set()).update(others)
+    return {booking_id: sorted(others) for booking_id, others in duplicates.items()}
+
+
+def attach_homestay_summaries(bookings_data, homestays=None):
+    """Attach a short homestay summary to each booking.
+
+    ``homestays`` is an optional prefetched ``{id: homestay}`` map; otherwise
+    all referenced homestays are fetched in one query.
+    """
+    if homestays is None:
+        homestays = store.homestays.get_many(b.get('homestay_id') for b in bookings_data)
+    for booking in bookings_data:
+        homestay = homestays.get(booking.get('homestay_id'))
+        if homestay:
+            booking['homestay'] = {
+                'owner': homestay.get('owner'),
+                'rooms': homestay.get('rooms'),
+                'beds': homestay.get('beds'),
+                'price': homestay.get('price'),
+                'contact': homestay.get('contact')
+            }
+
+
 def compute_nights(from_date_str, till_date_str):
     """Return positive night count or None if invalid."""
     try:
@@ -221,7 +490,7 @@ def compute_nights(from_date_str, till_date_str):
     except Exception:
         return None
     delta = int((end - start).days)
-    print(f"DEBUG compute_nights: from={from_date_str}, till={till_date_str}, delta={delta} (type: {type(delta).__name__})")
+    log.debug("compute_nights from=%s till=%s nights=%s", from_date_str, till_date_str, delta)
     return delta if delta > 0 else None
 
 
@@ -281,20 +550,50 @@ def verify_cashfree_signature(raw_body: str, signature: str) -> bool:
     ).hexdigest()
     return hmac.compare_digest(computed, signature)
 
+def external_held_beds(homestay_id, from_date, till_date):
+    """Beds blocked by imported bookings from other platforms (see ``ical_import.py``)."""
+    try:
+        return ical_import.holds.booked_beds(store, homestay_id, from_date, till_date)
+    except Exception:
+        log.exception("Error loading external holds")
+        return 0
+
+def bed_placement(homestay_id, from_date, till_date, beds):
+    """Whether a party can keep the same beds every night (see ``allocation.py``); None if unknown."""
+    try:
+        return bed_allocator.can_stay_together(homestay_id, from_date, till_date, beds)
+    except Exception:
+        log.exception("Error checking bed placement")
+        return None
+
+def quote_stay(homestay_id, from_date, till_date, beds=1, homestay=None):
+    """Price a stay; falls back to the homestay's base price if pricing rules cannot be loaded."""
+    try:
+        return pricing_engine.quote(homestay_id, from_date, till_date, beds)
+    except pricing.PricingError:
+        raise
+    except Exception:
+        log.exception("Error loading pricing rules; using the base price")
+    if homestay is None:
+        homestay = get_homestay_by_id(homestay_id) or {}
+    return pricing.flat_quote(homestay_id, homestay.get('price'), from_date, till_date, beds)
+
 def get_booked_beds_for_date_range(homestay_id, from_date_str, till_date_str):
     """Get total number of booked beds for a date range, counting beds booked in overlapping bookings."""
     try:
         from_date = datetime.fromisoformat(from_date_str).date()
         till_date = datetime.fromisoformat(till_date_str).date()
         
-        # Get all approved or pending bookings for this homestay
-        response = supabase.table('bookings').select('*').eq('homestay_id', homestay_id).in_('status', ['approved', 'pending']).execute()
+        # Get approved or pending bookings for this homestay that overlap the range
+        overlapping = store.bookings.list_active_for_homestay(
+            homestay_id, ['approved', 'pending'], from_date.isoformat(), till_date.isoformat()
+        )
         
-        if not response.data:
-            return 0
+        if not overlapping:
+            return external_held_beds(homestay_id, from_date, till_date)
         
         total_booked_beds = 0
-        for booking in response.data:
+        for booking in overlapping:
             try:
                 booking_from = datetime.fromisoformat(booking['from_date']).date()
                 booking_till = datetime.fromisoformat(booking['till_date']).date()
@@ -306,9 +605,9 @@ def get_booked_beds_for_date_range(homestay_id, from_date_str, till_date_str):
             except Exception:
                 continue
         
-        return total_booked_beds
-    except Exception as e:
-        print(f"Error calculating booked beds: {e}")
+        return total_booked_beds + external_held_beds(homestay_id, from_date, till_date)
+    except Exception:
+        log.exception("Error calculating booked beds")
         return 0
 
 def get_available_beds_for_dates(homestay_id, from_date_str, till_date_str):
@@ -323,8 +622,8 @@ def get_available_beds_for_dates(homestay_id, from_date_str, till_date_str):
         available = max(0, total_beds - booked_beds)
         
         return available
-    except Exception as e:
-        print(f"Error getting available beds: {e}")
+    except Exception:
+        log.exception("Error getting available beds")
         return 0
 
 def get_availability_status(homestay_id, days=7):
@@ -355,24 +654,41 @@ def get_availability_status(homestay_id, days=7):
             }
         
         return availability
-    except Exception as e:
-        print(f"Error getting availability status: {e}")
+    except Exception:
+        log.exception("Error getting availability status")
         return {}
 
-def login_required(f):
-    """Decorator to protect routes"""
+def guard_view(f, check):
+    """Wrap a sync or async view so ``check()`` runs first; a non-None result is returned instead."""
+    if inspect.iscoroutinefunction(f):
+        @wraps(f)
+        async def async_decorated_function(*args, **kwargs):
+            denied = check()
+            if denied is not None:
+                return denied
+            return await f(*args, **kwargs)
+        return async_decorated_function
+
     @wraps(f)
     def decorated_function(*args, **kwargs):
+        denied = check()
+        if denied is not None:
+            return denied
+        return f(*args, **kwargs)
+    return decorated_function
+
+def login_required(f):
+    """Decorator to protect routes"""
+    def check():
         if 'user_id' not in session:
             flash('Please log in to access this page.', 'error')
             return redirect(url_for('login'))
-        return f(*args, **kwargs)
-    return decorated_function
+        return None
+    return guard_view(f, check)
 
 def admin_required(f):
     """Decorator to protect admin routes"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
+    def check():
         if 'user_id' not in session:
             flash('Please log in to access this page.', 'error')
             return redirect(url_for('login'))
@@ -382,9 +698,8 @@ def admin_required(f):
         if not is_admin:
             flash('You do not have permission to access this page.', 'error')
             return redirect(url_for('home'))
-        
-        return f(*args, **kwargs)
-    return decorated_function
+        return None
+    return guard_view(f, check)
 
 # Routes
 @app.route('/')
@@ -451,6 +766,7 @@ def terms():
     return render_template('terms.html', last_updated=last_updated)
 
 @app.route('/signup', methods=['GET', 'POST'])
+@rate_limiter.limit('signup', template='signup.html')
 def signup():
     if 'user_id' in session:
         return redirect(url_for('home'))
@@ -476,15 +792,19 @@ def signup():
             return redirect(url_for('signup'))
 
         try:
+            # Look up email and phone number together
+            existing = Prefetch().add('email', store.users.get_by_email, email).add('phone', store.users.get_by_phone, phone_number).run()
+            for result in existing.values():
+                if isinstance(result, Exception):
+                    raise result
+
             # Check if user already exists in public.users table (email)
-            existing_email = supabase.table('users').select('*').eq('email', email).execute()
-            if existing_email.data:
+            if existing['email']:
                 flash('This email is already registered! Please login.', 'error')
                 return redirect(url_for('login'))
 
             # Check if user already exists in public.users table (phone number)
-            existing_phone = supabase.table('users').select('*').eq('phone_number', phone_number).execute()
-            if existing_phone.data:
+            if existing['phone']:
                 flash('This phone number is already registered! Please login or use a different number.', 'error')
                 return redirect(url_for('signup'))
 
@@ -505,13 +825,14 @@ def signup():
 
             return redirect(url_for('verify_signup_otp'))
 
-        except Exception as e:
-            print(f"Signup error: {e}")
+        except Exception:
+            log.exception("Signup error")
             flash(f'Signup error. Please try again.', 'error')
 
     return render_template('signup.html')
 
 @app.route('/verify-signup-otp', methods=['GET', 'POST'])
+@rate_limiter.limit('verify_signup_otp', template='verify_otp.html', page_type='signup')
 def verify_signup_otp():
     if 'signup_otp' not in session:
         flash('Please sign up first!', 'error')
@@ -525,15 +846,14 @@ def verify_signup_otp():
             phone_number = session.get('signup_phone')
             password_hash = session.get('signup_password_hash', '')
             try:
-                result = supabase.table('users').insert({
+                user = store.users.create({
                     'email': email,
                     'name': name,
                     'phone_number': phone_number,
                     'password_hash': password_hash,
                     'created_at': datetime.now(timezone.utc).isoformat()
-                }).execute()
-                if result.data:
-                    user = result.data[0]
+                })
+                if user:
                     session['user_id'] = user['id']
                     session['phone_number'] = phone_number
                     session['name'] = name
@@ -548,14 +868,15 @@ def verify_signup_otp():
                     if session.get('is_admin', False):
                         return redirect(url_for('admin_dashboard'))
                     return redirect(url_for('home'))
-            except Exception as e:
-                print(f"User creation error: {e}")
+            except Exception:
+                log.exception("User creation error")
                 flash('Error creating account. Please try again.', 'error')
         else:
             flash('Invalid OTP. Please try again.', 'error')
     return render_template('verify_otp.html', page_type='signup')
 
 @app.route('/login', methods=['GET', 'POST'])
+@rate_limiter.limit('login', template='login.html')
 def login():
     if 'user_id' in session:
         return redirect(url_for('home'))
@@ -623,6 +944,7 @@ def login():
 
 # Endpoint to request OTP for login
 @app.route('/request-login-otp', methods=['POST'])
+@rate_limiter.limit('request_login_otp')
 def request_login_otp():
     data = request.get_json()
     email = data.get('email', '').strip()
@@ -645,43 +967,83 @@ def request_login_otp():
 def rooms():
     """Display all available homestays"""
     try:
-        response = supabase.table('homestays').select('*').execute()
-        homestays_data = response.data if response.data else []
-    except Exception as e:
-        print(f"Error fetching homestays: {e}")
+        homestays_data = store.homestays.list_all()
+    except Exception:
+        log.exception("Error fetching homestays")
         flash('Error loading homestays. Please try again.', 'error')
         homestays_data = []
+
+    # Tonight's rate for every card, priced in one batch
+    today = datetime.now().date()
+    tonight = (today + timedelta(days=1)).isoformat()
+    try:
+        quotes = pricing_engine.quote_many([
+            {'homestay_id': h['id'], 'from_date': today.isoformat(), 'till_date': tonight} for h in homestays_data
+        ])
+        tonight_rates = {q['homestay_id']: q['total'] for q in quotes if 'total' in q}
+    except Exception:
+        log.exception("Error loading pricing rules; showing base prices")
+        tonight_rates = {h['id']: pricing.money(h.get('price') or pricing.DEFAULT_PRICE) for h in homestays_data}
     
     user_data = {
         'name': session.get('name', 'User'),
         'phone_number': session.get('phone_number', '')
     }
     
-    return render_template('rooms.html', homestays=homestays_data, user=user_data)
+    return render_template('rooms.html', homestays=homestays_data, user=user_data, tonight_rates=tonight_rates)
+
+@app.route('/homestay/<int:homestay_id>/calendar.ics')
+def homestay_calendar(homestay_id):
+    """Approved and pending bookings of a homestay as an iCalendar feed for other booking platforms."""
+    token = app.config['CALENDAR_FEED_TOKEN']
+    if token and not hmac.compare_digest(request.args.get('token', ''), token):
+        return {'error': 'invalid token'}, 403
+    try:
+        entry = calendar_feed.cache.get(store, homestay_id)
+    except Exception:
+        log.exception("Error building calendar feed for homestay %s", homestay_id)
+        return {'error': 'calendar unavailable'}, 503
+    if entry is None:
+        return {'error': 'homestay not found'}, 404
+
+    headers = {'ETag': f'"{entry.etag}"', 'Cache-Control': 'no-cache'}
+    if not is_resource_modified(request.environ, etag=entry.etag, last_modified=entry.last_modified):
+        calendar_feed.cache.record_not_modified()
+        response = Response(status=304, headers=headers)
+    elif entry.body is not None:
+        response = Response(entry.body, mimetype=calendar_feed.MIMETYPE, headers=headers)
+    else:
+        response = Response(calendar_feed.cache.stream(entry), mimetype=calendar_feed.MIMETYPE, headers=headers)
+    response.last_modified = entry.last_modified
+    return response
 
 @app.route('/homestay/<int:homestay_id>')
 @login_required
-def homestay_details(homestay_id):
+async def homestay_details(homestay_id):
     """Display details of a specific homestay"""
-    try:
-        response = supabase.table('homestays').select('*').eq('id', homestay_id).execute()
-        
-        if not response.data or len(response.data) == 0:
-            flash('Homestay not found!', 'error')
-            return redirect(url_for('rooms'))
-        
-        homestay = response.data[0]
-    except Exception as e:
-        print(f"Error fetching homestay: {e}")
+    # Fetch the homestay and its availability for the next 30 days concurrently
+    today = datetime.now().date()
+    homestay, availability, rates = await astore.gather(
+        astore.homestays.get(homestay_id),
+        astore.run(get_availability_status, homestay_id, 30),
+        astore.run(pricing_engine.nightly_rates, homestay_id, today, 30),
+    )
+    if isinstance(homestay, Exception):
+        log.error("Error fetching homestay", exc_info=homestay)
         flash('Error loading homestay details. Please try again.', 'error')
         return redirect(url_for('rooms'))
-    
-    # Get availability status for next 30 days
-    availability = get_availability_status(homestay_id, 30)
+    if not homestay:
+        flash('Homestay not found!', 'error')
+        return redirect(url_for('rooms'))
+    if isinstance(availability, Exception):
+        log.error("Error getting availability status", exc_info=availability)
+        availability = {}
+    if isinstance(rates, Exception):
+        log.error("Error getting nightly rates", exc_info=rates)
+        rates = {}
 
     # Build calendar-friendly structure (start today, 30 days)
     calendar_days = []
-    today = datetime.now().date()
     for i in range(30):
         day_date = today + timedelta(days=i)
         day_str = day_date.isoformat()
@@ -694,7 +1056,8 @@ def homestay_details(homestay_id):
             'available': day_info.get('available', 0),
             'total': day_info.get('total', 0),
             'is_fully_booked': day_info.get('is_fully_booked', False),
-            'booked': day_info.get('booked', 0)
+            'booked': day_info.get('booked', 0),
+            'price': rates.get(day_str),
         })
 
     calendar_meta = {
@@ -721,38 +1084,60 @@ def homestay_details(homestay_id):
 @login_required
 def book_homestay(homestay_id):
     """Capture stay dates and stage a booking before payment."""
-    homestay = get_homestay_by_id(homestay_id)
-    if not homestay:
+    # Fetch the homestay together with the availability data this request needs
+    batch = Prefetch().add('homestay', get_homestay_by_id, homestay_id)
+    if request.method == 'POST':
+        from_date = request.form.get('from_date')
+        till_date = request.form.get('till_date')
+        nights = compute_nights(from_date, till_date) if from_date and till_date else None
+        if nights:
+            batch.add('booked_beds', get_booked_beds_for_date_range, homestay_id, from_date, till_date)
+    else:
+        batch.add('availability', get_availability_status, homestay_id, 30)
+    prefetched = batch.run()
+
+    homestay = prefetched['homestay']
+    if not homestay or isinstance(homestay, Exception):
         flash('Homestay not found.', 'error')
         return redirect(url_for('rooms'))
 
     if request.method == 'POST':
-        from_date = request.form.get('from_date')
-        till_date = request.form.get('till_date')
         beds_requested = int(request.form.get('beds_requested', 1))
 
         if not from_date or not till_date:
             flash('Please select both dates.', 'error')
             return redirect(url_for('book_homestay', homestay_id=homestay_id))
 
-        nights = compute_nights(from_date, till_date)
         if not nights:
             flash('Till date must be after from date.', 'error')
             return redirect(url_for('book_homestay', homestay_id=homestay_id))
 
         # Check bed availability
-        available_beds = get_available_beds_for_dates(homestay_id, from_date, till_date)
+        booked_beds = prefetched['booked_beds']
+        if isinstance(booked_beds, Exception):
+            log.error("Error calculating booked beds", exc_info=booked_beds)
+            flash('Could not check availability right now. Please try again.', 'error')
+            return redirect(url_for('book_homestay', homestay_id=homestay_id))
+        available_beds = max(0, (homestay.get('beds', 0) or 0) - booked_beds)
         if beds_requested > available_beds:
             flash(f'Only {available_beds} bed(s) available for your selected dates. Homestay has {homestay.get("beds", 0)} total beds.', 'error')
             return redirect(url_for('book_homestay', homestay_id=homestay_id))
 
-        # Price is fixed: ₹500 per bed per night
-        price_per_bed_per_night = 500
-        # FIX: Explicit calculation - should be 2000 for 2beds*2nights*500
-        total_amount = int(nights) * int(beds_requested) * int(price_per_bed_per_night)
-        
-        # DEBUG LOG
-        print(f"DEBUG CALC: nights={nights}, beds={beds_requested}, price={price_per_bed_per_night}, result={total_amount}")
+        # Enough beds each night is not enough: the guests need the same beds for the whole stay
+        placement = bed_placement(homestay_id, from_date, till_date, beds_requested)
+        if placement and not placement['fits']:
+            flash('No beds stay free for every night of your selected dates. Please try other dates or fewer beds.', 'error')
+            return redirect(url_for('book_homestay', homestay_id=homestay_id))
+        if placement and not placement['together'] and beds_requested > 1:
+            flash('Your party will be split across rooms for these dates.', 'info')
+
+        # Seasonal, weekend and festival rates plus any length-of-stay discount
+        try:
+            quote = quote_stay(homestay_id, from_date, till_date, beds_requested, homestay=homestay)
+        except pricing.PricingError as e:
+            log.warning("Error pricing stay: %s", e)
+            flash('Could not price your stay right now. Please try again.', 'error')
+            return redirect(url_for('book_homestay', homestay_id=homestay_id))
 
         session['pending_booking'] = {
             'homestay_id': homestay_id,
@@ -761,8 +1146,11 @@ def book_homestay(homestay_id):
             'nights': nights,
             'beds_requested': beds_requested,
             'beds' : beds_requested,
-            'price_per_bed_per_night': price_per_bed_per_night,
-            'total_amount': total_amount,
+            'price_per_bed_per_night': quote['average_nightly_rate'],
+            'subtotal': quote['subtotal'],
+            'discount_percent': quote['discount_percent'],
+            'discount': quote['discount'],
+            'total_amount': quote['total'],
             'homestay_owner': homestay.get('owner'),
             'homestay_contact': homestay.get('contact'),
             'homestay_image': homestay.get('image'),
@@ -771,32 +1159,47 @@ def book_homestay(homestay_id):
         return redirect(url_for('payment'))
 
     # Get availability info for the form
-    availability = get_availability_status(homestay_id, 30)
+    availability = prefetched['availability']
+    if isinstance(availability, Exception):
+        log.error("Error getting availability status", exc_info=availability)
+        availability = {}
     
     return render_template('book_homestay.html', homestay=homestay, availability=availability)
 
 
 @app.route('/payment', methods=['GET', 'POST'])
 @login_required
+@idempotent
 def payment():
     """Demo payment step; on success create booking and redirect to receipt."""
     pending = session.get('pending_booking')
     if not pending:
         flash('No booking in progress.', 'error')
         return redirect(url_for('rooms'))
+
+    # Look the homestay up while the session is updated; only the GET page renders it
+    batch = Prefetch()
+    if request.method != 'POST':
+        batch.add('homestay', get_homestay_by_id, pending['homestay_id']).start()
     
-    # RECALCULATE total_amount to ensure it's correct
-    nights_val = pending.get('nights', 1)
-    beds_val = pending.get('beds_requested', 1)
-    price_per_bed = 500
-    calculated_total = int(nights_val) * int(beds_val) * int(price_per_bed)
-    
-    # Update the pending dict with the correct total
-    pending['total_amount'] = calculated_total
+    # Re-quote so the amount charged always matches the current rates
+    try:
+        quote = quote_stay(
+            pending['homestay_id'], pending['from_date'], pending['till_date'], pending.get('beds_requested', 1)
+        )
+    except pricing.PricingError as e:
+        log.warning("Error pricing stay: %s", e)
+        session.pop('pending_booking', None)
+        flash('Could not price your stay. Please start the booking again.', 'error')
+        return redirect(url_for('rooms'))
+    pending.update({
+        'price_per_bed_per_night': quote['average_nightly_rate'],
+        'subtotal': quote['subtotal'],
+        'discount_percent': quote['discount_percent'],
+        'discount': quote['discount'],
+        'total_amount': quote['total'],
+    })
     session['pending_booking'] = pending
-    
-
-    homestay = get_homestay_by_id(pending['homestay_id'])
 
     if request.method == 'POST':
         payment_ref = f"DEMO-{random.randint(100000, 999999)}"
@@ -810,7 +1213,7 @@ def payment():
             beds_booked = int(beds_booked)
         except Exception:
             beds_booked = 1
-        print(f"DEBUG: beds_booked to save = {beds_booked} (pending: {pending})")
+        log.debug("beds_booked to save=%s pending=%s", beds_booked, pending)
         booking_payload = {
             'homestay_id': pending['homestay_id'],
             'from_date': pending['from_date'],
@@ -826,7 +1229,25 @@ def payment():
             'user_name': user_name,
         }
 
-        booking = create_booking(booking_payload)
+        # A Cashfree attempt may already have saved this booking (see create_order); complete that one
+        staged = get_booking_by_id(pending['booking_id']) if pending.get('booking_id') else None
+        if staged and staged.get('status') == 'pending' and str(staged.get('user_id')) == str(session.get('user_id')):
+            try:
+                booking = store.bookings.update(staged['id'], {
+                    'status': 'paid', 'payment_reference': payment_ref, 'total_amount': pending['total_amount'],
+                })
+            except Exception:
+                log.exception("Error updating staged booking")
+                booking = None
+        else:
+            # Beds may have been taken since the booking form was submitted
+            placement = bed_placement(pending['homestay_id'], pending['from_date'], pending['till_date'], beds_booked)
+            if placement and not placement['fits']:
+                session.pop('pending_booking', None)
+                flash('The beds for your dates were just taken. Please choose other dates.', 'error')
+                return redirect(url_for('book_homestay', homestay_id=pending['homestay_id']))
+
+            booking = create_booking(booking_payload)
 
         # Clear pending booking regardless of success to avoid duplicate attempts
         session.pop('pending_booking', None)
@@ -838,64 +1259,112 @@ def payment():
         flash('Payment successful! Booking confirmed.', 'success')
         return redirect(url_for('receipt', booking_id=booking['id']))
 
+    homestay = batch.results().get('homestay')
+    if isinstance(homestay, Exception):
+        homestay = None
     return render_template('payment.html', pending=pending, homestay=homestay)
 
 
 @app.route('/receipt/<booking_id>')
 @login_required
-def receipt(booking_id):
+async def receipt(booking_id):
     """Show booking receipt."""
-    booking = get_booking_by_id(booking_id)
+    booking = await astore.run(get_booking_by_id, booking_id)
     if not booking:
         flash('Booking not found.', 'error')
         return redirect(url_for('rooms'))
 
-    homestay = get_homestay_by_id(booking['homestay_id']) if booking.get('homestay_id') else None
+    homestay = await astore.run(get_homestay_by_id, booking['homestay_id']) if booking.get('homestay_id') else None
     return render_template('receipt.html', booking=booking, homestay=homestay)
 
 
 @app.route('/payments/create-order', methods=['POST'])
+@login_required
 def create_order():
-    """Create a Cashfree order and persist a pending payment row."""
+    """Create a Cashfree order and persist a pending payment row.
+
+    The order pays for a booking that carries its ``order_id``, so
+    reconciliation can approve the booking once Cashfree reports the
+    payment: the ``booking_id`` sent by the page, or else a pending booking
+    staged from the booking in progress (reused when the guest retries).
+    The amount is never taken from the client: it is that booking's
+    ``total_amount``, and the booking must belong to the logged-in user.
+    """
     try:
         payload = request.get_json(force=True)
         order_id = payload.get('order_id')
-        amount = float(payload.get('amount', 0))
         customer_id = payload.get('customer_id')
         phone = payload.get('phone')
+        booking_id = payload.get('booking_id')
 
-        if not all([order_id, amount, customer_id, phone]):
-            print(f"Missing fields in payment request: {payload}")
+        if not all([order_id, customer_id, phone]):
+            log.warning("Missing fields in payment request: %s", payload)
             return {"error": "Missing required fields"}, 400
+
+        pending = session.get('pending_booking')
+        if not booking_id and pending:
+            booking_id = pending.get('booking_id')
+            booking = get_booking_by_id(booking_id) if booking_id else None
+            if not booking or booking.get('status') != 'pending' or str(booking.get('user_id')) != str(session['user_id']):
+                booking = stage_order_booking(pending)
+                if booking is None:
+                    return {"error": "The beds for your dates were just taken. Please choose other dates."}, 409
+                pending['booking_id'] = booking['id']
+                session['pending_booking'] = pending
+        elif booking_id:
+            booking = get_booking_by_id(booking_id)
+            if not booking or str(booking.get('user_id')) != str(session['user_id']):
+                return {"error": "Booking not found"}, 404
+        else:
+            return {"error": "No booking in progress"}, 400
+
+        try:
+            amount = float(booking.get('total_amount') or 0)
+        except (TypeError, ValueError):
+            amount = 0
         if amount <= 0:
             return {"error": "Invalid amount"}, 400
 
-        # Generate return URL for redirect after payment
-        return_url = url_for('receipt', booking_id='PENDING', _external=True)
-        
-        payment_session_id = create_cashfree_order(order_id, amount, customer_id, phone, return_url)
+        # Link the booking before the order exists, so a webhook can never arrive first
+        previous_order_id = booking.get('order_id')
+        if previous_order_id and previous_order_id != order_id:
+            if store.payments.get_status(previous_order_id) == 'SUCCESS':
+                return {"error": "This booking is already paid"}, 409
+        if previous_order_id != order_id:
+            store.bookings.update(booking['id'], {'order_id': order_id})
+
+        # Cashfree sends the guest back to this booking's receipt
+        return_url = url_for('receipt', booking_id=booking['id'], _external=True)
+
+        try:
+            payment_session_id = create_cashfree_order(order_id, amount, customer_id, phone, return_url)
+        except Exception:
+            # No order was created: restore the link (none for a new booking, so the sweeper may expire it)
+            try:
+                store.bookings.update(booking['id'], {'order_id': previous_order_id})
+            except Exception:
+                log.exception("Booking order unlink error")
+            raise
 
         # Store payment as pending
         try:
-            supabase_sr.table('payments').insert({
+            store.payments.create({
                 "order_id": order_id,
                 "amount": amount,
                 "status": "PENDING",
                 "created_at": datetime.now(timezone.utc).isoformat()
-            }).execute()
-        except Exception as db_exc:
-            print(f"Payments insert error: {db_exc}")
+            })
+        except Exception:
+            log.exception("Payments insert error")
             # Do not fail payment creation if DB write has a transient issue
 
         return {"payment_session_id": payment_session_id}, 200
 
     except RuntimeError as e:
-        print(f"Create order runtime error: {e}")
+        log.exception("Create order runtime error")
         return {"error": str(e)}, 500
-    except Exception as e:
-        print(f"Create order error: {e}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        log.exception("Create order error")
         return {"error": "Could not create order"}, 500
 
 
@@ -923,12 +1392,11 @@ def cashfree_webhook():
 
     # Idempotency: check existing status
     try:
-        existing = supabase_sr.table('payments').select('status').eq('order_id', order_id).limit(1).execute()
-        current_status = existing.data[0]['status'] if existing.data else None
+        current_status = store.payments.get_status(order_id)
         if current_status in ('SUCCESS', 'FAILED'):
             return {"ok": True}, 200
-    except Exception as db_exc:
-        print(f"Payments fetch error: {db_exc}")
+    except Exception:
+        log.exception("Payments fetch error")
         # Proceed to upsert regardless
 
     new_status = None
@@ -941,108 +1409,468 @@ def cashfree_webhook():
         return {"ok": True, "ignored": True}, 200
 
     try:
-        supabase_sr.table('payments').upsert({
+        update = {
             "order_id": order_id,
             "status": new_status,
             "updated_at": datetime.now(timezone.utc).isoformat()
-        }, on_conflict="order_id").execute()
-    except Exception as db_exc:
-        print(f"Payments upsert error: {db_exc}")
+        }
+        # Record what Cashfree says was paid; reconciliation compares it with the booking total
+        paid_amount = data.get('payment', {}).get('payment_amount', order.get('order_amount'))
+        if paid_amount is not None:
+            update["amount"] = paid_amount
+        store.payments.upsert(update)
+    except Exception:
+        log.exception("Payments upsert error")
         return {"error": "db error"}, 500
 
+    # Link the payment to its booking now rather than at the next scheduled run
+    if 'reconcile-payments' in tasks:
+        tasks['reconcile-payments'].trigger()
+
     return {"ok": True}, 200
 
 
 @app.route('/bookings')
 @login_required
 def bookings():
-    """List current user's bookings."""
+    """List current user's bookings; ``?history=1`` adds archived past stays."""
     user_id = session.get('user_id')
     user_phone = session.get('phone_number')
     user_email = session.get('email')
     user_name = session.get('name', 'User')
+    history = request.args.get('history') == '1'
 
     try:
-        query = supabase.table('bookings').select('*')
         # Filter by email (most reliable), then phone, then name
-        if user_email:
-            query = query.eq('user_email', user_email)
-        elif user_phone:
-            query = query.eq('user_phone', user_phone)
-        elif user_name:
-            query = query.eq('user_name', user_name)
-        
-        response = query.order('from_date', desc=False).execute()
-        bookings_data = response.data if response.data else []
-        
-        # Fetch homestay details for each booking
-        for booking in bookings_data:
-            homestay = get_homestay_by_id(booking['homestay_id']) if booking.get('homestay_id') else None
-            if homestay:
-                booking['homestay'] = {
-                    'owner': homestay.get('owner'),
-                    'rooms': homestay.get('rooms'),
-                    'beds': homestay.get('beds'),
-                    'price': homestay.get('price'),
-                    'contact': homestay.get('contact')
-                }
-    except Exception as e:
-        print(f"Error fetching bookings: {e}")
+        bookings_data = archive.list_for_user(store, email=user_email, phone=user_phone, name=user_name,
+                                              include_history=history)
+        attach_homestay_summaries(bookings_data)
+    except Exception:
+        log.exception("Error fetching bookings")
         bookings_data = []
         flash('Could not load bookings right now.', 'error')
 
-    return render_template('bookings.html', bookings=bookings_data, user_name=user_name)
+    return render_template('bookings.html', bookings=bookings_data, user_name=user_name, history=history)
 
 @app.route('/admin/dashboard')
 @admin_required
-def admin_dashboard():
-    """Admin dashboard to view and manage homestays"""
-    try:
-        response = supabase.table('homestays').select('*').execute()
-        homestays_data = response.data if response.data else []
-    except Exception as e:
-        print(f"Error fetching homestays: {e}")
+async def admin_dashboard():
+    """Admin dashboard to view and manage homestays; ``?history=1`` includes archived bookings."""
+    history = request.args.get('history') == '1'
+    # Homestays and bookings are independent; fetch them concurrently
+    homestays_data, bookings_data = await astore.gather(
+        astore.homestays.list_all(),
+        astore.run(archive.list_all, store, desc=True, include_history=history) if history
+        else astore.bookings.list_all(desc=True),
+    )
+    if isinstance(homestays_data, Exception):
+        log.error("Error fetching homestays", exc_info=homestays_data)
         flash('Error loading homestays.', 'error')
         homestays_data = []
     
     # Fetch all bookings for admin
-    try:
-        response = supabase.table('bookings').select('*').order('from_date', desc=True).execute()
-        bookings_data = response.data if response.data else []
-        
-        # Fetch homestay details for each booking
-        for booking in bookings_data:
-            homestay = get_homestay_by_id(booking['homestay_id']) if booking.get('homestay_id') else None
-            if homestay:
-                booking['homestay'] = {
-                    'owner': homestay.get('owner'),
-                    'rooms': homestay.get('rooms'),
-                    'beds': homestay.get('beds'),
-                    'price': homestay.get('price'),
-                    'contact': homestay.get('contact')
-                }
-    except Exception as e:
-        print(f"Error fetching bookings: {e}")
+    if isinstance(bookings_data, Exception):
+        log.error("Error fetching bookings", exc_info=bookings_data)
         bookings_data = []
+    else:
+        # Every homestay is already loaded, so no extra lookups are needed
+        attach_homestay_summaries(bookings_data, {h['id']: h for h in homestays_data})
     
     admin_name = session.get('name', 'Admin')
     # Prepare UPI confirmations from bookings with txn_id or screenshot
+    upi_bookings = [b for b in bookings_data if b.get('txn_id') or b.get('screenshot')]
+    try:
+        duplicates = await astore.run(find_duplicate_references, [b.get('id') for b in upi_bookings])
+    except Exception:
+        log.exception("Error checking duplicate UTRs")
+        duplicates = {}
     upi_confirmations = []
-    for booking in bookings_data:
-        if booking.get('txn_id') or booking.get('screenshot'):
-            upi_confirmations.append({
-                'booking_id': booking.get('id'),
-                'txn_id': booking.get('txn_id'),
-                'screenshot': booking.get('screenshot'),
-                'status': booking.get('status', 'pending')
+    for booking in upi_bookings:
+        upi_confirmations.append({
+            'booking_id': booking.get('id'),
+            'txn_id': booking.get('txn_id'),
+            'screenshot': booking.get('screenshot'),
+            'status': booking.get('status', 'pending'),
+            'duplicate_of': duplicates.get(str(booking.get('id')), [])
+        })
+    return render_template('admin_dashboard.html', homestays=homestays_data, bookings=bookings_data, username=admin_name, upi_confirmations=upi_confirmations, history=history)
+
+# Admin: Live dashboard updates (Server-Sent Events)
+@app.route('/admin/events')
+@admin_required
+def admin_events():
+    """Stream booking and payment events to the admin dashboard (see ``events.py``)."""
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_event_id = None
+    subscription = events.bus.subscribe(last_event_id)
+    if subscription is None:
+        return {'error': 'too many live dashboards open'}, 503, {'Retry-After': '30'}
+    return Response(
+        stream_with_context(events.bus.stream(subscription)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+# Admin: Request profiles (see profiling.py)
+@app.route('/admin/profiles')
+@admin_required
+def admin_profiles():
+    """List kept profiles; ``?merged=1`` (optionally with ``path=``) returns their stacks added together."""
+    if request.args.get('merged') == '1':
+        stacks = profiler.merged(request.args.get('path'))
+        return Response(profiling.collapsed(stacks), mimetype='text/plain')
+    return {**profiler.stats(), 'profiles': profiler.list()}
+
+@app.route('/admin/profiles/enable', methods=['POST'])
+@admin_required
+def admin_profiles_enable():
+    """Turn profiling on in this worker; ``sample_percent`` (0-100) also profiles that share of all requests."""
+    value = request.values.get('sample_percent')
+    if value is None:
+        value = (request.get_json(silent=True) or {}).get('sample_percent')
+    try:
+        sample_percent = float(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return {'error': 'sample_percent must be a number'}, 400
+    if sample_percent is not None and not 0 <= sample_percent <= 100:
+        return {'error': 'sample_percent must be between 0 and 100'}, 400
+    profiler.enable(sample_percent)
+    return profiler.stats()
+
+@app.route('/admin/profiles/disable', methods=['POST'])
+@admin_required
+def admin_profiles_disable():
+    """Turn profiling off in this worker; kept profiles stay readable."""
+    profiler.disable()
+    return profiler.stats()
+
+@app.route('/admin/profiles/<int:profile_id>')
+@admin_required
+def admin_profile(profile_id):
+    """One profile as collapsed stacks, ready for flamegraph.pl or speedscope."""
+    profile = profiler.get(profile_id)
+    if profile is None:
+        return {'error': 'profile not found'}, 404
+    return Response(profiling.collapsed(profile['stacks']), mimetype='text/plain',
+                    headers={'Content-Disposition': f'inline; filename=profile-{profile_id}.folded'})
+
+# Admin: Memory allocation changes since the previous call
+@app.route('/admin/memory', methods=['POST'])
+@admin_required
+def admin_memory():
+    """Snapshot tracemalloc and diff it against the previous snapshot; ``stop=1`` turns tracing off."""
+    if request.values.get('stop') == '1':
+        return memory_tracker.stop()
+    try:
+        limit = int(request.values.get('limit', '25'))
+    except ValueError:
+        return {'error': 'limit must be an integer'}, 400
+    return memory_tracker.snapshot_diff(limit=max(1, min(limit, 200)))
+
+# Admin: Look up many UTRs at once (e.g. pasted from a bank statement)
+@app.route('/admin/utr/lookup', methods=['POST'])
+@admin_required
+def admin_utr_lookup():
+    """Return the bookings each UTR was submitted for, flagging reuse."""
+    payload = request.get_json(silent=True) or {}
+    utrs = payload.get('utrs')
+    if utrs is None:
+        # Accept a raw statement paste: one UTR per line or comma-separated
+        utrs = request.get_data(as_text=True).replace(',', '\n').splitlines()
+    normalized = {}
+    for utr in utrs:
+        if str(utr).strip():
+            normalized[normalize_utr(str(utr))] = str(utr).strip()
+    if not normalized:
+        return {'error': 'No UTRs supplied'}, 400
+    try:
+        found = store.payment_refs.lookup_many('utr', normalized)
+        booking_ids = {int(row['booking_id']) for rows in found.values() for row in rows if row['booking_id'].isdigit()}
+        bookings_by_id = store.bookings.get_many(booking_ids)
+    except Exception:
+        log.exception("Error looking up UTRs")
+        return {'error': 'Lookup failed'}, 500
+
+    results = {}
+    for utr in normalized:
+        matches = []
+        for row in found.get(utr, []):
+            booking = bookings_by_id.get(int(row['booking_id'])) if row['booking_id'].isdigit() else None
+            matches.append({
+                'booking_id': row['booking_id'],
+                'submitted_at': row.get('created_at'),
+                'status': booking.get('status') if booking else None,
+                'amount': booking.get('total_amount') if booking else None,
             })
-    return render_template('admin_dashboard.html', homestays=homestays_data, bookings=bookings_data, username=admin_name, upi_confirmations=upi_confirmations)
+        results[utr] = {'found': bool(matches), 'duplicate': len(matches) > 1, 'bookings': matches}
+    return {'results': results, 'unknown': [utr for utr in normalized if utr not in found]}
+
+# Admin: Approve/reject many UPI bookings in one request
+# Bookings already approved or rejected are left untouched
+BULK_REVIEWABLE_STATUSES = ['pending', 'paid']
+
+@app.route('/admin/bookings/bulk', methods=['POST'])
+@admin_required
+def admin_bulk_review():
+    """Apply approve/reject decisions to many bookings with batched updates.
+
+    Expects JSON ``{"decisions": [{"booking_id": 1, "decision": "approve"},
+    {"booking_id": 2, "decision": "reject", "reason": "..."}]}`` and returns
+    a per-booking summary so the dashboard can patch rows in place.
+    """
+    payload = request.get_json(silent=True) or {}
+    decisions = payload.get('decisions')
+    if not isinstance(decisions, list) or not decisions:
+        return {'error': 'decisions must be a non-empty list'}, 400
+
+    invalid = []
+    # (new status, rejection reason) -> booking ids; one update per group
+    groups = {}
+    for item in decisions:
+        try:
+            booking_id = int(item.get('booking_id'))
+        except (TypeError, ValueError, AttributeError):
+            invalid.append({'booking_id': item.get('booking_id') if isinstance(item, dict) else item, 'error': 'invalid booking_id'})
+            continue
+        decision = str(item.get('decision', '')).lower()
+        reason = str(item.get('reason') or '').strip()
+        if decision == 'approve':
+            groups.setdefault(('approved', None), []).append(booking_id)
+        elif decision == 'reject':
+            if not reason:
+                invalid.append({'booking_id': booking_id, 'error': 'rejection reason is required'})
+                continue
+            groups.setdefault(('rejected', reason), []).append(booking_id)
+        else:
+            invalid.append({'booking_id': booking_id, 'error': f"unknown decision '{decision}'"})
+
+    updated = {}
+    failed = []
+    for (status, reason), ids in groups.items():
+        data = {'status': status}
+        if reason:
+            data['rejection_reason'] = reason
+        try:
+            for row in store.bookings.update_many(ids, data, only_statuses=BULK_REVIEWABLE_STATUSES):
+                updated[row['id']] = row
+        except Exception:
+            log.exception("Error applying bulk %s", status)
+            failed.extend({'booking_id': i, 'error': 'update failed'} for i in ids)
+
+    failed_ids = {f['booking_id'] for f in failed}
+    requested = [i for ids in groups.values() for i in ids]
+    skipped = [i for i in requested if i not in updated and i not in failed_ids]
+    return {
+        'updated': [
+            {'booking_id': row['id'], 'status': row.get('status'), 'rejection_reason': row.get('rejection_reason')}
+            for row in updated.values()
+        ],
+        'skipped': [{'booking_id': i, 'error': 'not found or already reviewed'} for i in skipped],
+        'invalid': invalid,
+        'failed': failed,
+        'counts': {
+            'approved': sum(1 for row in updated.values() if row.get('status') == 'approved'),
+            'rejected': sum(1 for row in updated.values() if row.get('status') == 'rejected'),
+            'skipped': len(skipped),
+            'invalid': len(invalid),
+            'failed': len(failed),
+        },
+    }
+
+# Admin: Stream bookings (with homestay owner and payment status) for accounting
+@app.route('/admin/export/bookings')
+@admin_required
+def admin_export_bookings():
+    """Stream all matching bookings as CSV or NDJSON.
+
+    Query parameters: ``format`` (csv|ndjson), ``from``/``to`` (ISO dates
+    bounding the stay's from_date), ``status`` (comma-separated),
+    ``include`` (comma-separated subset of homestay,payments) and
+    ``history=1`` to add archived bookings.
+    """
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in exports.FORMATS:
+        return {'error': f"format must be one of {', '.join(exports.FORMATS)}"}, 400
+    try:
+        from_date = datetime.fromisoformat(request.args['from']).date().isoformat() if request.args.get('from') else None
+        till_date = datetime.fromisoformat(request.args['to']).date().isoformat() if request.args.get('to') else None
+    except ValueError:
+        return {'error': 'from/to must be ISO dates (YYYY-MM-DD)'}, 400
+    statuses = [v.strip() for v in request.args.get('status', '').split(',') if v.strip()] or None
+    include = {v.strip() for v in request.args.get('include', 'homestay,payments').split(',')}
+
+    rows = exports.iter_booking_rows(
+        store,
+        from_date=from_date,
+        till_date=till_date,
+        statuses=statuses,
+        include_homestay='homestay' in include,
+        include_payments='payments' in include,
+        include_history=request.args.get('history') == '1',
+    )
+    if fmt == 'csv':
+        body = exports.stream_csv(rows, exports.export_columns('homestay' in include, 'payments' in include))
+    else:
+        body = exports.stream_ndjson(rows)
+
+    filename = f"bookings_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    return Response(
+        stream_with_context(body),
+        mimetype=exports.FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
+
+# Whether a party can share one room
+@app.route('/api/homestays/<int:homestay_id>/together')
+@login_required
+def api_stay_together(homestay_id):
+    """``{together, room}`` for ``beds`` guests staying ``from`` to ``to`` (ISO dates)."""
+    try:
+        from_date = datetime.fromisoformat(request.args['from']).date()
+        till_date = datetime.fromisoformat(request.args['to']).date()
+        beds = int(request.args.get('beds', 1))
+    except (KeyError, ValueError):
+        return {'error': 'from/to (ISO dates) and beds are required'}, 400
+    if till_date <= from_date or beds < 1:
+        return {'error': 'to must be after from and beds at least 1'}, 400
+    result = bed_allocator.can_stay_together(homestay_id, from_date.isoformat(), till_date.isoformat(), beds)
+    if result is None:
+        return {'error': 'homestay not found'}, 404
+    return result
+
+# Price quotes for many stays at once (search results, calendars)
+@app.route('/api/quotes', methods=['POST'])
+@login_required
+def api_quotes():
+    """Quote every stay in ``{"stays": [{homestay_id, from_date, till_date, beds}, ...]}``."""
+    payload = request.get_json(silent=True) or {}
+    stays = payload.get('stays')
+    if not isinstance(stays, list) or not stays:
+        return {'error': 'stays must be a non-empty list'}, 400
+    if len(stays) > MAX_QUOTES_PER_REQUEST:
+        return {'error': f"At most {MAX_QUOTES_PER_REQUEST} stays per request"}, 400
+    if not all(isinstance(stay, dict) for stay in stays):
+        return {'error': 'Each stay must be an object'}, 400
+    return {'quotes': pricing_engine.quote_many(stays)}
+
+# Admin: Seasonal, weekend, festival and length-of-stay pricing rules
+@app.route('/admin/pricing/rules', methods=['GET', 'POST'])
+@admin_required
+def admin_pricing_rules():
+    """List pricing rules, or add one from a JSON body (see ``pricing.validate_rule``)."""
+    if request.method == 'GET':
+        return {'rules': store.pricing_rules.list_all()}
+    try:
+        row = pricing.validate_rule(request.get_json(silent=True) or {})
+    except pricing.PricingError as e:
+        return {'error': str(e)}, 400
+    row['created_at'] = datetime.now(timezone.utc).isoformat()
+    return {'rule': store.pricing_rules.create(row)}, 201
+
+@app.route('/admin/pricing/rules/<int:rule_id>/delete', methods=['POST'])
+@admin_required
+def admin_delete_pricing_rule(rule_id):
+    store.pricing_rules.delete(rule_id)
+    return {'deleted': rule_id}
+
+# Admin: iCalendar feeds of other platforms imported as holds
+@app.route('/admin/calendar/sources', methods=['GET', 'POST'])
+@admin_required
+def admin_calendar_sources():
+    """List calendar sources, or add one from a JSON body (see ``ical_import.validate_source``)."""
+    if request.method == 'GET':
+        return {'sources': store.calendar_sources.list_all()}
+    try:
+        row = ical_import.validate_source(request.get_json(silent=True) or {}, app.config['CALENDAR_IMPORT_DIR'])
+    except ical_import.ICalError as e:
+        return {'error': str(e)}, 400
+    if not store.homestays.get(row['homestay_id']):
+        return {'error': 'homestay not found'}, 400
+    row['created_at'] = datetime.now(timezone.utc).isoformat()
+    return {'source': store.calendar_sources.create(row)}, 201
+
+@app.route('/admin/calendar/sources/<int:source_id>/delete', methods=['POST'])
+@admin_required
+def admin_delete_calendar_source(source_id):
+    """Delete a source and release the beds its holds blocked."""
+    released = store.external_holds.delete_for_source(source_id)
+    store.calendar_sources.delete(source_id)
+    return {'deleted': source_id, 'holds_deleted': len(released)}
+
+@app.route('/admin/calendar/sync', methods=['POST'])
+@admin_required
+def admin_calendar_sync():
+    """Sync every source now, or only ``source_ids`` from the JSON body."""
+    source_ids = (request.get_json(silent=True) or {}).get('source_ids')
+    if source_ids is not None and (not isinstance(source_ids, list)
+                                   or not all(isinstance(i, int) for i in source_ids)):
+        return {'error': 'source_ids must be a list of ids'}, 400
+    return run_calendar_sync(source_ids)
+
+# Admin: Which bed each guest sleeps in (housekeeping plan)
+@app.route('/admin/beds/<int:homestay_id>')
+@admin_required
+def admin_bed_plan(homestay_id):
+    """Rooms and beds of a homestay with the bookings in each; ``from``/``to`` default to the next 14 nights."""
+    today = datetime.now().date()
+    try:
+        from_date = datetime.fromisoformat(request.args['from']).date() if request.args.get('from') else today
+        till_date = datetime.fromisoformat(request.args['to']).date() if request.args.get('to') else today + timedelta(days=14)
+    except ValueError:
+        return {'error': 'from/to must be ISO dates (YYYY-MM-DD)'}, 400
+    if till_date <= from_date:
+        return {'error': 'to must be after from'}, 400
+    plan = bed_allocator.plan(homestay_id, from_date.isoformat(), till_date.isoformat())
+    if plan is None:
+        return {'error': 'homestay not found'}, 404
+    return plan
+
+@app.cli.command('rebuild-bed-index')
+def rebuild_bed_index_command():
+    """Rebuild bed assignments of every homestay from the bookings and print a summary."""
+    print(json.dumps({**bed_allocator.rebuild(), **bed_allocator.stats()}, indent=2))
+
+# Admin: Archive of past stays
+@app.route('/admin/archive', methods=['GET', 'POST'])
+@admin_required
+def admin_archive():
+    """Live/archived booking counts; a POST runs one archival pass first."""
+    result = {}
+    if request.method == 'POST':
+        result['run'] = run_booking_archival()
+    result['report'] = archive.report(store, app.config['ARCHIVE_AFTER_DAYS'])
+    return result
+
+# Admin: Occupancy and revenue analytics
+@app.route('/admin/analytics')
+@admin_required
+def admin_analytics():
+    """Occupancy and revenue per homestay as JSON.
+
+    ``from``/``to`` (ISO dates) select the nights to report on; the default
+    is the 30 nights before and 60 after today. Archived bookings are read
+    when the window starts before the archival cutoff (or with ``history=1``).
+    """
+    today = datetime.now().date()
+    try:
+        window_start = datetime.fromisoformat(request.args['from']).date() if request.args.get('from') else today - timedelta(days=30)
+        window_end = datetime.fromisoformat(request.args['to']).date() if request.args.get('to') else today + timedelta(days=60)
+    except ValueError:
+        return {'error': 'from/to must be ISO dates (YYYY-MM-DD)'}, 400
+    history = (request.args.get('history') == '1'
+               or window_start.isoformat() < archive.cutoff(app.config['ARCHIVE_AFTER_DAYS'], today))
+    try:
+        return analytics.get_analytics(store, window_start, window_end, include_history=history)
+    except ValueError as e:
+        return {'error': str(e)}, 400
 
 # Admin: Accept UPI payment
 @app.route('/admin/accept_upi/<int:booking_id>', methods=['POST'])
 def admin_accept_upi(booking_id):
     try:
-        supabase.table('bookings').update({'status': 'approved'}).eq('id', booking_id).execute()
+        store.bookings.update(booking_id, {'status': 'approved'})
         flash('Booking approved.', 'success')
     except Exception as e:
         flash(f'Error approving booking: {str(e)}', 'error')
@@ -1056,7 +1884,7 @@ def admin_reject_upi(booking_id):
         flash('Rejection reason is required.', 'error')
         return redirect(url_for('admin_dashboard'))
     try:
-        supabase.table('bookings').update({'status': 'rejected', 'rejection_reason': reason}).eq('id', booking_id).execute()
+        store.bookings.update(booking_id, {'status': 'rejected', 'rejection_reason': reason})
         flash('Booking rejected.', 'success')
     except Exception as e:
         flash(f'Error rejecting booking: {str(e)}', 'error')
@@ -1087,15 +1915,15 @@ def admin_add_homestay():
             # Remove any fields with empty string values
             homestay_data = {k: v for k, v in homestay_data.items() if v != ''}
             
-            response = supabase.table('homestays').insert(homestay_data).execute()
+            created = store.homestays.create(homestay_data)
             
-            if response.data:
+            if created:
                 flash('Homestay added successfully!', 'success')
                 return redirect(url_for('admin_dashboard'))
             else:
                 flash('Error adding homestay. Please try again.', 'error')
         except Exception as e:
-            print(f"Error adding homestay: {e}")
+            log.exception("Error adding homestay")
             flash(f'Error: {str(e)}', 'error')
     
     return render_template('admin_add_homestay.html')
@@ -1105,14 +1933,12 @@ def admin_add_homestay():
 def admin_edit_homestay(homestay_id):
     """Edit a homestay"""
     try:
-        response = supabase.table('homestays').select('*').eq('id', homestay_id).execute()
-        if not response.data:
+        homestay = store.homestays.get(homestay_id)
+        if not homestay:
             flash('Homestay not found!', 'error')
             return redirect(url_for('admin_dashboard'))
-        
-        homestay = response.data[0]
-    except Exception as e:
-        print(f"Error fetching homestay: {e}")
+    except Exception:
+        log.exception("Error fetching homestay")
         flash('Error loading homestay.', 'error')
         return redirect(url_for('admin_dashboard'))
     
@@ -1137,15 +1963,15 @@ def admin_edit_homestay(homestay_id):
             # Remove any fields with empty string values
             update_data = {k: v for k, v in update_data.items() if v != ''}
             
-            response = supabase.table('homestays').update(update_data).eq('id', homestay_id).execute()
+            updated = store.homestays.update(homestay_id, update_data)
             
-            if response.data:
+            if updated:
                 flash('Homestay updated successfully!', 'success')
                 return redirect(url_for('admin_dashboard'))
             else:
                 flash('Error updating homestay. Please try again.', 'error')
         except Exception as e:
-            print(f"Error updating homestay: {e}")
+            log.exception("Error updating homestay")
             flash(f'Error: {str(e)}', 'error')
     
     return render_template('admin_edit_homestay.html', homestay=homestay)
@@ -1155,10 +1981,10 @@ def admin_edit_homestay(homestay_id):
 def admin_delete_homestay(homestay_id):
     """Delete a homestay"""
     try:
-        response = supabase.table('homestays').delete().eq('id', homestay_id).execute()
+        store.homestays.delete(homestay_id)
         flash('Homestay deleted successfully!', 'success')
-    except Exception as e:
-        print(f"Error deleting homestay: {e}")
+    except Exception:
+        log.exception("Error deleting homestay")
         flash('Error deleting homestay.', 'error')
     
     return redirect(url_for('admin_dashboard'))
@@ -1166,7 +1992,8 @@ def admin_delete_homestay(homestay_id):
 @app.route('/logout')
 @login_required
 def logout():
-    supabase.auth.sign_out()
+    if supabase is not None:
+        supabase.auth.sign_out()
     session.clear()
     flash('You have been logged out successfully!', 'success')
     return redirect(url_for('login'))
@@ -1175,6 +2002,9 @@ def logout():
 def test_supabase():
     """Test endpoint to verify Supabase connection"""
     try:
+        if store.backend != 'supabase':
+            return f"Data backend is '{store.backend}' - Supabase is not in use"
+
         # Test if client is initialized
         if not supabase_url or not supabase_key:
             return f"ERROR: Missing environment variables<br>URL: {supabase_url}<br>KEY: {'*' * 10 if supabase_key else 'MISSING'}"
@@ -1227,6 +2057,8 @@ def get_or_create_payment_id():
 
 # Make get_or_create_payment_id available in Jinja templates (after definition)
 app.jinja_env.globals['get_or_create_payment_id'] = get_or_create_payment_id
+# One-time key for forms that create bookings (see idempotency.py)
+app.jinja_env.globals['idempotency_token'] = idempotency.idempotency_token
 
 # UPI Payment confirmation route (for entering UTR/Txn ID)
 @app.route('/confirm/<booking_id>', methods=['GET', 'POST'], endpoint='confirm_booking')
@@ -1237,14 +2069,17 @@ def confirm_booking(booking_id):
         if not utr:
             message = 'Please enter a valid UTR/Transaction ID.'
         else:
-            # Store UTR in in-memory store (for demo; in production, store in DB)
-            utr_store[booking_id] = utr
+            # Index the UTR so reuse across bookings is caught
+            duplicates = record_payment_reference('utr', normalize_utr(utr), booking_id)
             message = f'Thank you! UTR/Txn ID <b>{utr}</b> received for Booking ID <b>{booking_id}</b>. We will verify and confirm your payment shortly.'
+            if duplicates:
+                message += ' This UTR was already submitted for another booking, so our team will review it manually.'
     return render_template('confirm_upi.html', booking_id=booking_id, payment_id=booking_id, message=message)
                           
 
 # Confirm booking directly from payment page (adds to public.bookings)
 @app.route('/confirm-booking/<booking_id>', methods=['POST'], endpoint='confirm_booking_direct')
+@idempotent
 def confirm_booking_direct(booking_id):
     amount = request.form.get('amount')
     user_id = session.get('user_id')
@@ -1281,6 +2116,7 @@ def confirm_booking_direct(booking_id):
     txn_id = request.form.get('txn_id')
     # Optional screenshot upload
     screenshot_filename = None
+    screenshot_hash = None
     if 'screenshot' in request.files:
         screenshot = request.files['screenshot']
         if screenshot and screenshot.filename:
@@ -1292,7 +2128,10 @@ def confirm_booking_direct(booking_id):
             ext = os.path.splitext(screenshot.filename)[1]
             unique_name = f"{booking_id}_{int(datetime.now().timestamp())}{ext}"
             file_path = os.path.join(upload_dir, secure_filename(unique_name))
-            screenshot.save(file_path)
+            content = screenshot.read()
+            screenshot_hash = hashlib.sha256(content).hexdigest()
+            with open(file_path, 'wb') as f:
+                f.write(content)
             screenshot_filename = file_path.replace('static/', '')  # Store relative path for template use
 
     # Try to get beds_booked from session or form
@@ -1327,11 +2166,15 @@ def confirm_booking_direct(booking_id):
         # Add other required fields if needed
     }
     try:
-        response = supabase.table('bookings').insert(booking_data).execute()
-        # Get the new booking ID from the response
-        new_booking_id = None
-        if response and response.data and len(response.data) > 0:
-            new_booking_id = response.data[0].get('id')
+        new_booking = store.bookings.create(booking_data)
+        # Get the new booking ID from the inserted row
+        new_booking_id = new_booking.get('id') if new_booking else None
+        # Index the UTR and screenshot so reuse on other bookings is flagged to admins
+        if new_booking_id:
+            if txn_id and txn_id.strip():
+                record_payment_reference('utr', normalize_utr(txn_id), new_booking_id)
+            if screenshot_hash:
+                record_payment_reference('screenshot', screenshot_hash, new_booking_id)
         flash('Booking confirmed and sent for admin approval!', 'success')
         if new_booking_id:
             return redirect(url_for('receipt', booking_id=new_booking_id))
@@ -1343,22 +2186,19 @@ def confirm_booking_direct(booking_id):
 def ensure_inauguration_table():
     """Ensure inauguration table exists with a status column. Only runs if not present."""
     try:
-        # Try to select from inauguration table
-        result = supabase.table('inauguration').select('*').limit(1).execute()
         # If no rows, insert default row
-        if not result.data:
-            supabase.table('inauguration').insert({'status': 'no'}).execute()
+        store.inauguration.ensure_row('no')
     except Exception as e:
         # Table might not exist, try to create it (Supabase: must be done via dashboard or migration)
-        print("[WARN] Could not verify/create inauguration table. Please ensure it exists in Supabase with a 'status' column (text, yes/no). Error:", e)
+        log.warning("Could not verify/create inauguration table. Please ensure it exists in Supabase with a 'status' column (text, yes/no). Error: %s", e)
 
 def get_inauguration_status():
     try:
-        result = supabase.table('inauguration').select('status').limit(1).execute()
-        if result.data and len(result.data) > 0:
-            return result.data[0]['status']
+        status = store.inauguration.get_status()
+        if status:
+            return status
     except Exception as e:
-        print("[WARN] Could not fetch inauguration status:", e)
+        log.warning("Could not fetch inauguration status: %s", e)
     return 'yes'  # Default to normal if error
 
 # Ensure table exists at startup
@@ -1367,7 +2207,7 @@ ensure_inauguration_table()
 # Restrict access based on inauguration status
 @app.before_request
 def restrict_for_inauguration():
-    allowed_endpoints = {'login', 'static', 'inauguration_login', 'request_login_otp', 'logout'}
+    allowed_endpoints = {'login', 'static', 'inauguration_login', 'request_login_otp', 'logout', 'homestay_calendar'}
     # Only admins can access admin_dashboard and inauguration
     admin_only_endpoints = {'admin_dashboard', 'inauguration'}
     if request.endpoint in admin_only_endpoints and not session.get('is_admin', False):
@@ -1396,18 +2236,123 @@ def set_inauguration_status():
     status = data.get('status', 'yes')
     try:
         # Update the first row (should only be one row)
-        result = supabase.table('inauguration').select('id').limit(1).execute()
-        if result.data and len(result.data) > 0:
-            row_id = result.data[0]['id']
-            supabase.table('inauguration').update({'status': status}).eq('id', row_id).execute()
-        else:
-            supabase.table('inauguration').insert({'status': status}).execute()
+        store.inauguration.set_status(status)
         return {'success': True, 'status': status}
     except Exception as e:
-        print('Error updating inauguration status:', e)
+        log.exception('Error updating inauguration status')
         return {'success': False, 'error': str(e)}, 500
 
 
+# --- Background jobs and metrics ---
+def run_payment_reconciliation():
+    return reconcile_payments(
+        store,
+        batch_size=app.config['RECONCILE_BATCH_SIZE'],
+        max_batches=app.config['RECONCILE_MAX_BATCHES'],
+        unmatched_grace_seconds=app.config['RECONCILE_UNMATCHED_GRACE_SECONDS'],
+    )
+
+
+@app.cli.command('reconcile-payments')
+def reconcile_payments_command():
+    """Link paid Cashfree orders to their bookings once and print a summary."""
+    print(json.dumps(run_payment_reconciliation(), indent=2))
+
+
+def run_pending_sweep():
+    return expire_stale_bookings(
+        store,
+        ttl_seconds=app.config['PENDING_TTL_SECONDS'],
+        batch_size=app.config['SWEEP_BATCH_SIZE'],
+        max_batches=app.config['SWEEP_MAX_BATCHES'],
+    )
+
+
+@app.cli.command('expire-pending-bookings')
+def expire_pending_bookings_command():
+    """Expire abandoned or past-check-in pending bookings once and print a summary."""
+    print(json.dumps(run_pending_sweep(), indent=2))
+
+
+def run_calendar_sync(source_ids=None):
+    return ical_import.sync_all(store, import_dir=app.config['CALENDAR_IMPORT_DIR'], source_ids=source_ids)
+
+
+@app.cli.command('sync-calendars')
+def sync_calendars_command():
+    """Import every external iCalendar feed once and print a summary."""
+    print(json.dumps(run_calendar_sync(), indent=2))
+
+
+def run_booking_archival():
+    return archive.archive_bookings(
+        store,
+        after_days=app.config['ARCHIVE_AFTER_DAYS'],
+        batch_size=app.config['ARCHIVE_BATCH_SIZE'],
+        max_batches=app.config['ARCHIVE_MAX_BATCHES'],
+    )
+
+
+@app.cli.command('archive-bookings')
+def archive_bookings_command():
+    """Move settled past stays to the archive once and print the moved and remaining counts."""
+    summary = run_booking_archival()
+    print(json.dumps({**summary, 'report': archive.report(store, app.config['ARCHIVE_AFTER_DAYS'])}, indent=2))
+
+
+def start_background_tasks():
+    if app.config['RECONCILE_INTERVAL_SECONDS'] > 0:
+        schedule('reconcile-payments', app.config['RECONCILE_INTERVAL_SECONDS'], run_payment_reconciliation)
+    if app.config['SWEEP_INTERVAL_SECONDS'] > 0:
+        schedule('expire-pending-bookings', app.config['SWEEP_INTERVAL_SECONDS'], run_pending_sweep)
+    if app.config['ARCHIVE_INTERVAL_SECONDS'] > 0:
+        schedule('archive-bookings', app.config['ARCHIVE_INTERVAL_SECONDS'], run_booking_archival)
+    if app.config['BED_INDEX_REBUILD_SECONDS'] > 0:
+        # Runs once right away (off the import path), then every interval
+        schedule('rebuild-bed-index', app.config['BED_INDEX_REBUILD_SECONDS'], bed_allocator.rebuild).trigger()
+    if app.config['CALENDAR_SYNC_INTERVAL_SECONDS'] > 0:
+        schedule('sync-calendars', app.config['CALENDAR_SYNC_INTERVAL_SECONDS'], run_calendar_sync)
+
+
+metrics.register('queries', lambda: {'backend': store.backend, 'total': store.stats.total, 'by_table': store.stats.snapshot()})
+metrics.register('reconciliation', reconciliation_stats.snapshot)
+metrics.register('pending_sweeper', sweeper_stats.snapshot)
+metrics.register('booking_archive', archive.stats.snapshot)
+metrics.register('idempotency', idempotency.store.stats)
+metrics.register('store_resilience', store_resilience.snapshot)
+metrics.register('read_coalescing', read_coalescer.stats)
+metrics.register('rate_limits', rate_limiter.stats)
+metrics.register('logging', logs.stats)
+metrics.register('compression', lambda: {
+    **compressor.stats(),
+    'minified_templates': template_minifier.stats() if template_minifier else None,
+})
+if supabase_transport is not None:
+    metrics.register('supabase_http', supabase_transport.snapshot)
+if shared_cache is not None:
+    metrics.register('l2_cache', shared_cache.stats)
+metrics.register('analytics_cache', analytics.cache.stats)
+metrics.register('pricing', pricing_engine.stats)
+metrics.register('calendar_feeds', calendar_feed.cache.stats)
+metrics.register('bed_allocation', bed_allocator.stats)
+metrics.register('admin_events', events.bus.stats)
+metrics.register('calendar_sync', lambda: {**ical_import.stats.snapshot(), 'holds_index': ical_import.holds.stats()})
+metrics.register('profiling', lambda: {
+    **profiler.stats(),
+    'memory': memory_tracker.stats(),
+})
+metrics.register('tasks', lambda: {name: task.status() for name, task in tasks.items()})
+
+start_background_tasks()
+
+
+@app.route('/admin/metrics')
+@admin_required
+def admin_metrics():
+    """Runtime metrics of the data layer and background jobs as JSON."""
+    return metrics.collect()
+
+
 if __name__ == '__main__':
     print("✅ Flask application ready!")
     print("🌐 Access at: http://localhost:5000")
@@ -0,0 +1,170 @@
+"""Move past stays out of the bookings table.
+
+Availability checks, the admin dashboard and ``/bookings`` only need
+current and future stays, but every booking ever made stays in
+``bookings`` and every read pays for it. ``archive_bookings`` moves
+bookings that are settled (``ARCHIVED_STATUSES``) and whose stay ended
+more than ``after_days`` ago into ``bookings_archive``, in batches:
+
+1. read a batch of archivable bookings (keyset by id)
+2. copy them to the archive (an upsert, so a rerun after a crash is safe)
+3. delete them from ``bookings``
+
+A booking is in ``bookings_archive`` before it leaves ``bookings``, so a
+failure between the steps leaves a copy in both places, never in neither;
+the readers below prefer the live row and the next run removes it.
+
+Reads touch the archive only when asked for history (``include_history``);
+without it they cost the same however many years of bookings exist.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+ARCHIVED_STATUSES = ('approved', 'rejected', 'expired', 'cancelled', 'payment_failed')
+AFTER_DAYS = 90
+
+
+def cutoff(after_days, today=None):
+    """Stays that ended before this date (ISO) may be archived."""
+    today = today or datetime.now(timezone.utc).date()
+    return (today - timedelta(days=max(1, after_days))).isoformat()
+
+
+class ArchiveStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.moved = 0
+        self.by_status = {}
+        self.last_run_at = None
+        self.last_duration_ms = None
+        self.last_moved = 0
+        self.last_cutoff = None
+
+    def record(self, summary):
+        with self._lock:
+            self.runs += 1
+            self.moved += summary['moved']
+            for status, count in summary['by_status'].items():
+                self.by_status[status] = self.by_status.get(status, 0) + count
+            self.last_run_at = summary['finished_at']
+            self.last_duration_ms = summary['duration_ms']
+            self.last_moved = summary['moved']
+            self.last_cutoff = summary['cutoff']
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'runs': self.runs,
+                'moved': self.moved,
+                'by_status': dict(self.by_status),
+                'last_run_at': self.last_run_at,
+                'last_duration_ms': self.last_duration_ms,
+                'last_moved': self.last_moved,
+                'last_cutoff': self.last_cutoff,
+            }
+
+
+stats = ArchiveStats()
+
+
+def archive_bookings(store, after_days=AFTER_DAYS, batch_size=500, max_batches=20, now=None):
+    """Run one archival pass; returns a summary dict."""
+    started = time.perf_counter()
+    now = now or datetime.now(timezone.utc)
+    till_before = cutoff(after_days, now.date())
+    summary = {'cutoff': till_before, 'scanned': 0, 'moved': 0, 'by_status': {}, 'batches': 0}
+    cursor = None
+
+    for _ in range(max_batches):
+        bookings = store.bookings.list_archivable(till_before, ARCHIVED_STATUSES, after_id=cursor, limit=batch_size)
+        if not bookings:
+            break
+        summary['batches'] += 1
+        summary['scanned'] += len(bookings)
+        cursor = bookings[-1]['id']
+
+        archived_at = now.isoformat()
+        store.bookings_archive.insert_many([{**booking, 'archived_at': archived_at} for booking in bookings])
+        deleted = store.bookings.delete_many([booking['id'] for booking in bookings])
+        summary['moved'] += len(deleted)
+        for booking in deleted:
+            status = booking.get('status') or 'unknown'
+            summary['by_status'][status] = summary['by_status'].get(status, 0) + 1
+
+        if len(bookings) < batch_size:
+            break
+
+    summary['finished_at'] = datetime.now(timezone.utc).isoformat()
+    summary['duration_ms'] = (time.perf_counter() - started) * 1000.0
+    stats.record(summary)
+    return summary
+
+
+def report(store, after_days=AFTER_DAYS):
+    """Row counts of both tables and what archival has moved in this process."""
+    return {
+        'live_bookings': store.bookings.count(),
+        'archived_bookings': store.bookings_archive.count(),
+        'after_days': after_days,
+        'cutoff': cutoff(after_days),
+        'runs': stats.snapshot(),
+    }
+
+
+# --- History-aware reads ---
+
+def _merge(live, archived):
+    ids = {booking['id'] for booking in live}
+    return live + [booking for booking in archived if booking['id'] not in ids]
+
+
+def list_for_user(store, email=None, phone=None, name=None, include_history=False):
+    """A guest's bookings, with archived past stays first when ``include_history``."""
+    live = store.bookings.list_for_user(email=email, phone=phone, name=name)
+    if not include_history:
+        return live
+    archived = store.bookings_archive.list_for_user(email=email, phone=phone, name=name)
+    return sorted(_merge(live, archived), key=lambda b: str(b.get('from_date') or ''))
+
+
+def list_all(store, desc=True, include_history=False):
+    """All bookings ordered by from_date, archived ones only when ``include_history``."""
+    live = store.bookings.list_all(desc=desc)
+    if not include_history:
+        return live
+    return sorted(_merge(live, store.bookings_archive.list_all(desc=desc)),
+                  key=lambda b: str(b.get('from_date') or ''), reverse=desc)
+
+
+def iter_pages(store, page_size=500, include_history=False, **filters):
+    """Keyset pages of live bookings, then (with ``include_history``) of archived ones.
+
+    Archived rows still present in ``bookings`` (an interrupted run) are
+    left out, so every booking appears once.
+    """
+    after_id = None
+    while True:
+        page = store.bookings.page(after_id, page_size, **filters)
+        if page:
+            yield page
+        if len(page) < page_size:
+            break
+        after_id = page[-1]['id']
+    if not include_history:
+        return
+
+    after_id = None
+    while True:
+        page = store.bookings_archive.page(after_id, page_size, **filters)
+        if not page:
+            return
+        live = store.bookings.get_many(booking['id'] for booking in page)
+        rows = [booking for booking in page if booking['id'] not in live]
+        if rows:
+            yield rows
+        if len(page) < page_size:
+            return
+        after_id = page[-1]['id']
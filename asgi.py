@@ -0,0 +1,16 @@
+"""ASGI entry point.
+
+Serve the app from an ASGI server, for example:
+
+    uvicorn asgi:asgi_app --workers 2
+
+The server's event loop accepts connections while requests are handled on
+its thread pool, and the ``async def`` views gather their independent
+queries concurrently.
+"""
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app
+
+asgi_app = WsgiToAsgi(app)
@@ -0,0 +1,66 @@
+"""Async access to the data store for ``async def`` views.
+
+Flask runs every async view on a fresh event loop, so an async HTTP client
+(which is bound to the loop it was created on) cannot be shared between
+requests. Instead each repository call is run on a shared, bounded thread
+pool using the existing pooled clients, which lets a view ``await`` several
+independent queries at once with ``gather``.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from datastore import DataStore
+
+# Shared by every request of this worker; sized for network-bound calls
+IO_THREADS = int(os.getenv('IO_THREADS', '16'))
+io_executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix='store-io')
+
+
+async def run_in_io_pool(func, *args, **kwargs):
+    """Run a blocking call on the shared I/O pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, lambda: func(*args, **kwargs))
+
+
+class AsyncRepository:
+    """Exposes every method of a repository as a coroutine."""
+
+    def __init__(self, get_repo):
+        self._get_repo = get_repo
+
+    def __getattr__(self, name):
+        method = getattr(self._get_repo(), name)
+        if not callable(method):
+            return method
+
+        async def call(*args, **kwargs):
+            return await run_in_io_pool(method, *args, **kwargs)
+        return call
+
+
+class AsyncDataStore:
+    """Async facade over the current ``DataStore``.
+
+    ``get_store`` is called on every access so the facade follows the app's
+    store if it is swapped (e.g. by the benchmarks).
+    """
+
+    def __init__(self, get_store):
+        self._get_store = get_store
+        for name in DataStore.REPOSITORIES:
+            setattr(self, name, AsyncRepository(lambda name=name: getattr(self._get_store(), name)))
+
+    async def run(self, func, *args, **kwargs):
+        """Run any blocking helper (e.g. availability calculation) off the event loop."""
+        return await run_in_io_pool(func, *args, **kwargs)
+
+    @staticmethod
+    async def gather(*awaitables):
+        """Await independent queries concurrently.
+
+        Exceptions are returned in place of results so each caller can keep
+        its own per-query error handling.
+        """
+        return await asyncio.gather(*awaitables, return_exceptions=True)
@@ -0,0 +1,254 @@
+"""Benchmark the booking funnel against the local SQLite backend.
+
+Drives the real Flask app in-process with synthetic data (N homestays and
+M bookings) and reports latency percentiles, throughput and queries per
+request for every page of the funnel at each booking-history size.
+
+Usage:
+    python benchmarks/bench_booking_funnel.py --homestays 20 \\
+        --bookings 1000,10000,50000 --iterations 50 --output bench.json
+
+The JSON result includes the git commit so runs can be compared.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The app reads its backend at import time
+os.environ.setdefault('DATA_BACKEND', 'sqlite')
+os.environ.setdefault('SQLITE_PATH', ':memory:')
+# Keep background jobs out of the timings
+os.environ.setdefault('RECONCILE_INTERVAL_SECONDS', '0')
+os.environ.setdefault('SWEEP_INTERVAL_SECONDS', '0')
+os.environ.setdefault('ARCHIVE_INTERVAL_SECONDS', '0')
+os.environ.setdefault('CALENDAR_SYNC_INTERVAL_SECONDS', '0')
+os.environ.setdefault('BED_INDEX_REBUILD_SECONDS', '0')
+# App logs go to stdout; keep them out of the JSON output
+os.environ.setdefault('LOG_LEVEL', 'CRITICAL')
+
+import app as kangundi  # noqa: E402
+from sqlite_store import create_sqlite_datastore  # noqa: E402
+
+STATUSES = ['approved', 'pending', 'paid', 'rejected']
+GUEST = {'id': 1, 'name': 'Bench Guest', 'email': 'guest1@bench.local', 'phone_number': '9000000001'}
+ADMIN = {'id': 2, 'name': 'Bench Admin', 'email': 'admin@bench.local', 'phone_number': '9000000002'}
+
+
+def seed_store(num_homestays, num_bookings, num_users, rng):
+    """Create a fresh in-memory store filled with synthetic data."""
+    store = create_sqlite_datastore(':memory:')
+    conn = store.db.connection()
+    now = datetime.now(timezone.utc).isoformat()
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (id, name, email, username, phone_number, password_hash, is_admin, created_at) "
+            "VALUES (?, ?, ?, ?, ?, '', ?, ?)",
+            [
+                (i, f"Guest {i}", f"guest{i}@bench.local", f"guest{i}", f"9{i:09d}", int(i == ADMIN['id']), now)
+                for i in range(1, num_users + 1)
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO homestays (id, owner, rooms, beds, floor, description, price, contact) "
+            "VALUES (?, ?, ?, ?, 'Ground', 'Synthetic homestay', ?, ?)",
+            [
+                (i, f"Owner {i}", rng.randint(1, 4), rng.randint(4, 12), rng.choice([400, 500, 600]), f"98{i:08d}")
+                for i in range(1, num_homestays + 1)
+            ],
+        )
+        today = date.today()
+        rows = []
+        for _ in range(num_bookings):
+            user_id = rng.randint(1, num_users)
+            start = today + timedelta(days=rng.randint(-365, 365))
+            nights = rng.randint(1, 5)
+            beds = rng.randint(1, 2)
+            rows.append((
+                rng.randint(1, num_homestays), start.isoformat(), (start + timedelta(days=nights)).isoformat(),
+                nights, beds, nights * beds * 500, rng.choice(STATUSES), user_id, f"Guest {user_id}",
+                f"9{user_id:09d}", f"guest{user_id}@bench.local", now,
+            ))
+        conn.executemany(
+            "INSERT INTO bookings (homestay_id, from_date, till_date, nights, beds_booked, total_amount, status, "
+            "user_id, user_name, user_phone, user_email, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.execute("INSERT INTO inauguration (status) VALUES ('yes')")
+    return store
+
+
+def login(client, user, is_admin=False):
+    with client.session_transaction() as sess:
+        sess['user_id'] = user['id']
+        sess['name'] = user['name']
+        sess['email'] = user['email']
+        sess['phone_number'] = user['phone_number']
+        sess['is_admin'] = is_admin
+
+
+def stage_booking(client, homestay_id, rng):
+    """Put a pending booking in the session, as POST /book would."""
+    start = date.today() + timedelta(days=rng.randint(400, 700))
+    with client.session_transaction() as sess:
+        sess['pending_booking'] = {
+            'homestay_id': homestay_id,
+            'from_date': start.isoformat(),
+            'till_date': (start + timedelta(days=2)).isoformat(),
+            'nights': 2,
+            'beds_requested': 1,
+            'beds': 1,
+            'price_per_bed_per_night': 500,
+            'total_amount': 1000,
+        }
+
+
+def build_scenarios(num_homestays, rng):
+    """Each scenario is (name, admin?, prepare(client), request(client))."""
+    def homestay():
+        return rng.randint(1, num_homestays)
+
+    def book_form():
+        start = date.today() + timedelta(days=rng.randint(1, 60))
+        return {
+            'from_date': start.isoformat(),
+            'till_date': (start + timedelta(days=rng.randint(1, 3))).isoformat(),
+            'beds_requested': '1',
+        }
+
+    noop = lambda client: None  # noqa: E731
+    stage = lambda client: stage_booking(client, homestay(), rng)  # noqa: E731
+    return [
+        ('GET /rooms', False, noop, lambda c: c.get('/rooms')),
+        ('GET /homestay/<id>', False, noop, lambda c: c.get(f"/homestay/{homestay()}")),
+        ('POST /book/<id>', False, noop, lambda c: c.post(f"/book/{homestay()}", data=book_form())),
+        ('GET /payment', False, stage, lambda c: c.get('/payment')),
+        ('POST /payment', False, stage, lambda c: c.post('/payment')),
+        ('POST /confirm-booking/<id>', False, stage,
+         lambda c: c.post(f"/confirm-booking/bench-{rng.random():.8f}", data={'txn_id': f"UTR{rng.randint(1, 10**9)}"})),
+        ('GET /bookings', False, noop, lambda c: c.get('/bookings')),
+        ('GET /admin/dashboard', True, noop, lambda c: c.get('/admin/dashboard')),
+    ]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def run_scenario(store, scenario, iterations, warmup):
+    name, as_admin, prepare, send = scenario
+    client = kangundi.app.test_client()
+    login(client, ADMIN if as_admin else GUEST, is_admin=as_admin)
+
+    for _ in range(warmup):
+        prepare(client)
+        send(client)
+
+    latencies = []
+    statuses = {}
+    queries = 0
+    total_time = 0.0
+    for _ in range(iterations):
+        prepare(client)
+        before = store.stats.total
+        start = time.perf_counter()
+        response = send(client)
+        elapsed = time.perf_counter() - start
+        queries += store.stats.total - before
+        total_time += elapsed
+        latencies.append(elapsed * 1000.0)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    latencies.sort()
+    return {
+        'endpoint': name,
+        'iterations': iterations,
+        'status_codes': {str(k): v for k, v in sorted(statuses.items())},
+        'latency_ms': {
+            'mean': sum(latencies) / len(latencies),
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1],
+        },
+        'throughput_rps': iterations / total_time if total_time else None,
+        'queries_per_request': queries / iterations,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    results = {
+        'benchmark': 'booking_funnel',
+        'commit': git_commit(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'config': {
+            'homestays': args.homestays,
+            'bookings': args.bookings,
+            'users': args.users,
+            'iterations': args.iterations,
+            'warmup': args.warmup,
+            'seed': args.seed,
+        },
+        'runs': [],
+    }
+    for num_bookings in args.bookings:
+        rng = random.Random(args.seed)
+        store = seed_store(args.homestays, num_bookings, args.users, rng)
+        kangundi.use_store(store)
+        run_result = {'bookings': num_bookings, 'endpoints': []}
+        for scenario in build_scenarios(args.homestays, rng):
+            run_result['endpoints'].append(run_scenario(store, scenario, args.iterations, args.warmup))
+        results['runs'].append(run_result)
+        print(f"bookings={num_bookings}: done", file=sys.stderr)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--homestays', type=int, default=20, help='number of synthetic homestays')
+    parser.add_argument('--bookings', type=lambda v: [int(x) for x in v.split(',')], default=[1000, 5000, 20000],
+                        help='comma-separated booking-history sizes')
+    parser.add_argument('--users', type=int, default=200, help='number of synthetic users')
+    parser.add_argument('--iterations', type=int, default=30, help='measured requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=3, help='unmeasured requests per endpoint')
+    parser.add_argument('--seed', type=int, default=42, help='random seed for reproducible data')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""Benchmark the Supabase HTTP transport against a local PostgREST stub.
+
+Runs the same concurrent repository reads through Supabase clients built
+with the library's default HTTP settings and through the shared, tuned
+pool from ``http_transport.py``. It reports latency percentiles and the
+TCP connections the stub accepted (connection churn) for each. The anon
+and service-role clients get different keys, and each variant fails if a
+client sends the other's ``apikey`` header.
+
+Usage:
+    python benchmarks/bench_supabase_transport.py --threads 24 \\
+        --requests 200 --latency-ms 5 --output transport.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from supabase import create_client  # noqa: E402
+from supabase.lib.client_options import SyncClientOptions  # noqa: E402
+
+import http_transport  # noqa: E402
+import postgrest_stub  # noqa: E402
+from datastore import create_datastore  # noqa: E402
+
+KEY = 'stub-anon-key'
+SERVICE_KEY = 'stub-service-role-key'
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def default_clients(url, args):
+    return create_client(url, KEY), create_client(url, SERVICE_KEY), None
+
+
+def tuned_clients(url, args):
+    transport = http_transport.PooledTransport(max_connections=args.pool_size, http2=True)
+
+    def options():
+        return SyncClientOptions(httpx_client=http_transport.create_http_client(transport, timeout=20))
+    return create_client(url, KEY, options=options()), create_client(url, SERVICE_KEY, options=options()), transport
+
+
+def check_keys(name, server, client, service_client):
+    """Fail unless each client sends its own ``apikey``, also after the other has initialised."""
+    for label, c, expected in (('anon', client, KEY), ('service role', service_client, SERVICE_KEY),
+                               ('anon', client, KEY)):
+        c.table('homestays').select('id').limit(1).execute()
+        if server.last_apikey != expected:
+            raise SystemExit(f"{name}: {label} client sent apikey {server.last_apikey!r}, expected {expected!r}")
+
+
+def run_variant(name, make_clients, server, args):
+    client, service_client, transport = make_clients(server.url, args)
+    check_keys(name, server, client, service_client)
+    store = create_datastore('supabase', supabase_client=client, supabase_service_client=service_client)
+    rng = random.Random(args.seed)
+    ids = [rng.randint(1, args.homestays) for _ in range(args.threads * args.requests)]
+    latencies = []
+    lock = threading.Lock()
+    connections_before = server.connections
+
+    def worker(chunk):
+        local = []
+        for i, homestay_id in enumerate(chunk):
+            start = time.perf_counter()
+            if i % 10 == 0:
+                store.homestays.list_all()
+            else:
+                store.homestays.get(homestay_id)
+            local.append((time.perf_counter() - start) * 1000.0)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(ids[t::args.threads],)) for t in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        'variant': name,
+        'requests': len(latencies),
+        'latency_ms': {
+            'mean': sum(latencies) / len(latencies),
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1],
+        },
+        'throughput_rps': len(latencies) / elapsed,
+        'connections_accepted': server.connections - connections_before,
+    }
+    if transport is not None:
+        result['transport'] = transport.snapshot()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    tables = {'homestays': [
+        {'id': i, 'owner': f"Owner {i}", 'rooms': 3, 'beds': 6, 'price': 500, 'description': 'Stub homestay'}
+        for i in range(1, args.homestays + 1)
+    ]}
+    server = postgrest_stub.start(tables, latency_ms=args.latency_ms)
+    try:
+        results = {
+            'benchmark': 'supabase_transport',
+            'commit': git_commit(),
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'config': vars(args),
+            'runs': [],
+        }
+        for name, make_clients in (('default', default_clients), ('tuned', tuned_clients)):
+            results['runs'].append(run_variant(name, make_clients, server, args))
+            print(f"{name}: done", file=sys.stderr)
+        return results
+    finally:
+        server.shutdown()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--threads', type=int, default=24, help='concurrent request threads')
+    parser.add_argument('--requests', type=int, default=100, help='reads per thread')
+    parser.add_argument('--homestays', type=int, default=50, help='rows served by the stub')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='delay the stub adds to every response')
+    parser.add_argument('--pool-size', type=int, default=http_transport.pool_size(8, 16),
+                        help='connections in the tuned pool')
+    parser.add_argument('--seed', type=int, default=42, help='random seed')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""Minimal PostgREST-compatible HTTP server for exercising the Supabase clients.
+
+Serves ``/rest/v1/<table>`` from in-memory rows: GET with ``col=eq.value``
+and ``col=in.(a,b)`` filters, POST (insert), PATCH and DELETE with the same
+filters. Connections are HTTP/1.1 keep-alive; the server counts the TCP
+connections it accepts so a benchmark can measure connection churn, and
+``latency_ms`` adds a fixed delay to every response. The ``apikey`` header
+of the latest request is kept in ``last_apikey``.
+
+Usage:
+    python benchmarks/postgrest_stub.py --port 54321 --latency-ms 5
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+def _coerce(value):
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _matches(row, filters):
+    for column, condition in filters:
+        op, _, operand = condition.partition('.')
+        if op == 'eq' and row.get(column) != _coerce(operand):
+            return False
+        if op == 'in' and row.get(column) not in {_coerce(v) for v in operand.strip('()').split(',') if v}:
+            return False
+    return True
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, tables=None, latency_ms=0.0):
+        super().__init__(address, StubHandler)
+        self.tables = tables if tables is not None else {}
+        self.latency = latency_ms / 1000.0
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.last_apikey = None
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _parse(self):
+        with self.server.lock:
+            self.server.last_apikey = self.headers.get('apikey')
+        parts = urlsplit(self.path)
+        if not parts.path.startswith('/rest/v1/'):
+            return None, []
+        table = parts.path[len('/rest/v1/'):]
+        filters = [(k, v) for k, v in parse_qsl(parts.query) if k not in ('select', 'order', 'limit', 'offset')]
+        return table, filters
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'null') if length else None
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        with self.server.lock:
+            self.server.requests += 1
+
+    def do_GET(self):
+        table, filters = self._parse()
+        if table is None:
+            return self._send(404, {'message': 'not found'})
+        with self.server.lock:
+            rows = [r for r in self.server.tables.get(table, []) if _matches(r, filters)]
+        self._send(200, rows)
+
+    def do_POST(self):
+        table, _ = self._parse()
+        body = self._body()
+        rows = body if isinstance(body, list) else [body]
+        with self.server.lock:
+            existing = self.server.tables.setdefault(table, [])
+            for row in rows:
+                row.setdefault('id', max((r.get('id', 0) for r in existing), default=0) + 1)
+                existing.append(row)
+        self._send(201, rows)
+
+    def do_PATCH(self):
+        table, filters = self._parse()
+        changes = self._body() or {}
+        with self.server.lock:
+            rows = [r for r in self.server.tables.get(table, []) if _matches(r, filters)]
+            for row in rows:
+                row.update(changes)
+        self._send(200, rows)
+
+    def do_DELETE(self):
+        table, filters = self._parse()
+        with self.server.lock:
+            rows = self.server.tables.get(table, [])
+            removed = [r for r in rows if _matches(r, filters)]
+            self.server.tables[table] = [r for r in rows if not _matches(r, filters)]
+        self._send(200, removed)
+
+
+def start(tables=None, latency_ms=0.0, port=0):
+    """Serve on a daemon thread; returns the server (``server.url``, ``server.shutdown()``)."""
+    server = StubServer(('127.0.0.1', port), tables, latency_ms)
+    threading.Thread(target=server.serve_forever, name='postgrest-stub', daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=54321)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='delay added to every response')
+    args = parser.parse_args(argv)
+    server = StubServer(('127.0.0.1', args.port), latency_ms=args.latency_ms)
+    print(f"PostgREST stub at {server.url}/rest/v1/")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
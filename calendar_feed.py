@@ -0,0 +1,213 @@
+"""iCalendar feeds of each homestay's bookings for other booking platforms.
+
+``/homestay/<id>/calendar.ics`` lists every approved or pending booking that
+has not ended more than ``PAST_DAYS`` ago as an all-day event (check-in to
+check-out, beds in the summary, no guest details). External platforms poll
+it often, so ``FeedCache`` keeps per homestay:
+
+* the feed's ETag, a hash of the bookings in it, so every worker computes
+  the same tag for the same bookings
+* its Last-Modified, the time this worker first saw that ETag
+* the rendered body, once it has been streamed in full
+
+A poll with a matching ``If-None-Match``/``If-Modified-Since`` is answered
+304 without a query. Booking and homestay writes drop the affected entries
+(``on_store_change``); entries also expire after ``ttl`` seconds so other
+workers' writes show up.
+"""
+
+import hashlib
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+
+PRODID = '-//Kangundi HomeStay//Availability//EN'
+UID_DOMAIN = 'kangundi-homestay'
+FEED_STATUSES = ('approved', 'pending')
+PAST_DAYS = 30
+CACHE_SECONDS = 300
+MIMETYPE = 'text/calendar'
+
+
+def _escape(text):
+    return (str(text).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _fold(line):
+    """Fold a content line at 75 octets as RFC 5545 requires; returns it CRLF-terminated."""
+    data = line.encode()
+    if len(data) <= 75:
+        return line + '\r\n'
+    parts, start, limit = [], 0, 75
+    while start < len(data):
+        end = min(start + limit, len(data))
+        while end < len(data) and (data[end] & 0xC0) == 0x80:
+            end -= 1  # never split a UTF-8 sequence
+        parts.append(data[start:end].decode())
+        start, limit = end, 74  # continuation lines start with a space
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _date(value):
+    return date.fromisoformat(str(value)[:10]).strftime('%Y%m%d')
+
+
+def _stamp(value):
+    try:
+        moment = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        moment = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _event_key(booking):
+    return (booking.get('id'), str(booking.get('from_date')), str(booking.get('till_date')),
+            booking.get('beds_booked') or 1, booking.get('status'), str(booking.get('created_at')))
+
+
+def load_bookings(store, homestay_id, today=None):
+    """Bookings that belong in the feed, ordered by check-in (one indexed query)."""
+    start = (today or date.today()) - timedelta(days=PAST_DAYS)
+    rows = store.bookings.list_active_for_homestay(homestay_id, FEED_STATUSES, from_date=start.isoformat())
+    valid = []
+    for booking in rows:
+        try:
+            if date.fromisoformat(str(booking['till_date'])[:10]) > date.fromisoformat(str(booking['from_date'])[:10]):
+                valid.append(booking)
+        except (KeyError, TypeError, ValueError):
+            continue
+    return sorted(valid, key=lambda b: (str(b['from_date']), b.get('id') or 0))
+
+
+def feed_etag(homestay, bookings):
+    digest = hashlib.sha1(repr((homestay.get('id'), homestay.get('owner'), [_event_key(b) for b in bookings])).encode())
+    return digest.hexdigest()
+
+
+def render_feed(homestay, bookings):
+    """Yield the feed in chunks: the calendar header, one VEVENT per booking, the footer."""
+    name = f"{homestay.get('owner') or 'Homestay'} - Kangundi HomeStay"
+    yield ''.join(_fold(line) for line in (
+        'BEGIN:VCALENDAR', 'VERSION:2.0', f'PRODID:{PRODID}', 'CALSCALE:GREGORIAN', 'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{_escape(name)}',
+    ))
+    for booking in bookings:
+        beds = booking.get('beds_booked') or 1
+        yield ''.join(_fold(line) for line in (
+            'BEGIN:VEVENT',
+            f"UID:booking-{booking.get('id')}@{UID_DOMAIN}",
+            f"DTSTAMP:{_stamp(booking.get('created_at'))}",
+            f"DTSTART;VALUE=DATE:{_date(booking['from_date'])}",
+            f"DTEND;VALUE=DATE:{_date(booking['till_date'])}",
+            f"SUMMARY:{_escape(f'Booked: {beds} bed(s)')}",
+            f"STATUS:{'CONFIRMED' if booking.get('status') == 'approved' else 'TENTATIVE'}",
+            'TRANSP:OPAQUE',
+            'END:VEVENT',
+        ))
+    yield _fold('END:VCALENDAR')
+
+
+class FeedEntry:
+    __slots__ = ('etag', 'last_modified', 'built_at', 'homestay', 'bookings', 'body')
+
+    def __init__(self, etag, last_modified, built_at, homestay, bookings):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.built_at = built_at
+        self.homestay = homestay
+        self.bookings = bookings
+        self.body = None
+
+
+class FeedCache:
+    def __init__(self, ttl=CACHE_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._last_seen = {}
+        self._versions = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.invalidations = 0
+
+    def get(self, store, homestay_id):
+        """Current ``FeedEntry`` of a homestay (None if it does not exist); two queries on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(homestay_id)
+            if entry and now - entry.built_at < self.ttl:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            version = (self._generation, self._versions.get(homestay_id, 0))
+
+        homestay = store.homestays.get(homestay_id)
+        if not homestay:
+            return None
+        bookings = load_bookings(store, homestay_id)
+        etag = feed_etag(homestay, bookings)
+        with self._lock:
+            seen = self._last_seen.get(homestay_id)
+            if seen and seen[0] == etag:
+                last_modified = seen[1]
+            else:
+                last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+                self._last_seen[homestay_id] = (etag, last_modified)
+            entry = FeedEntry(etag, last_modified, now, homestay, bookings)
+            # Only keep it if no write to this homestay happened meanwhile
+            if (self._generation, self._versions.get(homestay_id, 0)) == version:
+                self._entries[homestay_id] = entry
+        return entry
+
+    def stream(self, entry):
+        """Yield the feed body; the first complete render is kept on ``entry``."""
+        if entry.body is not None:
+            yield entry.body
+            return
+        chunks = []
+        for chunk in render_feed(entry.homestay, entry.bookings):
+            chunks.append(chunk)
+            yield chunk
+        entry.body = ''.join(chunks)
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def invalidate(self, homestay_id=None):
+        with self._lock:
+            self.invalidations += 1
+            if homestay_id is None:
+                self._generation += 1
+                self._entries.clear()
+            else:
+                self._entries.pop(homestay_id, None)
+                self._versions[homestay_id] = self._versions.get(homestay_id, 0) + 1
+
+    def on_store_change(self, table, operation, rows, args):
+        if table == 'bookings':
+            ids = {row.get('homestay_id') for row in rows if row.get('homestay_id') is not None}
+            if not ids:
+                self.invalidate()
+            for homestay_id in ids:
+                self.invalidate(int(homestay_id))
+        elif table == 'homestays' and operation in ('update', 'delete') and args:
+            self.invalidate(int(args[0]))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'invalidations': self.invalidations,
+            }
+
+
+cache = FeedCache()
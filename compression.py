@@ -0,0 +1,153 @@
+"""Response compression and HTML minification.
+
+``Compressor.init_app(app)`` compresses HTML, JSON and iCalendar responses of at least
+``min_bytes`` after the view has run. Brotli is used when the client
+accepts it and the ``brotli`` package is installed, otherwise gzip.
+Streamed and file responses (exports, static files) and responses that
+already have a ``Content-Encoding`` are left alone.
+
+``MinifyingLoader`` strips indentation and blank lines from ``.html``
+templates when Jinja loads them. Jinja caches the compiled template, so
+each template is minified once and the static text it renders costs nothing
+extra per request. ``<pre>`` and ``<textarea>`` contents are kept as written.
+"""
+
+import gzip
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import request
+from jinja2 import BaseLoader
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is used without it
+    brotli = None
+
+MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+MIMETYPES = frozenset({'text/html', 'application/json', 'text/calendar'})
+
+_PRESERVED = re.compile(r'(<(pre|textarea)\b.*?</\2\s*>)', re.IGNORECASE | re.DOTALL)
+_INDENT = re.compile(r'^[ \t]+|[ \t]+$', re.MULTILINE)
+_BLANK_LINES = re.compile(r'\n{2,}')
+
+
+def minify_html(source):
+    """Drop indentation, trailing spaces and blank lines outside ``<pre>``/``<textarea>``."""
+    parts = _PRESERVED.split(source)
+    out = []
+    # split() yields text, whole preserved block, tag name, text, ...
+    for i in range(0, len(parts), 3):
+        out.append(_BLANK_LINES.sub('\n', _INDENT.sub('', parts[i])))
+        if i + 1 < len(parts):
+            out.append(parts[i + 1])
+    return ''.join(out)
+
+
+class MinifyingLoader(BaseLoader):
+    """Jinja loader that returns minified ``.html`` sources of another loader."""
+
+    def __init__(self, loader):
+        self.loader = loader
+        self._lock = threading.Lock()
+        self.templates = {}
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = self.loader.get_source(environment, template)
+        if template.endswith('.html'):
+            minified = minify_html(source)
+            with self._lock:
+                self.templates[template] = (len(source.encode()), len(minified.encode()))
+            source = minified
+        return source, filename, uptodate
+
+    def list_templates(self):
+        return self.loader.list_templates()
+
+    def stats(self):
+        with self._lock:
+            before = sum(b for b, _ in self.templates.values())
+            after = sum(a for _, a in self.templates.values())
+            return {
+                'templates': len(self.templates),
+                'source_bytes': before,
+                'minified_bytes': after,
+                'bytes_saved': before - after,
+            }
+
+
+class Compressor:
+    def __init__(self, min_bytes=MIN_BYTES, gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY, mimetypes=MIMETYPES):
+        self.min_bytes = min_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.mimetypes = frozenset(mimetypes)
+        self._lock = threading.Lock()
+        self.responses = Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+        return self
+
+    def _encoding(self):
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br']:
+            return 'br'
+        if accepted['gzip']:
+            return 'gzip'
+        return None
+
+    def _compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=self.brotli_quality)
+        return gzip.compress(data, compresslevel=self.gzip_level, mtime=0)
+
+    def after_request(self, response):
+        if (response.direct_passthrough or response.is_streamed
+                or response.mimetype not in self.mimetypes
+                or response.status_code < 200 or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self._encoding()
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_bytes:
+            return response
+
+        started = time.perf_counter()
+        compressed = self._compress(data, encoding)
+        elapsed = time.perf_counter() - started
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            # The bytes differ from the identity encoding; a weak tag still matches If-None-Match
+            response.set_etag(etag, weak=True)
+        with self._lock:
+            self.responses[encoding] += 1
+            self.bytes_in += len(data)
+            self.bytes_out += len(compressed)
+            self.seconds += elapsed
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {
+                'brotli_available': brotli is not None,
+                'min_bytes': self.min_bytes,
+                'responses': dict(self.responses),
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'bytes_saved': self.bytes_in - self.bytes_out,
+                'ratio': round(self.bytes_out / self.bytes_in, 4) if self.bytes_in else 0.0,
+                'compress_ms': round(self.seconds * 1000, 2),
+            }
@@ -0,0 +1,889 @@
+"""Data-access layer for Kangundi HomeStay.
+
+Routes talk to ``store.users``, ``store.homestays``, ``store.bookings``,
+``store.payments``, ``store.pricing_rules`` and ``store.inauguration``
+instead of calling Supabase directly. Two backends implement the same interfaces:
+
+* ``supabase`` - production backend (PostgREST through supabase-py)
+* ``sqlite``   - local, indexed SQLite database for offline benchmarking
+
+Pick one with the ``DATA_BACKEND`` setting (see ``create_datastore``).
+Every backend counts the queries it issues in ``store.stats`` so request
+cost can be measured without a live service.
+"""
+
+import logging
+import re
+import threading
+from collections import Counter
+from functools import wraps
+
+log = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """Thread-safe counter of queries issued, keyed by ``table.operation``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def record(self, table, operation):
+        with self._lock:
+            self._counts[f"{table}.{operation}"] += 1
+
+    @property
+    def total(self):
+        with self._lock:
+            return sum(self._counts.values())
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+# --- Repository interfaces ---
+
+class Repository:
+    """Base class for all repositories; records every query in ``stats``.
+
+    ``write_methods`` lists the methods that change data; the store wraps
+    them so change listeners hear about every write.
+    """
+
+    table = None
+    write_methods = ()
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def _count(self, operation):
+        self.stats.record(self.table, operation)
+
+
+class UsersRepository(Repository):
+    table = 'users'
+    write_methods = ('create',)
+
+    def get_by_email(self, email):
+        raise NotImplementedError
+
+    def get_by_username(self, username):
+        raise NotImplementedError
+
+    def get_by_phone(self, phone_number):
+        raise NotImplementedError
+
+    def create(self, data):
+        """Insert a user; returns the inserted row or None."""
+        raise NotImplementedError
+
+
+class HomestaysRepository(Repository):
+    table = 'homestays'
+    write_methods = ('create', 'update', 'delete')
+
+    def list_all(self):
+        raise NotImplementedError
+
+    def get(self, homestay_id):
+        raise NotImplementedError
+
+    def get_many(self, homestay_ids):
+        """Return ``{id: homestay}`` for the given ids in a single query."""
+        raise NotImplementedError
+
+    def create(self, data):
+        raise NotImplementedError
+
+    def update(self, homestay_id, data):
+        """Update a homestay; returns the updated row or None."""
+        raise NotImplementedError
+
+    def delete(self, homestay_id):
+        raise NotImplementedError
+
+
+class BookingsRepository(Repository):
+    table = 'bookings'
+    write_methods = ('create', 'update', 'update_many', 'delete_many', 'set_bed_assignment')
+
+    def get(self, booking_id):
+        raise NotImplementedError
+
+    def create(self, data):
+        raise NotImplementedError
+
+    def update(self, booking_id, data):
+        raise NotImplementedError
+
+    def set_bed_assignment(self, booking_id, assignment, expected=None):
+        """Save ``assignment`` only if ``bed_assignment`` is still ``expected`` (None: empty).
+
+        Returns the updated row, or None if another writer got there first.
+        """
+        raise NotImplementedError
+
+    def update_many(self, booking_ids, data, only_statuses=None):
+        """Apply ``data`` to many bookings in one statement; returns the updated rows.
+
+        With ``only_statuses`` only bookings currently in one of those
+        statuses are touched.
+        """
+        raise NotImplementedError
+
+    def list_by_order_ids(self, order_ids):
+        """Bookings linked to any of the given payment order ids."""
+        raise NotImplementedError
+
+    def list_stale_pending(self, created_before, checkin_before, after_id=None, limit=200):
+        """Pending bookings (ordered by id, after ``after_id``) that should no longer hold beds.
+
+        Matches bookings created before ``created_before`` with no txn_id,
+        screenshot or payment order, and any pending booking whose
+        from_date is before ``checkin_before``.
+        """
+        raise NotImplementedError
+
+    def get_many(self, booking_ids):
+        """Return ``{id: booking}`` for the given ids in a single query."""
+        raise NotImplementedError
+
+    def page(self, after_id=None, limit=500, from_date=None, till_date=None, statuses=None):
+        """One keyset page of bookings ordered by id, starting after ``after_id``.
+
+        ``from_date``/``till_date`` bound the stay's from_date (inclusive).
+        """
+        raise NotImplementedError
+
+    def list_all(self, desc=True):
+        """All bookings ordered by from_date."""
+        raise NotImplementedError
+
+    def list_for_user(self, email=None, phone=None, name=None):
+        """Bookings of one guest, matched by email, then phone, then name."""
+        raise NotImplementedError
+
+    def list_active_for_homestay(self, homestay_id, statuses, from_date=None, till_date=None):
+        """Bookings of a homestay in ``statuses`` overlapping [from_date, till_date)."""
+        raise NotImplementedError
+
+    def list_archivable(self, till_before, statuses, after_id=None, limit=500):
+        """Bookings in ``statuses`` whose stay ended before ``till_before``, ordered by id."""
+        raise NotImplementedError
+
+    def delete_many(self, booking_ids):
+        """Delete bookings by id; returns the deleted rows."""
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+
+class ArchivedBookingsRepository(Repository):
+    """Past stays moved out of ``bookings`` by ``archive.py``; same columns plus ``archived_at``."""
+
+    table = 'bookings_archive'
+    write_methods = ('insert_many',)
+
+    def insert_many(self, rows):
+        """Insert rows keeping their ids; rows already archived are overwritten."""
+        raise NotImplementedError
+
+    def get_many(self, booking_ids):
+        raise NotImplementedError
+
+    def page(self, after_id=None, limit=500, from_date=None, till_date=None, statuses=None):
+        raise NotImplementedError
+
+    def list_all(self, desc=True):
+        raise NotImplementedError
+
+    def list_for_user(self, email=None, phone=None, name=None):
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+
+class PaymentsRepository(Repository):
+    table = 'payments'
+    write_methods = ('create', 'upsert', 'mark_reconciled')
+
+    def get_status(self, order_id):
+        raise NotImplementedError
+
+    def create(self, data):
+        raise NotImplementedError
+
+    def upsert(self, data):
+        """Insert or update a payment keyed by order_id."""
+        raise NotImplementedError
+
+    def list_unreconciled(self, statuses, after_order_id=None, limit=100):
+        """Payments in ``statuses`` not yet linked to bookings, in order_id order."""
+        raise NotImplementedError
+
+    def mark_reconciled(self, order_ids, reconciled_at):
+        raise NotImplementedError
+
+    def get_many_by_order_ids(self, order_ids):
+        """Return ``{order_id: payment}`` in a single query."""
+        raise NotImplementedError
+
+
+class InaugurationRepository(Repository):
+    table = 'inauguration'
+    write_methods = ('set_status', 'ensure_row')
+
+    def get_status(self):
+        """Return the status of the single inauguration row, or None."""
+        raise NotImplementedError
+
+    def set_status(self, status):
+        raise NotImplementedError
+
+    def ensure_row(self, default_status='no'):
+        """Insert the inauguration row if the table is empty."""
+        raise NotImplementedError
+
+
+class PaymentReferencesRepository(Repository):
+    """Durable index of UPI transaction references (UTRs and screenshot hashes).
+
+    One row per (kind, reference, booking_id); lookups go through the
+    (kind, reference) key so the same reference on several bookings is
+    found with a single indexed query.
+    """
+
+    table = 'payment_references'
+    write_methods = ('register',)
+
+    def register(self, kind, reference, booking_id, created_at=None):
+        """Record ``reference`` for ``booking_id``.
+
+        Returns the ids of *other* bookings that already carry the same
+        reference (an empty list means it is unique).
+        """
+        raise NotImplementedError
+
+    def lookup_many(self, kind, references):
+        """Return ``{reference: [rows]}`` for every known reference in one query."""
+        raise NotImplementedError
+
+    def list_for_bookings(self, booking_ids):
+        raise NotImplementedError
+
+
+class PricingRulesRepository(Repository):
+    """Rate adjustments used by the pricing engine (see ``pricing.py``).
+
+    A rule with no ``homestay_id`` applies to every homestay.
+    """
+
+    table = 'pricing_rules'
+    write_methods = ('create', 'delete')
+
+    def list_all(self):
+        raise NotImplementedError
+
+    def list_for_homestays(self, homestay_ids):
+        """Rules for any of ``homestay_ids`` plus the global rules, in one query."""
+        raise NotImplementedError
+
+    def create(self, data):
+        raise NotImplementedError
+
+    def delete(self, rule_id):
+        raise NotImplementedError
+
+
+class CalendarSourcesRepository(Repository):
+    """External iCalendar feeds imported as holds (see ``ical_import.py``)."""
+
+    table = 'calendar_sources'
+    write_methods = ('create', 'update', 'delete')
+
+    def list_all(self):
+        raise NotImplementedError
+
+    def get(self, source_id):
+        raise NotImplementedError
+
+    def create(self, data):
+        raise NotImplementedError
+
+    def update(self, source_id, data):
+        raise NotImplementedError
+
+    def delete(self, source_id):
+        raise NotImplementedError
+
+
+class ExternalHoldsRepository(Repository):
+    """Beds held by bookings made on other platforms, one row per imported event.
+
+    Rows are unique per ``(source_id, uid)``.
+    """
+
+    table = 'external_holds'
+    write_methods = ('upsert_many', 'delete_many', 'delete_for_source')
+
+    def list_for_source(self, source_id):
+        raise NotImplementedError
+
+    def list_active(self, after_date):
+        """Holds of every homestay ending after ``after_date``."""
+        raise NotImplementedError
+
+    def upsert_many(self, rows):
+        """Insert or update holds keyed by ``(source_id, uid)``; returns the written rows."""
+        raise NotImplementedError
+
+    def delete_many(self, hold_ids):
+        """Delete holds by id; returns the deleted rows."""
+        raise NotImplementedError
+
+    def delete_for_source(self, source_id):
+        raise NotImplementedError
+
+
+def _public_methods(repo):
+    return [
+        name for name in dir(type(repo))
+        if not name.startswith('_') and callable(getattr(type(repo), name))
+    ]
+
+
+class DataStore:
+    """Bundle of repositories for one backend."""
+
+    REPOSITORIES = ('users', 'homestays', 'bookings', 'bookings_archive', 'payments', 'payment_refs', 'inauguration',
+                    'pricing_rules', 'calendar_sources', 'external_holds')
+
+    def __init__(self, backend, stats, **repositories):
+        self.backend = backend
+        self.stats = stats
+        self._listeners = []
+        for name in self.REPOSITORIES:
+            repo = repositories[name]
+            for method in repo.write_methods:
+                setattr(repo, method, self._notifying(repo.table, method, getattr(repo, method)))
+            setattr(self, name, repo)
+
+    def wrap_methods(self, wrapper):
+        """Replace every public repository method with ``wrapper(table, method, is_write, func)``.
+
+        Layers cross-cutting behaviour (timeouts, caching) over any backend.
+        Writes are wrapped outside the change notification.
+        """
+        for name in self.REPOSITORIES:
+            repo = getattr(self, name)
+            for method in _public_methods(repo):
+                func = getattr(repo, method)
+                setattr(repo, method, wrapper(repo.table, method, method in repo.write_methods, func))
+
+    def on_change(self, listener):
+        """Call ``listener(table, operation, rows, args)`` after every successful write.
+
+        ``rows`` are the rows the write returned (may be empty) and ``args``
+        the positional arguments it was called with (e.g. the id for updates).
+        """
+        self._listeners.append(listener)
+        return listener
+
+    def _notifying(self, table, operation, method):
+        @wraps(method)
+        def write(*args, **kwargs):
+            result = method(*args, **kwargs)
+            if self._listeners:
+                if isinstance(result, dict):
+                    rows = [result]
+                elif isinstance(result, list) and all(isinstance(r, dict) for r in result):
+                    rows = result
+                else:
+                    rows = []
+                for listener in list(self._listeners):
+                    try:
+                        listener(table, operation, rows, args)
+                    except Exception:
+                        log.exception("Change listener error (%s.%s)", table, operation)
+            return result
+        return write
+
+
+# --- Supabase backend ---
+
+def _first(response):
+    return response.data[0] if response.data else None
+
+
+class SupabaseUsers(UsersRepository):
+    def __init__(self, stats, client):
+        super().__init__(stats)
+        self.client = client
+
+    def _get_by(self, column, value):
+        self._count('select')
+        return _first(self.client.table('users').select('*').eq(column, value).execute())
+
+    def get_by_email(self, email):
+        return self._get_by('email', email)
+
+    def get_by_username(self, username):
+        return self._get_by('username', username)
+
+    def get_by_phone(self, phone_number):
+        return self._get_by('phone_number', phone_number)
+
+    def create(self, data):
+        self._count('insert')
+        return _first(self.client.table('users').insert(data).execute())
+
+
+class SupabaseHomestays(HomestaysRepository):
+    def __init__(self, stats, client):
+        super().__init__(stats)
+        self.client = client
+
+    def list_all(self):
+        self._count('select')
+        response = self.client.table('homestays').select('*').execute()
+        return response.data or []
+
+    def get(self, homestay_id):
+        self._count('select')
+        return _first(self.client.table('homestays').select('*').eq('id', homestay_id).execute())
+
+    def get_many(self, homestay_ids):
+        ids = list({i for i in homestay_ids if i is not None})
+        if not ids:
+            return {}
+        self._count('select')
+        response = self.client.table('homestays').select('*').in_('id', ids).execute()
+        return {row['id']: row for row in (response.data or [])}
+
+    def create(self, data):
+        self._count('insert')
+        return _first(self.client.table('homestays').insert(data).execute())
+
+    def update(self, homestay_id, data):
+        self._count('update')
+        return _first(self.client.table('homestays').update(data).eq('id', homestay_id).execute())
+
+    def delete(self, homestay_id):
+        self._count('delete')
+        self.client.table('homestays').delete().eq('id', homestay_id).execute()
+
+
+class SupabaseBookings(BookingsRepository):
+    def __init__(self, stats, client):
+        super().__init__(stats)
+        self.client = client
+
+    def get(self, booking_id):
+        self._count('select')
+        return _first(self.client.table('bookings').select('*').eq('id', booking_id).execute())
+
+    def create(self, data):
+        self._count('insert')
+        try:
+            return _first(self.client.table('bookings').insert(data).execute())
+        except Exception as e:
+            # If the schema is missing a column, retry once without it
+            match = re.search(r"Could not find the '(\w+)' column of 'bookings'", str(e))
+            if not match or match.group(1) not in data:
+                raise
+            missing_col = match.group(1)
+            log.warning("Column '%s' not found in bookings table. Please add it to Supabase or the field will be skipped.", missing_col)
+            self._count('insert')
+            filtered = {k: v for k, v in data.items() if k != missing_col}
+            return _first(self.client.table('bookings').insert(filtered).execute())
+
+    def update(self, booking_id, data):
+        self._count('update')
+        return _first(self.client.table('bookings').update(data).eq('id', booking_id).execute())
+
+    def set_bed_assignment(self, booking_id, assignment, expected=None):
+        query = self.client.table('bookings').update({'bed_assignment': assignment}).eq('id', booking_id)
+        if expected:
+            query = query.eq('bed_assignment', expected)
+        else:
+            query = query.or_('bed_assignment.is.null,bed_assignment.eq.""')
+        self._count('update')
+        return _first(query.execute())
+
+    def update_many(self, booking_ids, data, only_statuses=None):
+        ids = list(booking_ids)
+        if not ids:
+            return []
+        query = self.client.table('bookings').update(data).in_('id', ids)
+        if only_statuses:
+            query = query.in_('status', list(only_statuses))
+        self._count('update')
+        return query.execute().data or []
+
+    def list_by_order_ids(self, order_ids):
+        ids = list(order_ids)
+        if not ids:
+            return []
+        self._count('select')
+        return self.client.table('bookings').select('*').in_('order_id', ids).execute().data or []
+
+    def list_stale_pending(self, created_before, checkin_before, after_id=None, limit=200):
+        query = self.client.table('bookings').select('*').eq('status', 'pending').or_(
+            f'and(created_at.lt."{created_before}",txn_id.is.null,screenshot.is.null,order_id.is.null),'
+            f'from_date.lt.{checkin_before}'
+        )
+        if after_id is not None:
+            query = query.gt('id', after_id)
+        self._count('select')
+        return query.order('id').limit(limit).execute().data or []
+
+    def get_many(self, booking_ids):
+        ids = list({i for i in booking_ids if i is not None})
+        if not ids:
+            return {}
+        self._count('select')
+        response = self.client.table('bookings').select('*').in_('id', ids).execute()
+        return {row['id']: row for row in (response.data or [])}
+
+    def page(self, after_id=None, limit=500, from_date=None, till_date=None, statuses=None):
+        query = self.client.table('bookings').select('*')
+        if after_id is not None:
+            query = query.gt('id', after_id)
+        if from_date:
+            query = query.gte('from_date', from_date)
+        if till_date:
+            query = query.lte('from_date', till_date)
+        if statuses:
+            query = query.in_('status', list(statuses))
+        self._count('select')
+        return query.order('id').limit(limit).execute().data or []
+
+    def list_all(self, desc=True):
+        self._count('select')
+        response = self.client.table('bookings').select('*').order('from_date', desc=desc).execute()
+        return response.data or []
+
+    def list_for_user(self, email=None, phone=None, name=None):
+        query = self.client.table('bookings').select('*')
+        if email:
+            query = query.eq('user_email', email)
+        elif phone:
+            query = query.eq('user_phone', phone)
+        elif name:
+            query = query.eq('user_name', name)
+        self._count('select')
+        response = query.order('from_date', desc=False).execute()
+        return response.data or []
+
+    def list_active_for_homestay(self, homestay_id, statuses, from_date=None, till_date=None):
+        query = self.client.table('bookings').select('*').eq('homestay_id', homestay_id).in_('status', list(statuses))
+        if till_date:
+            query = query.lt('from_date', till_date)
+        if from_date:
+            query = query.gt('till_date', from_date)
+        self._count('select')
+        return query.execute().data or []
+
+    def list_archivable(self, till_before, statuses, after_id=None, limit=500):
+        query = self.client.table('bookings').select('*').in_('status', list(statuses)).lt('till_date', till_before)
+        if after_id is not None:
+            query = query.gt('id', after_id)
+        self._count('select')
+        return query.order('id').limit(limit).execute().data or []
+
+    def delete_many(self, booking_ids):
+        ids = list(booking_ids)
+        if not ids:
+            return []
+        self._count('delete')
+        return self.client.table('bookings').delete().in_('id', ids).execute().data or []
+
+    def count(self):
+        self._count('select')
+        return self.client.table('bookings').select('id', count='exact').limit(1).execute().count or 0
+
+
+class SupabaseArchivedBookings(ArchivedBookingsRepository):
+    def __init__(self, stats, client):
+        super().__init__(stats)
+        self.client = client
+
+    def insert_many(self, rows):
+        rows = list(rows)
+        if not rows:
+            return []
+        self._count('upsert')
+        return self.client.table('bookings_archive').upsert(rows, on_conflict='id').execute().data or []
+
+    def get_many(self, booking_ids):
+        ids = list({i for i in booking_ids if i is not None})
+        if not ids:
+            return {}
+        self._count('select')
+        response = self.client.table('bookings_archive').select('*').in_('id', ids).execute()
+        return {row['id']: row for row in (response.data or [])}
+
+    def page(self, after_id=None, limit=500, from_date=None, till_date=None, statuses=None):
+        query = self.client.table('bookings_archive').select('*')
+        if after_id is not None:
+            query = query.gt('id', after_id)
+        if from_date:
+            query = query.gte('from_date', from_date)
+        if till_date:
+            query = query.lte('from_date', till_date)
+        if statuses:
+            query = query.in_('status', list(statuses))
+        self._count('select')
+        return query.order('id').limit(limit).execute().data or []
+
+    def list_all(self, desc=True):
+        self._count('select')
+        return self.client.table('bookings_archive').select('*').order('from_date', desc=desc).execute().data or []
+
+    def list_for_user(self, email=None, phone=None, name=None):
+        query = self.client.table('bookings_archive').select('*')
+        if email:
+            query = query.eq('user_email', email)
+        elif phone:
+            query = query.eq('user_phone', phone)
+        elif name:
+            query = query.eq('user_name', name)
+        self._count('select')
+        return query.order('from_date', desc=False).execute().data or []
+
+    def count(self):
+        self._count('select')
+        return self.client.table('bookings_archive').select('id', count='exact').limit(1).execute().count or 0
+
+
+class SupabasePayments(PaymentsRepository):
+    def __init__(self, stats, client):
+        super().__init__(stats)
+        self.client = client
+
+    def get_status(self, order_id):
+        self._count('select')
+        row = _first(self.client.table('payments').select('status').eq('order_id', order_id).limit(1).execute())
+        return row['status'] if row else None
+
+    def create(self, data):
+        self._count('insert')
+        return _first(self.client.table('payments').insert(data).execute())
+
+    def upsert(self, data):
+        self._count('upsert')
+        return _first(self.client.table('payments').upsert(data, on_conflict='order_id').execute())
+
+    def list_unreconciled(self, statuses, after_order_id=None, limit=100):
+        query = self.client.table('payments').select('*').is_('reconciled_at', 'null').in_('status', list(statuses))
+        if after_order_id is not None:
+            query = query.gt('order_id', after_order_id)
+        self._count('select')
+        return query.order('order_id').limit(limit).execute().data or []
+
+    def mark_reconciled(self, order_ids, reconciled_at):
+        ids = list(order_ids)
+        if not ids:
+            return
+        self._count('update')
+        self.client.table('payments').update({'reconciled_at': reconciled_at}).in_('order_id', ids).execute()
+
+    def get_many_by_order_ids(self, order_ids):
+        ids = list({i for i in order_ids if i})
+        if not ids:
+            return {}
+        self._count('select')
+        rows = self.client.table('payments').select('*').in_('order_id', ids).execute().data or []
+        return {row['order_id']: row for row in rows}
+
+
+class SupabasePaymentReferences(PaymentReferencesRepository):
+    def __init__(self, stats, client):
+        super().__init__(stats)
+        self.client = client
+
+    def register(self, kind, reference, booking_id, created_at=None):
+        booking_id = str(booking_id)
+        # Insert first, then read every holder: of two bookings registering the
+        # same reference at once, the later read always sees the other
+        self._count('upsert')
+        self.client.table('payment_references').upsert(
+            {'kind': kind, 'reference': reference, 'booking_id': booking_id, 'created_at': created_at},
+            on_conflict='kind,reference,booking_id',
+            ignore_duplicates=True,
+        ).execute()
+        self._count('select')
+        rows = self.client.table('payment_references').select('booking_id').eq('kind', kind).eq('reference', reference).execute().data or []
+        return sorted({row['booking_id'] for row in rows} - {booking_id})
+
+    def lookup_many(self, kind, references):
+        refs = list(set(references))
+        if not refs:
+            return {}
+        self._count('select')
+        rows = self.client.table('payment_references').select('*').eq('kind', kind).in_('reference', refs).execute().data or []
+        found = {}
+        for row in rows:
+            found.setdefault(row['reference'], []).append(row)
+        return found
+
+    def list_for_bookings(self, booking_ids):
+        ids = [str(i) for i in set(booking_ids)]
+        if not ids:
+            return []
+        self._count('select')
+        return self.client.table('payment_references').select('*').in_('booking_id', ids).execute().data or []
+
+
+class SupabaseInauguration(InaugurationRepository):
+    def __init__(self, stats, client):
+        super().__init__(stats)
+        self.client = client
+
+    def get_status(self):
+        self._count('select')
+        row = _first(self.client.table('inauguration').select('status').limit(1).execute())
+        return row['status'] if row else None
+
+    def set_status(self, status):
+        self._count('select')
+        row = _first(self.client.table('inauguration').select('id').limit(1).execute())
+        if row:
+            self._count('update')
+            self.client.table('inauguration').update({'status': status}).eq('id', row['id']).execute()
+        else:
+            self._count('insert')
+            self.client.table('inauguration').insert({'status': status}).execute()
+
+    def ensure_row(self, default_status='no'):
+        self._count('select')
+        if not self.client.table('inauguration').select('*').limit(1).execute().data:
+            self._count('insert')
+            self.client.table('inauguration').insert({'status': default_status}).execute()
+
+
+class SupabasePricingRules(PricingRulesRepository):
+    def __init__(self, stats, client):
+        super().__init__(stats)
+        self.client = client
+
+    def list_all(self):
+        self._count('select')
+        return self.client.table('pricing_rules').select('*').order('id').execute().data or []
+
+    def list_for_homestays(self, homestay_ids):
+        ids = sorted({int(i) for i in homestay_ids if i is not None})
+        self._count('select')
+        query = self.client.table('pricing_rules').select('*')
+        if ids:
+            query = query.or_(f"homestay_id.is.null,homestay_id.in.({','.join(map(str, ids))})")
+        else:
+            query = query.is_('homestay_id', 'null')
+        return query.order('id').execute().data or []
+
+    def create(self, data):
+        self._count('insert')
+        return _first(self.client.table('pricing_rules').insert(data).execute())
+
+    def delete(self, rule_id):
+        self._count('delete')
+        self.client.table('pricing_rules').delete().eq('id', rule_id).execute()
+
+
+class SupabaseCalendarSources(CalendarSourcesRepository):
+    def __init__(self, stats, client):
+        super().__init__(stats)
+        self.client = client
+
+    def list_all(self):
+        self._count('select')
+        return self.client.table('calendar_sources').select('*').order('id').execute().data or []
+
+    def get(self, source_id):
+        self._count('select')
+        return _first(self.client.table('calendar_sources').select('*').eq('id', source_id).execute())
+
+    def create(self, data):
+        self._count('insert')
+        return _first(self.client.table('calendar_sources').insert(data).execute())
+
+    def update(self, source_id, data):
+        self._count('update')
+        return _first(self.client.table('calendar_sources').update(data).eq('id', source_id).execute())
+
+    def delete(self, source_id):
+        self._count('delete')
+        self.client.table('calendar_sources').delete().eq('id', source_id).execute()
+
+
+class SupabaseExternalHolds(ExternalHoldsRepository):
+    def __init__(self, stats, client):
+        super().__init__(stats)
+        self.client = client
+
+    def list_for_source(self, source_id):
+        self._count('select')
+        return self.client.table('external_holds').select('*').eq('source_id', source_id).execute().data or []
+
+    def list_active(self, after_date):
+        self._count('select')
+        return self.client.table('external_holds').select('*').gt('till_date', after_date).execute().data or []
+
+    def upsert_many(self, rows):
+        if not rows:
+            return []
+        self._count('upsert')
+        return self.client.table('external_holds').upsert(list(rows), on_conflict='source_id,uid').execute().data or []
+
+    def delete_many(self, hold_ids):
+        ids = list(hold_ids)
+        if not ids:
+            return []
+        self._count('delete')
+        return self.client.table('external_holds').delete().in_('id', ids).execute().data or []
+
+    def delete_for_source(self, source_id):
+        self._count('delete')
+        return self.client.table('external_holds').delete().eq('source_id', source_id).execute().data or []
+
+
+def create_supabase_datastore(client, service_client=None):
+    """Build a store on supabase-py clients.
+
+    Payments are written with the service-role client when one is given.
+    """
+    stats = QueryStats()
+    return DataStore(
+        'supabase',
+        users=SupabaseUsers(stats, client),
+        homestays=SupabaseHomestays(stats, client),
+        bookings=SupabaseBookings(stats, client),
+        bookings_archive=SupabaseArchivedBookings(stats, client),
+        payments=SupabasePayments(stats, service_client or client),
+        payment_refs=SupabasePaymentReferences(stats, service_client or client),
+        inauguration=SupabaseInauguration(stats, client),
+        pricing_rules=SupabasePricingRules(stats, client),
+        calendar_sources=SupabaseCalendarSources(stats, service_client or client),
+        external_holds=SupabaseExternalHolds(stats, service_client or client),
+        stats=stats,
+    )
+
+
+def create_datastore(backend, supabase_client=None, supabase_service_client=None, sqlite_path=None):
+    """Create the data store selected by ``backend`` ('supabase' or 'sqlite')."""
+    backend = (backend or 'supabase').lower()
+    if backend == 'supabase':
+        if supabase_client is None:
+            raise ValueError("Supabase backend requires a Supabase client")
+        return create_supabase_datastore(supabase_client, supabase_service_client)
+    if backend == 'sqlite':
+        from sqlite_store import create_sqlite_datastore
+        return create_sqlite_datastore(sqlite_path or ':memory:')
+    raise ValueError(f"Unknown data backend: {backend}")
@@ -0,0 +1,155 @@
+"""Live admin dashboard updates over Server-Sent Events.
+
+Store writes are turned into small events (``on_store_change``) and
+published on an in-process ``EventBus``; ``/admin/events`` streams them to
+every connected admin browser, which patches the dashboard in place
+instead of reloading it:
+
+* ``booking-created`` - a new booking
+* ``booking-status`` - a booking's status changed (review, expiry, payment)
+* ``upi-confirmation`` - a guest submitted a UTR or screenshot
+* ``payment-updated`` - a Cashfree payment was recorded or changed
+
+Each client gets a bounded queue. A client that falls ``max_queue`` events
+behind stops receiving events and gets a ``reset`` event instead, on which
+the dashboard reloads once; a slow browser never makes the queue grow. The last
+``replay`` events are kept so a browser that reconnects with
+``Last-Event-ID`` misses nothing. Events are per process: under several
+workers an admin sees the writes handled by the worker it is connected to.
+"""
+
+import itertools
+import json
+import queue
+import threading
+from collections import deque
+
+MAX_QUEUE = 100
+REPLAY = 200
+HEARTBEAT_SECONDS = 15
+MAX_CLIENTS = 4
+
+BOOKING_FIELDS = ('id', 'homestay_id', 'from_date', 'till_date', 'beds_booked', 'status', 'user_name',
+                  'txn_id', 'screenshot', 'order_id', 'bed_assignment')
+PAYMENT_FIELDS = ('order_id', 'status', 'amount', 'updated_at')
+
+
+class Subscription:
+    def __init__(self, max_queue):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBus:
+    def __init__(self, max_queue=MAX_QUEUE, replay=REPLAY, max_clients=MAX_CLIENTS):
+        self.max_queue = max_queue
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._recent = deque(maxlen=replay)
+        self._ids = itertools.count(1)
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+        self.rejected = 0
+
+    def publish(self, event, data):
+        with self._lock:
+            message = (next(self._ids), event, data)
+            self._recent.append(message)
+            self.published += 1
+            for sub in self._subscribers:
+                if sub.overflowed:
+                    continue
+                try:
+                    sub.queue.put_nowait(message)
+                    self.delivered += 1
+                except queue.Full:
+                    sub.overflowed = True
+                    self.overflows += 1
+        return message[0]
+
+    def subscribe(self, last_event_id=None):
+        """A new ``Subscription`` (None when ``max_clients`` are connected), primed with missed events."""
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                self.rejected += 1
+                return None
+            sub = Subscription(self.max_queue)
+            if last_event_id is not None:
+                missed = [m for m in self._recent if m[0] > last_event_id]
+                if self._recent and self._recent[0][0] > last_event_id + 1:
+                    sub.overflowed = True  # older events are gone; the client must reload
+                for message in missed[-self.max_queue:]:
+                    sub.queue.put_nowait(message)
+            self._subscribers.add(sub)
+            return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def stream(self, sub, heartbeat=HEARTBEAT_SECONDS):
+        """Yield SSE frames for ``sub`` until the client goes away."""
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                if sub.overflowed:
+                    yield 'event: reset\ndata: {}\n\n'
+                    return
+                message = sub.get(heartbeat)
+                if message is None:
+                    yield ': ping\n\n'  # keeps proxies from closing the connection; detects gone clients
+                    continue
+                event_id, event, data = message
+                yield f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        finally:
+            self.unsubscribe(sub)
+
+    def on_store_change(self, table, operation, rows, args):
+        if table == 'bookings':
+            changes = _changes(operation, args)
+            for row in rows:
+                booking = {k: row.get(k) for k in BOOKING_FIELDS}
+                if operation == 'create':
+                    self.publish('booking-created', booking)
+                    if booking['txn_id'] or booking['screenshot']:
+                        self.publish('upi-confirmation', booking)
+                    continue
+                if operation == 'delete_many':
+                    continue
+                if 'status' in changes:
+                    self.publish('booking-status', booking)
+                if changes & {'txn_id', 'screenshot'}:
+                    self.publish('upi-confirmation', booking)
+        elif table == 'payments' and operation in ('create', 'upsert'):
+            for row in rows:
+                self.publish('payment-updated', {k: row.get(k) for k in PAYMENT_FIELDS})
+
+    def stats(self):
+        with self._lock:
+            return {
+                'clients': len(self._subscribers),
+                'max_clients': self.max_clients,
+                'published': self.published,
+                'delivered': self.delivered,
+                'overflows': self.overflows,
+                'rejected': self.rejected,
+                'queued': sum(sub.queue.qsize() for sub in self._subscribers),
+            }
+
+
+def _changes(operation, args):
+    """Columns a bookings ``update``/``update_many`` call set (its ``data`` argument)."""
+    if operation in ('update', 'update_many') and len(args) > 1 and isinstance(args[1], dict):
+        return set(args[1])
+    return set()
+
+
+bus = EventBus()
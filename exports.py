@@ -0,0 +1,107 @@
+"""Streaming exports of bookings for accounting.
+
+Rows are read in keyset pages (``WHERE id > last_id ORDER BY id LIMIT n``)
+and written out page by page, so memory use stays constant however many
+bookings exist. Each page costs one bookings query plus, when requested,
+one payments query.
+"""
+
+import csv
+import io
+import json
+
+import archive
+
+BOOKING_COLUMNS = [
+    'id', 'created_at', 'homestay_id', 'from_date', 'till_date', 'nights', 'beds_booked',
+    'total_amount', 'amount', 'status', 'rejection_reason', 'payment_reference', 'txn_id',
+    'order_id', 'user_id', 'user_name', 'user_email', 'user_phone', 'bed_assignment',
+]
+HOMESTAY_COLUMNS = ['homestay_owner']
+PAYMENT_COLUMNS = ['payment_status', 'payment_amount', 'payment_updated_at']
+
+# Leading characters spreadsheets read as a formula in a CSV cell
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def iter_booking_rows(store, from_date=None, till_date=None, statuses=None,
+                      include_homestay=True, include_payments=True, page_size=500, include_history=False):
+    """Yield export rows (dicts) for every matching booking, one keyset page at a time.
+
+    Archived bookings (``archive.py``) follow the live ones when ``include_history``.
+    """
+    owners = {}
+    if include_homestay:
+        # Homestays are a small table; one query covers the whole export
+        owners = {h['id']: h.get('owner') for h in store.homestays.list_all()}
+
+    pages = archive.iter_pages(store, page_size, include_history=include_history,
+                               from_date=from_date, till_date=till_date, statuses=statuses)
+    for page in pages:
+        payments = {}
+        if include_payments:
+            payments = store.payments.get_many_by_order_ids(b.get('order_id') for b in page)
+        for booking in page:
+            row = {column: booking.get(column) for column in BOOKING_COLUMNS}
+            if include_homestay:
+                row['homestay_owner'] = owners.get(booking.get('homestay_id'))
+            if include_payments:
+                payment = payments.get(booking.get('order_id')) or {}
+                row['payment_status'] = payment.get('status')
+                row['payment_amount'] = payment.get('amount')
+                row['payment_updated_at'] = payment.get('updated_at')
+            yield row
+
+
+def export_columns(include_homestay=True, include_payments=True):
+    columns = list(BOOKING_COLUMNS)
+    if include_homestay:
+        columns += HOMESTAY_COLUMNS
+    if include_payments:
+        columns += PAYMENT_COLUMNS
+    return columns
+
+
+def _csv_safe(value):
+    """Prefix strings a spreadsheet would run as a formula with ``'`` (guest-typed names, UTRs)."""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def stream_csv(rows, columns, flush_every=500):
+    """Encode rows as CSV, yielding a chunk every ``flush_every`` rows.
+
+    String cells that start like a formula are escaped (``_csv_safe``);
+    NDJSON keeps the values as stored.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow({column: _csv_safe(value) for column, value in row.items()})
+        count += 1
+        if count % flush_every == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_ndjson(rows, flush_every=500):
+    """Encode rows as newline-delimited JSON, yielding a chunk every ``flush_every`` rows."""
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(row, default=str))
+        if len(chunk) >= flush_every:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
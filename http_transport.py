@@ -0,0 +1,118 @@
+"""Shared, tuned HTTP connection pool for the Supabase clients.
+
+Both Supabase clients (anon and service role) send every PostgREST, auth
+and storage call through one ``PooledTransport``. Each client gets its own
+``httpx.Client`` from ``create_http_client``: postgrest stores the client's
+``apikey`` and ``Authorization`` headers on the ``httpx.Client`` it is
+given, so sharing the client would make both send the same key. The pool keeps connections alive between requests and
+uses HTTP/2 when the server offers it over TLS, which lets many concurrent
+queries share one connection. It is sized for the threads of a worker that
+can issue queries at the same time (``pool_size``).
+
+``PooledTransport.snapshot()`` reports requests in flight, connections
+opened and the current pool contents, for ``/admin/metrics``.
+"""
+
+import threading
+import time
+
+import httpx
+
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+KEEPALIVE_SECONDS = 60.0
+CONNECT_TIMEOUT = 5.0
+POOL_TIMEOUT = 5.0
+
+
+def pool_size(web_threads, io_threads):
+    """Connections one worker may need: every request thread plus the shared I/O pool."""
+    return max(1, web_threads + io_threads)
+
+
+class PooledTransport(httpx.HTTPTransport):
+    """``httpx.HTTPTransport`` with pool limits and usage counters."""
+
+    def __init__(self, max_connections, max_keepalive=None, keepalive_expiry=KEEPALIVE_SECONDS, http2=True):
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive if max_keepalive is not None else max_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        super().__init__(http2=self.http2, limits=self.limits)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.connections_opened = 0
+        self.wait_seconds = 0.0
+
+    def _trace(self, event, info):
+        if event == 'connection.connect_tcp.complete':
+            with self._lock:
+                self.connections_opened += 1
+
+    def handle_request(self, request):
+        request.extensions.setdefault('trace', self._trace)
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            return super().handle_request(request)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.wait_seconds += time.perf_counter() - started
+
+    def snapshot(self):
+        connections = list(self._pool.connections)
+        with self._lock:
+            requests = self.requests
+            summary = {
+                'http2_enabled': self.http2,
+                'max_connections': self.limits.max_connections,
+                'max_keepalive_connections': self.limits.max_keepalive_connections,
+                'keepalive_expiry_seconds': self.limits.keepalive_expiry,
+                'requests': requests,
+                'errors': self.errors,
+                'in_flight': self.in_flight,
+                'peak_in_flight': self.peak_in_flight,
+                'connections_opened': self.connections_opened,
+                'requests_per_connection': round(requests / self.connections_opened, 2) if self.connections_opened else 0.0,
+                'avg_response_ms': round(self.wait_seconds / requests * 1000, 2) if requests else 0.0,
+            }
+        summary['pool'] = {
+            'connections': len(connections),
+            'idle': sum(1 for c in connections if c.is_idle()),
+            'http2': sum(1 for c in connections if 'HTTP/2' in c.info()),
+            'utilization': round(self.in_flight / self.limits.max_connections, 4) if self.limits.max_connections else 0.0,
+        }
+        return summary
+
+
+def create_http_client(transport, timeout, connect_timeout=CONNECT_TIMEOUT, pool_timeout=POOL_TIMEOUT):
+    """``httpx.Client`` for ``SyncClientOptions(httpx_client=...)``.
+
+    Call once per Supabase client; clients built on the same ``transport``
+    share its connections but keep their own headers.
+
+    ``timeout`` bounds each read and write; ``pool_timeout`` is how long a
+    request may wait for a free connection when the pool is exhausted.
+    """
+    return httpx.Client(
+        transport=transport,
+        timeout=httpx.Timeout(timeout, connect=connect_timeout, pool=pool_timeout),
+        follow_redirects=True,
+    )
@@ -0,0 +1,504 @@
+"""Import other platforms' iCalendar feeds as external holds.
+
+Each ``calendar_sources`` row points at a feed (an ``http(s)://`` URL, or a
+file under the import directory) of bookings a homestay took elsewhere.
+``sync_all`` fetches every source and turns its events into
+``external_holds`` rows, which count against availability like approved
+bookings. A sync:
+
+* sends the source's last ``ETag``/``Last-Modified`` (or compares a file's
+  modification time) and stops if the feed has not changed
+* reads the feed line by line and handles one VEVENT at a time, so a large
+  feed is never held in memory
+* compares each event with the hold imported last time under the same UID
+  and writes only new or changed holds, in batches; an event whose
+  ``SEQUENCE`` is lower than the imported one is an old revision and is
+  ignored
+* deletes holds whose events are gone from the feed, but only after the
+  whole feed was read: a response without ``BEGIN:VCALENDAR`` and its
+  closing ``END:VCALENDAR`` (an HTML error page, a truncated file) fails
+  the sync like a fetch error
+
+Cancelled events, events that have ended and events of our own feed
+(``calendar_feed.py``) are skipped; an event with unreadable dates keeps
+the hold it had. A hold blocks ``beds`` of the source,
+or the whole homestay when the source does not say.
+
+``HoldIndex`` keeps the current holds per homestay in memory for the
+availability checks.
+"""
+
+import os
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import requests
+
+from calendar_feed import UID_DOMAIN
+
+BATCH_SIZE = 200
+FETCH_TIMEOUT = 20
+INDEX_SECONDS = 60
+SKIPPED_STATUSES = ('CANCELLED',)
+
+_DURATION = re.compile(r'^P(?:(\d+)W)?(?:(\d+)D)?')
+
+
+class ICalError(ValueError):
+    pass
+
+
+def validate_source(data, import_dir=None):
+    """Validate admin input for a source; returns the row to store or raises ``ICalError``."""
+    try:
+        homestay_id = int(data.get('homestay_id'))
+    except (TypeError, ValueError):
+        raise ICalError('homestay_id is required')
+    url = str(data.get('url') or '').strip()
+    if not url:
+        raise ICalError('url is required')
+    if not url.startswith(('http://', 'https://')):
+        _local_path(url, import_dir)
+    beds = data.get('beds')
+    if beds not in (None, ''):
+        try:
+            beds = int(beds)
+        except (TypeError, ValueError):
+            raise ICalError('beds must be a number')
+        if beds < 1:
+            raise ICalError('beds must be at least 1')
+    else:
+        beds = None
+    return {
+        'homestay_id': homestay_id,
+        'name': str(data.get('name') or '').strip() or None,
+        'url': url,
+        'beds': beds,
+    }
+
+
+def _local_path(url, import_dir):
+    """Resolve a file source; files outside ``import_dir`` are refused."""
+    if not import_dir:
+        raise ICalError('file sources need CALENDAR_IMPORT_DIR')
+    path = url[len('file://'):] if url.startswith('file://') else url
+    root = os.path.realpath(import_dir)
+    path = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, path]) != root:
+        raise ICalError('file sources must be inside CALENDAR_IMPORT_DIR')
+    return path
+
+
+# --- Parsing ---
+
+def unfold(lines):
+    """Join RFC 5545 continuation lines; yields logical content lines."""
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t'):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def _split(line):
+    """``NAME;PARAM=..:VALUE`` -> (upper-case name, value); colons inside quoted params are skipped."""
+    quoted = False
+    for i, char in enumerate(line):
+        if char == '"':
+            quoted = not quoted
+        elif char == ':' and not quoted:
+            return line[:i].split(';', 1)[0].upper(), line[i + 1:]
+    return line.upper(), ''
+
+
+def _unescape(text):
+    return (text.replace('\\n', '\n').replace('\\N', '\n').replace('\\,', ',')
+            .replace('\\;', ';').replace('\\\\', '\\'))
+
+
+def _parse_date(value):
+    value = value.strip()
+    try:
+        return date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+    except (ValueError, IndexError):
+        raise ICalError(f'bad date {value!r}')
+
+
+def _duration_days(value):
+    match = _DURATION.match(value.strip())
+    if not match:
+        return 1
+    weeks, days = (int(part or 0) for part in match.groups())
+    return weeks * 7 + days or 1
+
+
+def iter_events(lines):
+    """Yield one dict per VEVENT (uid, sequence, start, end, status, summary) from content lines.
+
+    Raises ``ICalError`` after the last event when the lines are not a
+    complete VCALENDAR, so a caller never mistakes a partial feed for one
+    whose other events were removed.
+    """
+    event = None
+    depth = 0
+    opened = closed = False
+    for line in unfold(lines):
+        name, value = _split(line)
+        if name == 'BEGIN':
+            if value.strip().upper() == 'VCALENDAR' and event is None:
+                opened = True
+            elif value.strip().upper() == 'VEVENT' and event is None:
+                event, depth = {}, 0
+            elif event is not None:
+                depth += 1  # VALARM etc.; their properties are not the event's
+            continue
+        if name == 'END':
+            if event is not None:
+                if depth:
+                    depth -= 1
+                elif value.strip().upper() == 'VEVENT':
+                    yield _finish(event)
+                    event = None
+            elif value.strip().upper() == 'VCALENDAR' and opened:
+                closed = True
+            continue
+        if event is None or depth:
+            continue
+        if name in ('UID', 'SEQUENCE', 'DTSTART', 'DTEND', 'DURATION', 'STATUS', 'SUMMARY'):
+            event.setdefault(name, value)
+    if not opened:
+        raise ICalError('not an iCalendar feed (no BEGIN:VCALENDAR)')
+    if not closed:
+        raise ICalError('incomplete feed (no END:VCALENDAR)')
+
+
+def _finish(props):
+    """The event's fields, or ``{'uid', 'invalid'}`` when its dates cannot be read."""
+    uid = props.get('UID', '').strip()
+    try:
+        if not uid or 'DTSTART' not in props:
+            raise ICalError('no UID or DTSTART')
+        start = _parse_date(props['DTSTART'])
+        if 'DTEND' in props:
+            end = _parse_date(props['DTEND'])
+        else:
+            end = start + timedelta(days=_duration_days(props.get('DURATION', '')))
+    except ICalError as e:
+        return {'uid': uid, 'invalid': str(e)}
+    if end <= start:
+        end = start + timedelta(days=1)  # a same-day end still blocks that night
+    try:
+        sequence = int(props.get('SEQUENCE', 0))
+    except ValueError:
+        sequence = 0
+    return {
+        'uid': uid,
+        'sequence': sequence,
+        'start': start,
+        'end': end,
+        'status': props.get('STATUS', '').strip().upper(),
+        'summary': _unescape(props.get('SUMMARY', ''))[:200] or None,
+    }
+
+
+# --- Fetching ---
+
+class NotModified(Exception):
+    pass
+
+
+class _Feed:
+    """Open a source and iterate its lines; raises ``NotModified`` when it is unchanged."""
+
+    def __init__(self, source, import_dir=None, timeout=FETCH_TIMEOUT):
+        self.source = source
+        self.import_dir = import_dir
+        self.timeout = timeout
+        self.etag = source.get('etag')
+        self.last_modified = source.get('last_modified')
+        self.bytes_read = 0
+        self._response = None
+        self._file = None
+
+    def __enter__(self):
+        url = self.source['url']
+        if url.startswith(('http://', 'https://')):
+            headers = {}
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
+            response = requests.get(url, headers=headers, stream=True, timeout=self.timeout)
+            if response.status_code == 304:
+                response.close()
+                raise NotModified()
+            if response.status_code != 200:
+                response.close()
+                raise ICalError(f'HTTP {response.status_code}')
+            self._response = response
+            self.etag = response.headers.get('ETag')
+            self.last_modified = response.headers.get('Last-Modified')
+        else:
+            path = _local_path(url, self.import_dir)
+            try:
+                modified = str(os.stat(path).st_mtime_ns)
+            except OSError as e:
+                raise ICalError(f'cannot read {url}: {e.strerror}')
+            if modified == self.source.get('last_modified'):
+                raise NotModified()
+            self._file = open(path, encoding='utf-8', errors='replace', newline='')
+            self.etag, self.last_modified = None, modified
+        return self
+
+    def lines(self):
+        if self._response is not None:
+            for raw in self._response.iter_lines():
+                self.bytes_read += len(raw) + 2
+                yield raw.decode('utf-8', errors='replace')
+        else:
+            for line in self._file:
+                self.bytes_read += len(line)
+                yield line
+
+    def __exit__(self, *exc):
+        if self._response is not None:
+            self._response.close()
+        if self._file is not None:
+            self._file.close()
+
+
+# --- Sync ---
+
+class SyncStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.sources_synced = 0
+        self.not_modified = 0
+        self.failed = 0
+        self.events_read = 0
+        self.invalid_events = 0
+        self.holds = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+        self.bytes_read = 0
+        self.last_run_at = None
+        self.last_duration_ms = None
+
+    def record(self, summary):
+        with self._lock:
+            self.runs += 1
+            for result in summary['sources']:
+                if result['status'] == 'synced':
+                    self.sources_synced += 1
+                elif result['status'] == 'not_modified':
+                    self.not_modified += 1
+                else:
+                    self.failed += 1
+                self.events_read += result.get('events', 0)
+                self.invalid_events += result.get('invalid', 0)
+                self.bytes_read += result.get('bytes', 0)
+                for key in self.holds:
+                    self.holds[key] += result.get(key, 0)
+            self.last_run_at = summary['finished_at']
+            self.last_duration_ms = summary['duration_ms']
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'runs': self.runs,
+                'sources_synced': self.sources_synced,
+                'not_modified': self.not_modified,
+                'failed': self.failed,
+                'events_read': self.events_read,
+                'invalid_events': self.invalid_events,
+                'holds': dict(self.holds),
+                'bytes_read': self.bytes_read,
+                'last_run_at': self.last_run_at,
+                'last_duration_ms': self.last_duration_ms,
+            }
+
+
+stats = SyncStats()
+
+
+def _unchanged(existing, row):
+    return all(str(existing.get(k)) == str(row[k]) for k in ('sequence', 'from_date', 'till_date', 'beds', 'summary'))
+
+
+def sync_source(store, source, homestay_beds, import_dir=None, today=None, batch_size=BATCH_SIZE):
+    """Sync one source; returns its result dict. Errors are reported, not raised."""
+    today = today or date.today()
+    result = {'source_id': source['id'], 'homestay_id': source['homestay_id'], 'status': 'synced',
+              'events': 0, 'invalid': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'bytes': 0}
+    now = datetime.now(timezone.utc).isoformat()
+    beds = int(source.get('beds') or homestay_beds or 1)
+    existing = {row['uid']: row for row in store.external_holds.list_for_source(source['id'])}
+    seen = {}
+    pending = []
+
+    def flush():
+        if pending:
+            store.external_holds.upsert_many([row for _, row in pending])
+            for kind, _ in pending:
+                result[kind] += 1
+            pending.clear()
+
+    feed = _Feed(source, import_dir)
+    try:
+        with feed:
+            for event in iter_events(feed.lines()):
+                result['events'] += 1
+                uid = event['uid']
+                if 'invalid' in event:
+                    # Keep what an unreadable event held before rather than releasing the beds
+                    result['invalid'] += 1
+                    if uid in existing:
+                        seen.setdefault(uid, int(existing[uid].get('sequence') or 0))
+                    continue
+                if (event['status'] in SKIPPED_STATUSES or event['end'] <= today
+                        or uid.endswith('@' + UID_DOMAIN)):
+                    continue
+                if uid in seen:
+                    # The same UID twice in one feed: the higher SEQUENCE wins
+                    if seen[uid] >= event['sequence']:
+                        continue
+                    pending[:] = [(kind, r) for kind, r in pending if r['uid'] != uid]
+                previous = existing.get(uid)
+                if previous and int(previous.get('sequence') or 0) > event['sequence']:
+                    seen[uid] = int(previous['sequence'])  # an old revision; keep what we have
+                    continue
+                seen[uid] = event['sequence']
+                row = {
+                    'source_id': source['id'],
+                    'homestay_id': source['homestay_id'],
+                    'uid': uid,
+                    'sequence': event['sequence'],
+                    'from_date': event['start'].isoformat(),
+                    'till_date': event['end'].isoformat(),
+                    'beds': beds,
+                    'summary': event['summary'],
+                    'imported_at': now,
+                }
+                if previous and _unchanged(previous, row):
+                    result['unchanged'] += 1
+                    continue
+                pending.append(('updated' if previous else 'inserted', row))
+                if len(pending) >= batch_size:
+                    flush()
+            flush()
+    except NotModified:
+        result['status'] = 'not_modified'
+        store.calendar_sources.update(source['id'], {'last_synced_at': now, 'last_error': None})
+        return result
+    except (ICalError, requests.RequestException, OSError, UnicodeError) as e:
+        # Holds written before the error stay; nothing is deleted from a partial read
+        result['status'] = 'failed'
+        result['error'] = str(e) or e.__class__.__name__
+        store.calendar_sources.update(source['id'], {'last_error': result['error']})
+        return result
+    finally:
+        result['bytes'] = feed.bytes_read
+
+    gone = [row['id'] for uid, row in existing.items() if uid not in seen]
+    for i in range(0, len(gone), batch_size):
+        result['deleted'] += len(store.external_holds.delete_many(gone[i:i + batch_size]))
+    store.calendar_sources.update(source['id'], {
+        'etag': feed.etag, 'last_modified': feed.last_modified, 'last_synced_at': now, 'last_error': None,
+    })
+    return result
+
+
+def sync_all(store, import_dir=None, source_ids=None, today=None, batch_size=BATCH_SIZE):
+    """Sync every source (or ``source_ids``); returns a summary dict."""
+    started = time.perf_counter()
+    sources = store.calendar_sources.list_all()
+    if source_ids is not None:
+        wanted = {int(i) for i in source_ids}
+        sources = [s for s in sources if s['id'] in wanted]
+    homestays = store.homestays.get_many({s['homestay_id'] for s in sources}) if sources else {}
+    summary = {'sources': []}
+    for source in sources:
+        homestay = homestays.get(source['homestay_id'])
+        if homestay is None:
+            summary['sources'].append({'source_id': source['id'], 'homestay_id': source['homestay_id'],
+                                       'status': 'failed', 'error': 'homestay not found'})
+            continue
+        summary['sources'].append(sync_source(
+            store, source, homestay.get('beds'), import_dir=import_dir, today=today, batch_size=batch_size,
+        ))
+    summary['finished_at'] = datetime.now(timezone.utc).isoformat()
+    summary['duration_ms'] = (time.perf_counter() - started) * 1000.0
+    stats.record(summary)
+    return summary
+
+
+# --- Availability ---
+
+class HoldIndex:
+    """Current and future holds grouped by homestay, reloaded after ``ttl`` seconds or a hold write."""
+
+    def __init__(self, ttl=INDEX_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._holds = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self.loads = 0
+        self.invalidations = 0
+
+    def _current(self, store):
+        now = time.monotonic()
+        with self._lock:
+            if self._holds is not None and now - self._loaded_at < self.ttl:
+                return self._holds
+            generation = self._generation
+        rows = store.external_holds.list_active((date.today() - timedelta(days=1)).isoformat())
+        holds = {}
+        for row in rows:
+            try:
+                span = (date.fromisoformat(str(row['from_date'])[:10]),
+                        date.fromisoformat(str(row['till_date'])[:10]), int(row.get('beds') or 1))
+            except (KeyError, TypeError, ValueError):
+                continue
+            holds.setdefault(int(row['homestay_id']), []).append(span)
+        with self._lock:
+            self.loads += 1
+            # Only keep it if no hold was written meanwhile
+            if generation == self._generation:
+                self._holds, self._loaded_at = holds, now
+        return holds
+
+    def booked_beds(self, store, homestay_id, from_date, till_date):
+        """Beds held by external bookings overlapping ``[from_date, till_date)``."""
+        spans = self._current(store).get(int(homestay_id), ())
+        return sum(beds for start, end, beds in spans if start < till_date and end > from_date)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._holds = None
+            self.invalidations += 1
+
+    def on_store_change(self, table, operation, rows, args):
+        if table == 'external_holds':
+            self.invalidate()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'homestays': len(self._holds) if self._holds is not None else None,
+                'holds': sum(len(v) for v in self._holds.values()) if self._holds is not None else None,
+                'loads': self.loads,
+                'invalidations': self.invalidations,
+            }
+
+
+holds = HoldIndex()
@@ -0,0 +1,140 @@
+"""Idempotency keys for booking-creating POSTs.
+
+Forms carry a one-time ``idempotency_key`` hidden field (see
+``idempotency_token``) and API clients may send an ``Idempotency-Key``
+header. The first request with a key runs the view; if it ends in a
+redirect to the booking receipt, that redirect is remembered for ``ttl``
+seconds. Repeats of the key (double clicks, browser retries) are answered
+with the same redirect without running the view again, and a repeat that
+arrives while the first is still running waits for it to finish.
+
+Keys are scoped to the user and endpoint, so one client cannot replay
+another's receipt. Entries live in process memory: each worker keeps its
+own, which covers retries that reach the same worker.
+"""
+
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from flask import flash, redirect, request, session, url_for
+
+HEADER = 'Idempotency-Key'
+FORM_FIELD = 'idempotency_key'
+KEY_PATTERN = re.compile(r'^[A-Za-z0-9_\-:.]{8,128}$')
+
+TTL_SECONDS = 24 * 3600
+WAIT_SECONDS = 5.0
+MAX_ENTRIES = 10000
+
+_IN_PROGRESS = object()
+
+
+class IdempotencyStore:
+    """Thread-safe ``key -> result`` map with expiry and a size bound."""
+
+    def __init__(self, ttl=TTL_SECONDS, max_entries=MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._changed = threading.Condition()
+        self.replays = 0
+        self.stored = 0
+        self.waits = 0
+
+    def _purge(self, now):
+        while self._entries:
+            key, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+    def claim(self, key, wait=WAIT_SECONDS):
+        """Reserve ``key`` for this request.
+
+        Returns ``(True, None)`` if the caller should run the view, or
+        ``(False, result)`` with the stored result of an earlier request
+        (``None`` if that request is still running after ``wait`` seconds).
+        """
+        deadline = time.monotonic() + wait
+        with self._changed:
+            while True:
+                now = time.monotonic()
+                self._purge(now)
+                entry = self._entries.get(key)
+                if entry is None:
+                    self._entries[key] = (now + self.ttl, _IN_PROGRESS)
+                    return True, None
+                if entry[1] is not _IN_PROGRESS:
+                    self.replays += 1
+                    return False, entry[1]
+                remaining = deadline - now
+                if remaining <= 0:
+                    return False, None
+                self.waits += 1
+                self._changed.wait(remaining)
+
+    def complete(self, key, result):
+        with self._changed:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            self.stored += 1
+            self._changed.notify_all()
+
+    def release(self, key):
+        """Forget a claim whose request failed so a retry can run again."""
+        with self._changed:
+            self._entries.pop(key, None)
+            self._changed.notify_all()
+
+    def stats(self):
+        with self._changed:
+            return {'entries': len(self._entries), 'stored': self.stored, 'replays': self.replays, 'waits': self.waits}
+
+
+store = IdempotencyStore()
+
+
+def idempotency_token():
+    """New key for a form; render it as a hidden ``idempotency_key`` input."""
+    return uuid.uuid4().hex
+
+
+def request_key():
+    key = request.headers.get(HEADER) or request.form.get(FORM_FIELD)
+    if key and KEY_PATTERN.match(key):
+        return key
+    return None
+
+
+def idempotent(f):
+    """Replay the receipt redirect of an earlier POST with the same key."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request_key() if request.method == 'POST' else None
+        if key is None:
+            return f(*args, **kwargs)
+
+        scoped = f"{request.endpoint}:{session.get('user_id') or 'anonymous'}:{key}"
+        run, location = store.claim(scoped)
+        if not run:
+            if location is None:
+                flash('Your booking is still being processed. Please check My Bookings shortly.', 'info')
+                return redirect(url_for('bookings'))
+            return redirect(location)
+
+        try:
+            response = f(*args, **kwargs)
+        except Exception:
+            store.release(scoped)
+            raise
+        location = getattr(response, 'location', None)
+        if getattr(response, 'status_code', None) in (301, 302, 303) and location and '/receipt/' in location:
+            store.complete(scoped, location)
+        else:
+            store.release(scoped)
+        return response
+    return decorated_function
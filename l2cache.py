@@ -0,0 +1,281 @@
+"""Second-level cache shared by every worker process.
+
+Read-through cache for hot, rarely-changing reads (homestays, inauguration
+status and availability lookups). User rows are never cached: they carry
+password hashes, which must not be copied into a shared file or Redis.
+Three backends implement the same small interface:
+
+* ``redis://host:port/db`` - any Redis-protocol server via redis-py
+  (optional dependency; pass ``client=`` to use a stand-in such as fakeredis)
+* ``sqlite:///path/to/cache.db`` - a file shared by the workers of one host
+* ``memory://`` - per-process only (the default)
+
+Keys are versioned per namespace: each cached value records the namespace
+version it was computed under, and a write anywhere bumps the version
+stored in the backend, so every worker stops using the old values at once.
+Values are JSON, so cached rows look exactly like fresh ones. Backend
+errors are counted and treated as misses.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from urllib.parse import urlparse
+
+try:
+    import redis
+except ImportError:  # optional; only needed for CACHE_URL=redis://...
+    redis = None
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TTL = 300
+KEY_PREFIX = 'kangundi'
+
+# (table, method) -> namespace whose version guards the cached result
+CACHED_READS = {
+    ('homestays', 'list_all'): 'homestays',
+    ('homestays', 'get'): 'homestays',
+    ('inauguration', 'get_status'): 'inauguration',
+    ('bookings', 'list_active_for_homestay'): 'bookings',
+}
+# Writes to a table invalidate these namespaces
+INVALIDATES = {
+    'homestays': ('homestays',),
+    'inauguration': ('inauguration',),
+    'bookings': ('bookings',),
+}
+
+
+class MemoryBackend:
+    """Per-process dict; expired values are dropped when read and swept every ``PURGE_EVERY`` sets."""
+
+    name = 'memory'
+    PURGE_EVERY = 500
+    MAX_ENTRIES = 10000
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._data = {}
+        self._writes = 0
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            values = []
+            for key in keys:
+                entry = self._data.get(key)
+                if entry and entry[1] is not None and entry[1] <= now:
+                    del self._data[key]
+                    entry = None
+                values.append(entry[0] if entry else None)
+            return values
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data.pop(key, None)  # re-inserted last, so the oldest values are evicted first
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0 or len(self._data) > self.max_entries:
+                self._purge()
+
+    def _purge(self):
+        now = time.monotonic()
+        expiring = [key for key, (_, expires_at) in self._data.items() if expires_at is not None]
+        excess = len(self._data) - self.max_entries
+        for key in expiring:
+            if self._data[key][1] <= now or excess > 0:
+                del self._data[key]
+                excess -= 1
+        # Version counters (no expiry) are never evicted: losing one would revive old values
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._data.get(key, ('0', None))[0]) + 1
+            self._data[key] = (str(value), None)
+            return value
+
+
+class SQLiteBackend:
+    """Cache table in a SQLite file; WAL lets every worker on the host share it."""
+
+    name = 'sqlite'
+    PURGE_EVERY = 500
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)")
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, keys):
+        rows = self._connection().execute(
+            f"SELECT key, value FROM cache WHERE key IN ({', '.join('?' for _ in keys)}) "
+            "AND (expires_at IS NULL OR expires_at > ?)",
+            [*keys, time.time()],
+        ).fetchall()
+        found = dict(rows)
+        return [found.get(key) for key in keys]
+
+    def set(self, key, value, ttl):
+        conn = self._connection()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                         (key, value, time.time() + ttl))
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+    def incr(self, key):
+        conn = self._connection()
+        with conn:
+            row = conn.execute(
+                "INSERT INTO cache (key, value, expires_at) VALUES (?, '1', NULL) "
+                "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1 RETURNING value",
+                (key,),
+            ).fetchone()
+        return int(row[0])
+
+
+class RedisBackend:
+    name = 'redis'
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("CACHE_URL uses redis:// but the 'redis' package is not installed")
+            client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.client = client
+
+    def get_many(self, keys):
+        return [v.decode() if isinstance(v, bytes) else v for v in self.client.mget(keys)]
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=max(1, int(ttl)))
+
+    def incr(self, key):
+        return int(self.client.incr(key))
+
+
+def create_backend(url):
+    """Backend for a ``CACHE_URL`` (see module docstring)."""
+    url = url or 'memory://'
+    scheme = urlparse(url).scheme
+    if scheme == 'memory':
+        return MemoryBackend()
+    if scheme == 'sqlite':
+        return SQLiteBackend(url[len('sqlite:///'):] if url.startswith('sqlite:///') else url[len('sqlite://'):])
+    if scheme in ('redis', 'rediss', 'unix'):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported CACHE_URL: {url}")
+
+
+class SharedCache:
+    def __init__(self, backend, ttl=DEFAULT_TTL, prefix=KEY_PREFIX):
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.errors = 0
+        self.invalidations = Counter()
+
+    def _version_key(self, namespace):
+        return f"{self.prefix}:version:{namespace}"
+
+    def _error(self, action, e):
+        with self._lock:
+            self.errors += 1
+        log.warning("L2 cache %s failed (%s): %s", action, self.backend.name, e)
+
+    def get(self, namespace, key):
+        """Return ``(hit, value, version)``; ``version`` is needed to ``set`` the value."""
+        try:
+            version, raw = self.backend.get_many([self._version_key(namespace), f"{self.prefix}:{namespace}:{key}"])
+        except Exception as e:
+            self._error('get', e)
+            return False, None, None
+        version = int(version or 0)
+        if raw is not None:
+            entry = json.loads(raw)
+            if entry['v'] == version:
+                with self._lock:
+                    self.hits[namespace] += 1
+                return True, entry['d'], version
+        with self._lock:
+            self.misses[namespace] += 1
+        return False, None, version
+
+    def set(self, namespace, key, value, version):
+        try:
+            payload = json.dumps({'v': version, 'd': value}, default=str)
+            self.backend.set(f"{self.prefix}:{namespace}:{key}", payload, self.ttl)
+        except Exception as e:
+            self._error('set', e)
+
+    def invalidate(self, namespace):
+        """Bump the namespace version; every worker's cached values for it become misses."""
+        try:
+            self.backend.incr(self._version_key(namespace))
+        except Exception as e:
+            self._error('invalidate', e)
+        with self._lock:
+            self.invalidations[namespace] += 1
+
+    def on_store_change(self, table, operation, rows, args):
+        for namespace in INVALIDATES.get(table, ()):
+            self.invalidate(namespace)
+
+    def attach(self, store):
+        """Serve ``CACHED_READS`` of ``store`` through the cache."""
+        store.wrap_methods(self._wrap)
+        return store
+
+    def _wrap(self, table, method, is_write, func):
+        namespace = CACHED_READS.get((table, method))
+        if namespace is None:
+            return func
+
+        @wraps(func)
+        def call(*args, **kwargs):
+            key = f"{table}.{method}:{json.dumps([args, kwargs], sort_keys=True, default=str)}"
+            hit, value, version = self.get(namespace, key)
+            if hit:
+                return value
+            value = func(*args, **kwargs)
+            if version is not None:
+                self.set(namespace, key, value, version)
+            return value
+        return call
+
+    def stats(self):
+        with self._lock:
+            hits, misses = sum(self.hits.values()), sum(self.misses.values())
+            return {
+                'backend': self.backend.name,
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0.0,
+                'errors': self.errors,
+                'by_namespace': {
+                    ns: {'hits': self.hits[ns], 'misses': self.misses[ns], 'invalidations': self.invalidations[ns]}
+                    for ns in sorted(set(self.hits) | set(self.misses) | set(self.invalidations))
+                },
+            }
@@ -0,0 +1,175 @@
+"""Structured, non-blocking logging.
+
+``configure()`` installs one ``QueueHandler`` on the root logger. Request
+threads only format the record and put it on a bounded queue; a
+``QueueListener`` thread writes it to stdout. Records are JSON objects
+(``ts``, ``level``, ``logger``, ``message``, the request's method and path
+and any ``extra=`` fields) or plain text with ``LOG_FORMAT=text``.
+
+Levels are set per module, e.g. ``LOG_LEVELS=datastore=DEBUG,werkzeug=WARNING``.
+DEBUG records that pass their logger's level are sampled at
+``debug_sample_rate`` so a noisy module can be switched on in production.
+If the queue is full, records are dropped and counted rather than blocking
+the request.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import has_request_context, request
+
+MAX_QUEUE = 10000
+
+# Attributes every LogRecord has; anything else came from ``extra=``
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_traceback_formatter = logging.Formatter()
+_listener = None
+_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        elif record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Add the current request's method and path (runs on the request thread)."""
+
+    def filter(self, record):
+        if has_request_context() and not hasattr(record, 'path'):
+            record.method = request.method
+            record.path = request.path
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """Keep a ``rate`` fraction of DEBUG records; other levels always pass."""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+        self.sampled_out = Counter()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate:
+            return True
+        self.sampled_out[record.name] += 1
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """``QueueHandler`` that drops records instead of waiting on a full queue."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self._lock_counts = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Format args and traceback here (they may not survive the thread hop) but
+        # keep the traceback out of the message so it lands in its own field
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock_counts:
+                self.dropped += 1
+            return
+        with self._lock_counts:
+            self.enqueued += 1
+
+
+def parse_levels(spec):
+    """``'datastore=DEBUG,werkzeug=WARNING'`` -> ``{'datastore': 'DEBUG', 'werkzeug': 'WARNING'}``."""
+    levels = {}
+    for item in (spec or '').split(','):
+        name, sep, level = item.partition('=')
+        if sep and name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure(level='INFO', module_levels=None, fmt='json', debug_sample_rate=1.0, stream=None):
+    """Route all logging through the queue; calling it again only updates the levels."""
+    global _listener, _handler
+    root = logging.getLogger()
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    for name, module_level in (module_levels or {}).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    if _handler is None:
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonFormatter() if fmt == 'json'
+                            else logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        _handler = NonBlockingQueueHandler(queue.Queue(MAX_QUEUE))
+        _handler.addFilter(DebugSampler(debug_sample_rate))
+        _handler.addFilter(RequestContextFilter())
+        for existing in root.handlers[:]:
+            root.removeHandler(existing)
+        root.addHandler(_handler)
+        _listener = logging.handlers.QueueListener(_handler.queue, output)
+        _listener.start()
+        atexit.register(shutdown)
+    else:
+        _handler.filters[0].rate = debug_sample_rate
+    return _handler
+
+
+def shutdown():
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def stats():
+    if _handler is None:
+        return {'configured': False}
+    with _handler._lock_counts:
+        counts = {'enqueued': _handler.enqueued, 'dropped': _handler.dropped}
+    sampler = _handler.filters[0]
+    return {
+        'configured': True,
+        'queued': _handler.queue.qsize(),
+        **counts,
+        'debug_sample_rate': sampler.rate,
+        'debug_sampled_out': dict(sampler.sampled_out),
+        'levels': {
+            name: logging.getLevelName(logger.level)
+            for name, logger in sorted(logging.root.manager.loggerDict.items())
+            if isinstance(logger, logging.Logger) and logger.level != logging.NOTSET
+        },
+    }
@@ -0,0 +1,21 @@
+"""Registry of runtime metrics served by ``/admin/metrics``.
+
+Subsystems register a callable returning a JSON-serialisable dict; it is
+only called when the metrics are requested.
+"""
+
+sources = {}
+
+
+def register(name, func):
+    sources[name] = func
+
+
+def collect():
+    snapshot = {}
+    for name, func in sources.items():
+        try:
+            snapshot[name] = func()
+        except Exception as e:
+            snapshot[name] = {'error': str(e)}
+    return snapshot
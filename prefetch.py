@@ -0,0 +1,98 @@
+"""Concurrent prefetch of independent queries for synchronous views.
+
+A view declares the lookups it needs, starts them on the shared I/O pool
+and collects the results, so page latency is the slowest query rather than
+the sum of all of them::
+
+    batch = Prefetch()
+    batch.add('homestay', get_homestay_by_id, homestay_id)
+    batch.add('booked', get_booked_beds_for_date_range, homestay_id, start, end, timeout=3)
+    results = batch.run()
+
+Failed or timed-out lookups come back as exception instances so each view
+keeps its own error handling. Prefetched callables run outside the request
+context and must not touch ``session``, ``request`` or ``flash``.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from async_store import io_executor
+
+DEFAULT_TIMEOUT = float(os.getenv('PREFETCH_TIMEOUT', '10'))
+
+
+class PrefetchTimeout(Exception):
+    """Raised (as a result value) when a prefetched query misses its deadline."""
+
+
+def _on_io_thread():
+    return threading.current_thread().name.startswith('store-io')
+
+
+class Prefetch:
+    """A request-scoped batch of independent lookups."""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self._calls = {}
+        self._futures = None
+        self._started_at = None
+
+    def add(self, name, func, *args, timeout=None, **kwargs):
+        """Declare a lookup; ``timeout`` overrides the batch default for this query."""
+        self._calls[name] = (func, args, kwargs, timeout if timeout is not None else self.timeout)
+        return self
+
+    def start(self):
+        """Submit every declared lookup; the view may do other work before ``results()``."""
+        if self._futures is not None:
+            return self
+        self._started_at = time.monotonic()
+        self._futures = {}
+        for name, (func, args, kwargs, _) in self._calls.items():
+            if _on_io_thread():
+                # Already on the pool: run inline rather than risk exhausting it
+                self._futures[name] = _completed(func, args, kwargs)
+            else:
+                self._futures[name] = io_executor.submit(func, *args, **kwargs)
+        return self
+
+    def results(self):
+        """Wait for every lookup (each up to its own timeout) and return ``{name: value}``."""
+        self.start()
+        results = {}
+        for name, future in self._futures.items():
+            timeout = self._calls[name][3]
+            remaining = max(0.0, timeout - (time.monotonic() - self._started_at))
+            try:
+                results[name] = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                future.cancel()
+                results[name] = PrefetchTimeout(f"{name} did not finish within {timeout}s")
+            except Exception as e:
+                results[name] = e
+        return results
+
+    def run(self):
+        return self.start().results()
+
+
+class _completed:
+    """Future-like wrapper for a lookup that was run inline."""
+
+    def __init__(self, func, args, kwargs):
+        try:
+            self._value, self._error = func(*args, **kwargs), None
+        except Exception as e:
+            self._value, self._error = None, e
+
+    def result(self, timeout=None):
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def cancel(self):
+        return False
@@ -0,0 +1,336 @@
+"""Seasonal pricing engine.
+
+Each homestay's nightly rate per bed starts from its ``price`` column and is
+adjusted by the rows of ``pricing_rules``, applied in this order:
+
+* ``season``         - date range (inclusive), sets ``price`` and/or ``multiplier``
+* ``weekend``        - ``weekdays`` ("4,5" = Friday and Saturday nights, 0 = Monday)
+* ``festival``       - date range, applied last so it wins over seasons
+* ``length_of_stay`` - ``discount_percent`` off the whole stay once ``min_nights`` is reached
+
+Rates for every night of the horizon are computed once per homestay and
+kept as a cumulative array, so the cost of any stay is
+``cumulative[end] - cumulative[start]`` no matter how long it is, and
+``quote_many`` prices many ranges with a single vectorised lookup.
+Calendars are rebuilt after a homestay or rule changes (see
+``on_store_change``) and at most ``ttl`` seconds after they were built.
+Stays are only quoted inside that window (from ``PAST_DAYS`` ago to
+``HORIZON_DAYS`` ahead, at most ``MAX_NIGHTS`` nights), so a calendar never
+grows beyond it.
+"""
+
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+# Per bed per night for homestays without a price
+DEFAULT_PRICE = 500
+RULE_KINDS = ('season', 'weekend', 'festival', 'length_of_stay')
+RATE_KINDS = ('season', 'weekend', 'festival')
+
+CACHE_SECONDS = 300
+PAST_DAYS = 30
+HORIZON_DAYS = 730
+MAX_NIGHTS = 90
+
+
+class PricingError(ValueError):
+    """Raised for invalid stays or pricing rules."""
+
+
+def _to_date(value):
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.fromisoformat(str(value)[:10]).date()
+    except ValueError:
+        raise PricingError(f"Invalid date: {value!r}")
+
+
+def money(amount):
+    """Round to paise; whole rupees come back as int (matches ``total_amount``)."""
+    amount = round(float(amount), 2)
+    return int(amount) if amount.is_integer() else amount
+
+
+def flat_quote(homestay_id, price, from_date, till_date, beds=1):
+    """Quote at the base ``price`` alone, for when the rules cannot be loaded."""
+    start, end = _to_date(from_date), _to_date(till_date)
+    nights = (end - start).days
+    if nights < 1:
+        raise PricingError("till_date must be after from_date")
+    rate = float(price or DEFAULT_PRICE)
+    subtotal = rate * nights * int(beds)
+    return {
+        'homestay_id': int(homestay_id),
+        'from_date': start.isoformat(),
+        'till_date': end.isoformat(),
+        'nights': nights,
+        'beds': int(beds),
+        'average_nightly_rate': money(rate),
+        'subtotal': money(subtotal),
+        'discount_percent': 0.0,
+        'discount': 0,
+        'total': money(subtotal),
+    }
+
+
+def validate_rule(data):
+    """Normalise an admin-submitted rule into a row for ``pricing_rules``."""
+    kind = data.get('kind')
+    if kind not in RULE_KINDS:
+        raise PricingError(f"kind must be one of {', '.join(RULE_KINDS)}")
+    row = {'kind': kind, 'name': (data.get('name') or '').strip() or None}
+    try:
+        row['homestay_id'] = int(data['homestay_id']) if data.get('homestay_id') not in (None, '') else None
+    except (TypeError, ValueError):
+        raise PricingError("homestay_id must be a number")
+
+    if kind == 'length_of_stay':
+        try:
+            row['min_nights'] = int(data['min_nights'])
+            row['discount_percent'] = float(data['discount_percent'])
+        except (KeyError, TypeError, ValueError):
+            raise PricingError("length_of_stay rules need min_nights and discount_percent")
+        if row['min_nights'] < 1 or not 0 < row['discount_percent'] < 100:
+            raise PricingError("min_nights must be >= 1 and discount_percent between 0 and 100")
+        return row
+
+    for field in ('price', 'multiplier'):
+        value = data.get(field)
+        try:
+            row[field] = float(value) if value not in (None, '') else None
+        except (TypeError, ValueError):
+            raise PricingError(f"{field} must be a number")
+        if row[field] is not None and row[field] <= 0:
+            raise PricingError(f"{field} must be positive")
+    if row['price'] is None and row['multiplier'] is None:
+        raise PricingError("rate rules need a price or a multiplier")
+
+    if kind == 'weekend':
+        try:
+            days = sorted({int(d) for d in str(data.get('weekdays') or '4,5').split(',') if d.strip()})
+        except ValueError:
+            raise PricingError("weekdays must be comma-separated numbers 0-6")
+        if not days or any(d < 0 or d > 6 for d in days):
+            raise PricingError("weekdays must be comma-separated numbers 0-6")
+        row['weekdays'] = ','.join(map(str, days))
+    else:
+        if not data.get('start_date') or not data.get('end_date'):
+            raise PricingError(f"{kind} rules need start_date and end_date")
+        start, end = _to_date(data['start_date']), _to_date(data['end_date'])
+        if end < start:
+            raise PricingError("end_date must not be before start_date")
+        row['start_date'], row['end_date'] = start.isoformat(), end.isoformat()
+    return row
+
+
+class RateCalendar:
+    """Nightly per-bed rates of one homestay for ``days`` nights from ``origin``."""
+
+    def __init__(self, homestay_id, base_price, rules, origin, days):
+        self.homestay_id = homestay_id
+        self.origin = origin
+        self.days = days
+        self.built_at = time.monotonic()
+
+        rates = np.full(days, float(base_price), dtype=np.float64)
+        offsets = np.arange(days)
+        weekdays = (origin.weekday() + offsets) % 7
+        for kind in RATE_KINDS:
+            for rule in (r for r in rules if r.get('kind') == kind):
+                if kind == 'weekend':
+                    mask = np.isin(weekdays, [int(d) for d in str(rule.get('weekdays') or '').split(',') if d.strip()])
+                else:
+                    first = (_to_date(rule['start_date']) - origin).days
+                    last = (_to_date(rule['end_date']) - origin).days
+                    mask = (offsets >= first) & (offsets <= last)
+                if rule.get('price') is not None:
+                    rates[mask] = float(rule['price'])
+                if rule.get('multiplier') is not None:
+                    rates[mask] *= float(rule['multiplier'])
+        self.rates = rates
+        self.cumulative = np.concatenate(([0.0], np.cumsum(rates)))
+        # (min_nights, percent), longest threshold first
+        self.stay_discounts = sorted(
+            ((int(r['min_nights']), float(r['discount_percent'])) for r in rules if r.get('kind') == 'length_of_stay'),
+            reverse=True,
+        )
+
+    def covers(self, start, end):
+        return self.origin <= start and end <= self.origin + timedelta(days=self.days)
+
+    def discount_percent(self, nights):
+        for min_nights, percent in self.stay_discounts:
+            if nights >= min_nights:
+                return percent
+        return 0.0
+
+    def nightly_rates(self, start, nights):
+        first = (start - self.origin).days
+        return self.rates[first:first + nights]
+
+    def quote_many(self, starts, ends, beds):
+        """Vectorised quotes; ``starts``/``ends`` are day offsets from ``origin``."""
+        starts, ends, beds = np.asarray(starts), np.asarray(ends), np.asarray(beds, dtype=np.float64)
+        per_bed = self.cumulative[ends] - self.cumulative[starts]
+        nights = ends - starts
+        discounts = np.array([self.discount_percent(n) for n in nights.tolist()], dtype=np.float64)
+        subtotal = per_bed * beds
+        return nights, per_bed, subtotal, discounts, subtotal * discounts / 100.0
+
+
+class PricingEngine:
+    """Per-homestay rate calendars built on demand from the current store."""
+
+    def __init__(self, get_store, ttl=CACHE_SECONDS):
+        self._get_store = get_store
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._calendars = {}
+        self.builds = 0
+        self.quotes = 0
+
+    def invalidate(self, homestay_id=None):
+        with self._lock:
+            if homestay_id is None:
+                self._calendars.clear()
+            else:
+                self._calendars.pop(int(homestay_id), None)
+
+    def on_store_change(self, table, operation, rows, args):
+        if table == 'pricing_rules':
+            self.invalidate()
+        elif table == 'homestays' and operation in ('update', 'delete'):
+            self.invalidate(args[0])
+
+    def _calendars_for(self, spans):
+        """Return ``{homestay_id: RateCalendar}`` covering each ``(start, end)`` in ``spans``."""
+        now = time.monotonic()
+        found, missing = {}, {}
+        with self._lock:
+            for homestay_id, (start, end) in spans.items():
+                calendar = self._calendars.get(homestay_id)
+                if calendar and calendar.covers(start, end) and now - calendar.built_at < self.ttl:
+                    found[homestay_id] = calendar
+                else:
+                    missing[homestay_id] = (start, end)
+        if not missing:
+            return found
+
+        store = self._get_store()
+        homestays = store.homestays.get_many(list(missing))
+        rules = store.pricing_rules.list_for_homestays(list(missing))
+        today = date.today()
+        for homestay_id, (start, end) in missing.items():
+            homestay = homestays.get(homestay_id)
+            if not homestay:
+                continue
+            origin = min(start, today - timedelta(days=PAST_DAYS))
+            days = (max(end, today + timedelta(days=HORIZON_DAYS)) - origin).days
+            own_rules = [r for r in rules if r.get('homestay_id') in (None, homestay_id)]
+            calendar = RateCalendar(homestay_id, homestay.get('price') or DEFAULT_PRICE, own_rules, origin, days)
+            found[homestay_id] = calendar
+            with self._lock:
+                self._calendars[homestay_id] = calendar
+                self.builds += 1
+        return found
+
+    def quote_many(self, requests):
+        """Price many stays at once.
+
+        ``requests`` are dicts with ``homestay_id``, ``from_date``,
+        ``till_date`` and optional ``beds`` (default 1). Returns one quote
+        dict per request, in order; unknown homestays and invalid or
+        out-of-window ranges get ``{'error': ...}`` instead, before any
+        calendar is built.
+        """
+        parsed, spans = [], {}
+        today = date.today()
+        earliest, latest = today - timedelta(days=PAST_DAYS), today + timedelta(days=HORIZON_DAYS)
+        for req in requests:
+            try:
+                homestay_id = int(req['homestay_id'])
+                start, end = _to_date(req['from_date']), _to_date(req['till_date'])
+                beds = int(req.get('beds') or 1)
+                if end <= start:
+                    raise PricingError("till_date must be after from_date")
+                if beds < 1:
+                    raise PricingError("beds must be at least 1")
+                if start < earliest or end > latest:
+                    raise PricingError(f"Stays must be between {earliest.isoformat()} and {latest.isoformat()}")
+                if (end - start).days > MAX_NIGHTS:
+                    raise PricingError(f"Stays can be at most {MAX_NIGHTS} nights")
+            except KeyError as e:
+                parsed.append(PricingError(f"Missing field {e}"))
+                continue
+            except (TypeError, ValueError) as e:
+                parsed.append(PricingError(str(e)))
+                continue
+            parsed.append((homestay_id, start, end, beds))
+            lo, hi = spans.get(homestay_id, (start, end))
+            spans[homestay_id] = (min(lo, start), max(hi, end))
+
+        calendars = self._calendars_for(spans) if spans else {}
+
+        # Group by homestay so each calendar answers its ranges in one vectorised call
+        by_homestay = {}
+        for index, item in enumerate(parsed):
+            if not isinstance(item, Exception):
+                by_homestay.setdefault(item[0], []).append(index)
+
+        results = [None] * len(parsed)
+        for homestay_id, indexes in by_homestay.items():
+            calendar = calendars.get(homestay_id)
+            if calendar is None:
+                for i in indexes:
+                    results[i] = {'homestay_id': homestay_id, 'error': 'Homestay not found'}
+                continue
+            starts = [(parsed[i][1] - calendar.origin).days for i in indexes]
+            ends = [(parsed[i][2] - calendar.origin).days for i in indexes]
+            beds = [parsed[i][3] for i in indexes]
+            nights, per_bed, subtotal, percent, discount = calendar.quote_many(starts, ends, beds)
+            for k, i in enumerate(indexes):
+                results[i] = {
+                    'homestay_id': homestay_id,
+                    'from_date': parsed[i][1].isoformat(),
+                    'till_date': parsed[i][2].isoformat(),
+                    'nights': int(nights[k]),
+                    'beds': beds[k],
+                    'average_nightly_rate': money(per_bed[k] / nights[k]),
+                    'subtotal': money(subtotal[k]),
+                    'discount_percent': float(percent[k]),
+                    'discount': money(discount[k]),
+                    'total': money(subtotal[k] - discount[k]),
+                }
+        for i, item in enumerate(parsed):
+            if isinstance(item, Exception):
+                results[i] = {'error': str(item)}
+        with self._lock:
+            self.quotes += len(parsed)
+        return results
+
+    def quote(self, homestay_id, from_date, till_date, beds=1):
+        """Quote a single stay; raises ``PricingError`` if it cannot be priced."""
+        result = self.quote_many([
+            {'homestay_id': homestay_id, 'from_date': from_date, 'till_date': till_date, 'beds': beds}
+        ])[0]
+        if 'error' in result:
+            raise PricingError(result['error'])
+        return result
+
+    def nightly_rates(self, homestay_id, start, nights):
+        """``{iso_date: rate}`` for ``nights`` nights from ``start`` (e.g. for a calendar)."""
+        start = _to_date(start)
+        end = start + timedelta(days=nights)
+        calendar = self._calendars_for({int(homestay_id): (start, end)}).get(int(homestay_id))
+        if calendar is None:
+            return {}
+        rates = calendar.nightly_rates(start, nights)
+        return {(start + timedelta(days=i)).isoformat(): money(rate) for i, rate in enumerate(rates.tolist())}
+
+    def stats(self):
+        with self._lock:
+            return {'calendars': len(self._calendars), 'builds': self.builds, 'quotes': self.quotes}
@@ -0,0 +1,266 @@
+"""On-demand request profiling and memory snapshots for admins.
+
+``Profiler.enabled`` starts from ``PROFILING`` and is switched at runtime
+with ``enable()``/``disable()`` (``/admin/profiles/enable`` and
+``/admin/profiles/disable``). While it is off, and nothing is still being
+profiled, each hook returns after one attribute check.
+
+A profiled request is sampled by a helper thread that records the request
+thread's Python stack every ``interval`` seconds. The result is a set of
+collapsed stacks (``module:function;module:function <count>`` per line),
+the input format of flamegraph.pl, speedscope and similar tools. A request
+is profiled when:
+
+* an admin sends ``X-Profile: 1`` - the response is unchanged and carries
+  ``X-Profile-Id``; the profile is fetched from ``/admin/profiles/<id>``
+* an admin adds ``?_profile=1`` - the response body is replaced by the
+  collapsed stacks
+* it is picked by random sampling (``sample_percent`` of all requests)
+
+Every profile goes into a ring of the last ``keep`` profiles.
+Async views run on an event loop thread, so their samples mostly show
+the request thread waiting for it.
+
+``MemoryTracker`` starts ``tracemalloc`` on first use and reports which
+source lines allocated or freed memory since the previous snapshot.
+"""
+
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+from flask import Response, g, request, session
+
+INTERVAL_SECONDS = 0.005
+KEEP = 50
+MAX_CONCURRENT = 4
+MAX_DEPTH = 128
+
+
+def _frame_name(code):
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}"
+
+
+class Sampler:
+    """Sample one thread's stack on a daemon thread until ``stop()``."""
+
+    def __init__(self, thread_id, interval=INTERVAL_SECONDS):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+        self._names = {}
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None and len(names) < MAX_DEPTH:
+                code = frame.f_code
+                name = self._names.get(code)
+                if name is None:
+                    name = self._names[code] = _frame_name(code)
+                names.append(name)
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self
+
+
+def collapsed(stacks):
+    """Collapsed-stack text of a ``Counter`` of stacks, heaviest first."""
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class Profiler:
+    def __init__(self, sample_percent=0.0, interval=INTERVAL_SECONDS, keep=KEEP, max_concurrent=MAX_CONCURRENT,
+                 enabled=False):
+        self.enabled = enabled
+        self.sample_percent = sample_percent
+        self.interval = interval
+        self.max_concurrent = max_concurrent
+        self._lock = threading.Lock()
+        self._profiles = deque(maxlen=keep)
+        self._ids = itertools.count(1)
+        self.active = 0
+        self.profiled = Counter()
+        self.skipped_busy = 0
+
+    def init_app(self, app):
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        return self
+
+    def enable(self, sample_percent=None):
+        if sample_percent is not None:
+            self.sample_percent = sample_percent
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def _reason(self):
+        if session.get('is_admin'):
+            if request.args.get('_profile') == '1':
+                return 'inline'
+            if request.headers.get('X-Profile') == '1':
+                return 'header'
+        if self.sample_percent and random.random() * 100 < self.sample_percent:
+            return 'sampled'
+        return None
+
+    def before_request(self):
+        if not self.enabled:
+            return
+        reason = self._reason()
+        if reason is None:
+            return
+        with self._lock:
+            if self.active >= self.max_concurrent:
+                self.skipped_busy += 1
+                return
+            self.active += 1
+        g.profile = (reason, time.perf_counter(), Sampler(threading.get_ident(), self.interval).start())
+
+    def _finish(self):
+        # Nothing is being profiled anywhere; skip the request-context lookup
+        if not self.active:
+            return None
+        profile = g.pop('profile', None)
+        if profile is None:
+            return None
+        reason, started, sampler = profile
+        sampler.stop()
+        record = {
+            'id': next(self._ids),
+            'reason': reason,
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+            'samples': sampler.samples,
+            'interval_ms': self.interval * 1000,
+            'stacks': sampler.stacks,
+        }
+        with self._lock:
+            self.active -= 1
+            self.profiled[reason] += 1
+            self._profiles.append(record)
+        return record
+
+    def after_request(self, response):
+        record = self._finish()
+        if record is None:
+            return response
+        if record['reason'] == 'inline':
+            return Response(collapsed(record['stacks']), mimetype='text/plain',
+                            headers={'X-Profile-Id': str(record['id'])})
+        response.headers['X-Profile-Id'] = str(record['id'])
+        return response
+
+    def teardown_request(self, exc=None):
+        # A view that raised skips after_request; stop its sampler here
+        self._finish()
+
+    def list(self):
+        with self._lock:
+            return [{k: v for k, v in p.items() if k != 'stacks'} for p in reversed(self._profiles)]
+
+    def get(self, profile_id):
+        with self._lock:
+            for profile in self._profiles:
+                if profile['id'] == profile_id:
+                    return profile
+        return None
+
+    def merged(self, path=None):
+        """Stacks of every kept profile (or those of ``path``) added together."""
+        total = Counter()
+        with self._lock:
+            for profile in self._profiles:
+                if path is None or profile['path'] == path:
+                    total.update(profile['stacks'])
+        return total
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'sample_percent': self.sample_percent,
+                'interval_ms': self.interval * 1000,
+                'kept': len(self._profiles),
+                'active': self.active,
+                'profiled': dict(self.profiled),
+                'skipped_busy': self.skipped_busy,
+            }
+
+
+class MemoryTracker:
+    """Diff ``tracemalloc`` snapshots between calls."""
+
+    def __init__(self, frames=1):
+        self.frames = frames
+        self._lock = threading.Lock()
+        self._previous = None
+
+    def snapshot_diff(self, limit=25):
+        """Start tracing if needed; returns the top allocation changes since the previous call."""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                self._previous = None
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            previous, self._previous = self._previous, snapshot
+            current, peak = tracemalloc.get_traced_memory()
+        result = {'tracing': True, 'traced_bytes': current, 'peak_bytes': peak, 'baseline': previous is None}
+        if previous is None:
+            result['top'] = [self._line(stat) for stat in snapshot.statistics('lineno')[:limit]]
+        else:
+            result['changes'] = [self._line(stat) for stat in snapshot.compare_to(previous, 'lineno')[:limit]]
+        return result
+
+    @staticmethod
+    def _line(stat):
+        frame = stat.traceback[0]
+        line = {'file': frame.filename, 'line': frame.lineno, 'size': stat.size, 'count': stat.count}
+        if hasattr(stat, 'size_diff'):
+            line['size_diff'] = stat.size_diff
+            line['count_diff'] = stat.count_diff
+        return line
+
+    def stats(self):
+        if not tracemalloc.is_tracing():
+            return {'tracing': False}
+        current, peak = tracemalloc.get_traced_memory()
+        return {'tracing': True, 'traced_bytes': current, 'peak_bytes': peak}
+
+    def stop(self):
+        with self._lock:
+            self._previous = None
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+        return {'tracing': False}
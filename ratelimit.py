@@ -0,0 +1,238 @@
+"""Token-bucket rate limiting for the auth endpoints.
+
+Each endpoint has a policy: a list of ``(key_kind, Limit)`` pairs, checked
+in order. ``ip`` buckets are keyed by client address, ``email`` and
+``phone`` by the normalised value submitted in the form or JSON body, so a
+script cannot get around the limit by rotating either one alone. A
+``Limit(capacity, period)`` allows a burst of ``capacity`` requests and
+refills at ``capacity / period`` tokens per second.
+
+Rejected requests get HTTP 429 with a ``Retry-After`` header. Buckets live
+in process memory by default; ``RATE_LIMIT_STORAGE`` can point at a SQLite
+file or Redis server so every worker shares them (see ``create_buckets``).
+"""
+
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+from functools import wraps
+from urllib.parse import urlparse
+
+from flask import flash, jsonify, make_response, render_template, request
+
+try:
+    import redis
+except ImportError:  # optional; only needed for RATE_LIMIT_STORAGE=redis://...
+    redis = None
+
+log = logging.getLogger(__name__)
+
+Limit = namedtuple('Limit', 'capacity period')
+
+POLICIES = {
+    'login': [('ip', Limit(20, 60)), ('email', Limit(10, 600))],
+    'request_login_otp': [('ip', Limit(10, 600)), ('email', Limit(3, 600))],
+    'signup': [('ip', Limit(10, 3600)), ('email', Limit(3, 3600)), ('phone', Limit(3, 3600))],
+    'verify_signup_otp': [('ip', Limit(10, 600))],
+}
+
+MAX_LOCAL_BUCKETS = 100000
+
+
+class LocalBuckets:
+    """Per-process buckets; a check is a dict lookup and a little arithmetic under a lock."""
+
+    name = 'memory'
+
+    def __init__(self, max_buckets=MAX_LOCAL_BUCKETS):
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, capacity, rate, now):
+        """Take one token; returns ``(allowed, retry_after_seconds)``."""
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+
+class SQLiteBuckets:
+    """Buckets in a SQLite file shared by the workers of one host."""
+
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute("CREATE TABLE IF NOT EXISTS rate_buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, capacity, rate, now):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute("INSERT OR REPLACE INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+
+class RedisBuckets:
+    """Buckets in Redis, updated atomically by a Lua script."""
+
+    name = 'redis'
+    SCRIPT = """
+    local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + (now - updated) * rate)
+    local allowed = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("RATE_LIMIT_STORAGE uses redis:// but the 'redis' package is not installed")
+            client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.client = client
+        self._script = client.register_script(self.SCRIPT)
+
+    def take(self, key, capacity, rate, now):
+        allowed, tokens = self._script(keys=[f"ratelimit:{key}"], args=[capacity, rate, now])
+        allowed = bool(int(allowed))
+        return allowed, 0.0 if allowed else (1 - float(tokens)) / rate
+
+
+def create_buckets(url):
+    """Bucket store for ``RATE_LIMIT_STORAGE`` (memory://, sqlite:///path or redis://...)."""
+    url = url or 'memory://'
+    scheme = urlparse(url).scheme
+    if scheme == 'memory':
+        return LocalBuckets()
+    if scheme == 'sqlite':
+        return SQLiteBuckets(url[len('sqlite:///'):] if url.startswith('sqlite:///') else url[len('sqlite://'):])
+    if scheme in ('redis', 'rediss', 'unix'):
+        return RedisBuckets(url)
+    raise ValueError(f"Unsupported RATE_LIMIT_STORAGE: {url}")
+
+
+def _submitted(field):
+    if request.is_json:
+        value = (request.get_json(silent=True) or {}).get(field)
+    else:
+        value = request.form.get(field)
+    return str(value or '').strip()
+
+
+def _key_for(kind):
+    if kind == 'ip':
+        return request.remote_addr or 'unknown'
+    if kind == 'email':
+        return _submitted('email').lower() or None
+    if kind == 'phone':
+        return re.sub(r'\D', '', _submitted('phone_number')) or None
+    raise ValueError(f"Unknown rate-limit key: {kind}")
+
+
+class RateLimiter:
+    def __init__(self, buckets=None, policies=None, enabled=True):
+        self.buckets = buckets or LocalBuckets()
+        self.policies = dict(POLICIES if policies is None else policies)
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.allowed = Counter()
+        self.rejected = Counter()
+        self.errors = 0
+
+    def check(self, endpoint):
+        """Take a token from every bucket of ``endpoint``; returns seconds to wait, or 0 if allowed."""
+        now = time.time()
+        for kind, limit in self.policies.get(endpoint, ()):
+            key = _key_for(kind)
+            if key is None:
+                continue
+            try:
+                allowed, retry_after = self.buckets.take(f"{endpoint}:{kind}:{key}", limit.capacity,
+                                                         limit.capacity / limit.period, now)
+            except Exception as e:
+                # A broken shared store must not lock everyone out
+                with self._lock:
+                    self.errors += 1
+                log.warning("Rate limiter error (%s): %s", self.buckets.name, e)
+                continue
+            if not allowed:
+                with self._lock:
+                    self.rejected[f"{endpoint}:{kind}"] += 1
+                return max(1, int(retry_after + 0.999))
+        with self._lock:
+            self.allowed[endpoint] += 1
+        return 0
+
+    def limit(self, endpoint, template=None, **context):
+        """Decorator: apply ``endpoint``'s policy to POST requests.
+
+        JSON requests are rejected with a JSON body; form posts re-render
+        ``template`` with a flash message.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if not self.enabled or request.method != 'POST':
+                    return f(*args, **kwargs)
+                retry_after = self.check(endpoint)
+                if not retry_after:
+                    return f(*args, **kwargs)
+                message = f'Too many attempts. Please try again in {retry_after} seconds.'
+                if request.is_json or template is None:
+                    response = make_response(jsonify({'message': message}), 429)
+                else:
+                    flash(message, 'error')
+                    response = make_response(render_template(template, **context), 429)
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+            return decorated_function
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': self.buckets.name,
+                'allowed': dict(self.allowed),
+                'rejected': dict(self.rejected),
+                'rejected_total': sum(self.rejected.values()),
+                'errors': self.errors,
+            }
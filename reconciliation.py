@@ -0,0 +1,174 @@
+"""Link Cashfree payments to bookings.
+
+``cashfree_webhook`` only records the payment status. This worker scans
+payments that have not been reconciled yet, matches them to bookings by
+``order_id`` and updates the bookings in bulk:
+
+* SUCCESS -> pending/paid bookings become ``approved``, but only when the
+  paid amount covers the booking's ``total_amount``; underpaid bookings are
+  left for an admin to review
+* FAILED  -> pending bookings become ``payment_failed`` (releasing the beds)
+
+Payments without a booking yet are left for the next run, and are marked
+reconciled once they are older than ``unmatched_grace_seconds``, so they do
+not pile up in front of newer payments. A pass that stops at ``max_batches``
+is resumed from where it stopped by the next run. Work is done in bounded
+batches and lag (payment update to reconciliation) is recorded.
+"""
+
+import threading
+import time
+from datetime import datetime, timezone
+
+STATUS_TRANSITIONS = {
+    'SUCCESS': ('approved', ['pending', 'paid']),
+    'FAILED': ('payment_failed', ['pending']),
+}
+UNMATCHED_GRACE_SECONDS = 48 * 3600
+
+
+class ReconciliationStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.payments_scanned = 0
+        self.payments_reconciled = 0
+        self.bookings_updated = 0
+        self.unmatched = 0
+        self.aged_out = 0
+        self.underpaid = 0
+        self.last_run_at = None
+        self.last_duration_ms = None
+        self.last_lag_seconds = None
+        self.max_lag_seconds = None
+        self._lag_total = 0.0
+
+    def record(self, summary, lags):
+        with self._lock:
+            self.runs += 1
+            self.payments_scanned += summary['scanned']
+            self.payments_reconciled += summary['reconciled']
+            self.bookings_updated += summary['bookings_updated']
+            self.unmatched = summary['unmatched']
+            self.aged_out += summary['aged_out']
+            self.underpaid += summary['underpaid']
+            self.last_run_at = summary['finished_at']
+            self.last_duration_ms = summary['duration_ms']
+            if lags:
+                self.last_lag_seconds = max(lags)
+                self.max_lag_seconds = max(self.max_lag_seconds or 0.0, self.last_lag_seconds)
+                self._lag_total += sum(lags)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'runs': self.runs,
+                'payments_scanned': self.payments_scanned,
+                'payments_reconciled': self.payments_reconciled,
+                'bookings_updated': self.bookings_updated,
+                'unmatched_last_run': self.unmatched,
+                'unmatched_aged_out': self.aged_out,
+                'underpaid': self.underpaid,
+                'last_run_at': self.last_run_at,
+                'last_duration_ms': self.last_duration_ms,
+                'last_lag_seconds': self.last_lag_seconds,
+                'max_lag_seconds': self.max_lag_seconds,
+                'avg_lag_seconds': self._lag_total / self.payments_reconciled if self.payments_reconciled else None,
+            }
+
+
+stats = ReconciliationStats()
+
+
+def _parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _amount(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _covers(payment, booking):
+    """True if the payment's amount is at least the booking total."""
+    paid, due = _amount(payment.get('amount')), _amount(booking.get('total_amount'))
+    return paid is not None and due is not None and paid + 0.005 >= due
+
+
+# order_id after which the next run continues when a run stops at max_batches
+_resume_after = None
+
+
+def reconcile_payments(store, batch_size=100, max_batches=10, unmatched_grace_seconds=UNMATCHED_GRACE_SECONDS):
+    """Run one reconciliation pass; returns a summary dict."""
+    global _resume_after
+    started = time.perf_counter()
+    summary = {'scanned': 0, 'reconciled': 0, 'bookings_updated': 0, 'unmatched': 0, 'aged_out': 0,
+               'underpaid': 0, 'batches': 0}
+    lags = []
+    cursor = _resume_after
+    finished = False
+
+    for _ in range(max_batches):
+        payments = store.payments.list_unreconciled(list(STATUS_TRANSITIONS), after_order_id=cursor, limit=batch_size)
+        if not payments:
+            finished = True
+            break
+        summary['batches'] += 1
+        summary['scanned'] += len(payments)
+        cursor = payments[-1]['order_id']
+
+        by_order = {p['order_id']: p for p in payments}
+        bookings = store.bookings.list_by_order_ids(by_order)
+        matched_orders = {b['order_id'] for b in bookings}
+        summary['unmatched'] += len(by_order) - len(matched_orders)
+
+        # One bulk update per target status
+        for payment_status, (new_status, from_statuses) in STATUS_TRANSITIONS.items():
+            ids = []
+            for b in bookings:
+                payment = by_order[b['order_id']]
+                if payment['status'] != payment_status:
+                    continue
+                if payment_status == 'SUCCESS' and not _covers(payment, b):
+                    summary['underpaid'] += 1
+                    continue
+                ids.append(b['id'])
+            if ids:
+                updated = store.bookings.update_many(ids, {'status': new_status}, only_statuses=from_statuses)
+                summary['bookings_updated'] += len(updated)
+
+        now = datetime.now(timezone.utc)
+        expired = set()
+        for order_id, payment in by_order.items():
+            if order_id in matched_orders:
+                continue
+            seen_at = _parse_timestamp(payment.get('updated_at') or payment.get('created_at'))
+            if seen_at is None or (now - seen_at).total_seconds() > unmatched_grace_seconds:
+                expired.add(order_id)
+        store.payments.mark_reconciled(matched_orders | expired, now.isoformat())
+        summary['reconciled'] += len(matched_orders)
+        summary['aged_out'] += len(expired)
+        for order_id in matched_orders:
+            paid_at = _parse_timestamp(by_order[order_id].get('updated_at') or by_order[order_id].get('created_at'))
+            if paid_at:
+                lags.append((now - paid_at).total_seconds())
+
+        if len(payments) < batch_size:
+            finished = True
+            break
+
+    # Start from the beginning again once the end was reached
+    _resume_after = None if finished else cursor
+    summary['finished_at'] = datetime.now(timezone.utc).isoformat()
+    summary['duration_ms'] = (time.perf_counter() - started) * 1000.0
+    stats.record(summary, lags)
+    return summary
@@ -0,0 +1,249 @@
+"""Timeouts, circuit breakers and stale fallbacks around data-store calls.
+
+``Resilience.protect(store)`` wraps every repository method:
+
+* each call runs on a bounded pool and is abandoned after the read or write
+  timeout (``CallTimeout``), so a slow Supabase cannot hold a request;
+  only writes that are safe to repeat (``RETRYABLE_WRITES``) are abandoned.
+  Any other write (an insert, a compare-and-set, a conditional update)
+  still lands after it is abandoned, so the caller would treat a done write
+  as failed or repeat it; those run on the caller's thread, bounded only by
+  the HTTP client's timeout
+* failures and timeouts are counted by one ``CircuitBreaker`` per
+  ``table.method``; once it opens, calls fail fast with ``BreakerOpen``
+  until ``reset_seconds`` pass and a single probe call succeeds
+* the read paths in ``STALE_READS`` remember their last good result and
+  serve it (for up to ``stale_max_age`` seconds) while the call fails, the
+  breaker is open or the call times out; a timed-out call that completes
+  later still refreshes the remembered result
+
+Errors that mean the service answered (``IGNORED_ERRORS``, e.g. a
+constraint violation) are raised as usual and do not trip the breaker.
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import wraps
+
+try:
+    from postgrest.exceptions import APIError
+    IGNORED_ERRORS = (APIError,)
+except ImportError:  # SQLite-only installs
+    IGNORED_ERRORS = ()
+
+READ_TIMEOUT = 5.0
+WRITE_TIMEOUT = 10.0
+FAILURE_THRESHOLD = 5
+RESET_SECONDS = 30.0
+STALE_MAX_AGE = 3600.0
+MAX_STALE_ENTRIES = 5000
+MAX_WORKERS = 32
+
+# Read paths that may be answered with their last good result
+STALE_READS = {
+    ('homestays', 'list_all'),
+    ('homestays', 'get'),
+    ('homestays', 'get_many'),
+    ('bookings', 'list_active_for_homestay'),
+    ('inauguration', 'get_status'),
+    ('pricing_rules', 'list_for_homestays'),
+}
+
+# Writes that leave the same state and result when repeated; only these are
+# abandoned on a timeout, every other write runs to completion
+RETRYABLE_WRITES = {'update', 'upsert', 'upsert_many', 'mark_reconciled', 'set_status'}
+
+
+def _stale_args(args):
+    """Args with id collections (lists, sets, generators) as sorted tuples, so equal reads share one key."""
+    normalised = []
+    for arg in args:
+        if isinstance(arg, (str, bytes, dict)) or not hasattr(arg, '__iter__'):
+            normalised.append(arg)
+            continue
+        values = list(arg)
+        try:
+            normalised.append(tuple(sorted(set(values), key=repr)))
+        except TypeError:
+            normalised.append(tuple(values))
+    return tuple(normalised)
+
+
+def _run_inline(func, args, kwargs):
+    """Run ``func`` on this thread; returns a finished ``Future`` with its outcome."""
+    future = Future()
+    try:
+        future.set_result(func(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+class BreakerOpen(Exception):
+    """Raised instead of calling a backend whose breaker is open."""
+
+
+class CallTimeout(Exception):
+    """Raised when a backend call does not finish within its timeout."""
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_seconds=RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    def allow(self):
+        """True if a call may go to the backend now."""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.CLOSED or (self.state == self.HALF_OPEN and not self._probe_in_flight):
+                if self.state == self.HALF_OPEN:
+                    self._probe_in_flight = True
+                self.calls += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'calls': self.calls,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'times_opened': self.times_opened,
+            }
+
+
+class Resilience:
+    """Shared breakers, stale results and call pool for one app."""
+
+    def __init__(self, read_timeout=READ_TIMEOUT, write_timeout=WRITE_TIMEOUT,
+                 failure_threshold=FAILURE_THRESHOLD, reset_seconds=RESET_SECONDS,
+                 stale_max_age=STALE_MAX_AGE, max_workers=MAX_WORKERS):
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.stale_max_age = stale_max_age
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='store-call')
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._stale = OrderedDict()
+        self.timeouts = 0
+        self.stale_served = 0
+
+    def breaker(self, table, method):
+        name = f"{table}.{method}"
+        with self._lock:
+            if name not in self._breakers:
+                self._breakers[name] = CircuitBreaker(name, self.failure_threshold, self.reset_seconds)
+            return self._breakers[name]
+
+    def protect(self, store):
+        store.wrap_methods(self._wrap)
+        return store
+
+    def _remember(self, key, value):
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._stale[key] = (time.monotonic(), value)
+            self._stale.move_to_end(key)
+            while len(self._stale) > MAX_STALE_ENTRIES:
+                self._stale.popitem(last=False)
+
+    def _fallback(self, key, error):
+        if key is not None:
+            with self._lock:
+                entry = self._stale.get(key)
+                if entry and time.monotonic() - entry[0] <= self.stale_max_age:
+                    self.stale_served += 1
+                    return copy.deepcopy(entry[1])
+        raise error
+
+    def _wrap(self, table, method, is_write, func):
+        breaker = self.breaker(table, method)
+        timeout = self.write_timeout if is_write else self.read_timeout
+        inline = is_write and method not in RETRYABLE_WRITES
+        serves_stale = (table, method) in STALE_READS
+
+        @wraps(func)
+        def call(*args, **kwargs):
+            key = None
+            if serves_stale:
+                # Materialises generator arguments too, so they are passed on intact
+                args = _stale_args(args)
+                key = (table, method, repr(args), repr(sorted(kwargs.items())))
+            if not breaker.allow():
+                return self._fallback(key, BreakerOpen(f"{breaker.name} circuit is open"))
+            if inline:
+                future = _run_inline(func, args, kwargs)
+            else:
+                future = self._executor.submit(func, *args, **kwargs)
+            try:
+                result = future.result(timeout=timeout)
+            except FutureTimeoutError:
+                breaker.record_failure()
+                with self._lock:
+                    self.timeouts += 1
+                if key is not None:
+                    # Let the slow call refresh the fallback when it does finish
+                    future.add_done_callback(lambda f: f.exception() is None and self._remember(key, f.result()))
+                return self._fallback(key, CallTimeout(f"{breaker.name} did not finish within {timeout}s"))
+            except IGNORED_ERRORS:
+                breaker.record_success()
+                raise
+            except Exception as e:
+                breaker.record_failure()
+                return self._fallback(key, e)
+            breaker.record_success()
+            if key is not None:
+                self._remember(key, result)
+            return result
+        return call
+
+    def snapshot(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+            summary = {'timeouts': self.timeouts, 'stale_served': self.stale_served, 'stale_entries': len(self._stale)}
+        summary['breakers'] = {name: b.snapshot() for name, b in sorted(breakers.items())}
+        summary['open'] = sorted(name for name, b in summary['breakers'].items() if b['state'] != CircuitBreaker.CLOSED)
+        return summary
@@ -0,0 +1,77 @@
+"""Minimal in-process scheduler for periodic background jobs.
+
+Each job runs on its own daemon thread every ``interval`` seconds and can
+be woken early with ``trigger()``. Jobs must be idempotent: under gunicorn
+every worker process runs its own copy.
+"""
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Run ``func()`` every ``interval`` seconds on a daemon thread."""
+
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.runs = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_started_at = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name=f"task-{self.name}", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def trigger(self):
+        """Run the job as soon as possible instead of waiting for the interval."""
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            self.last_started_at = time.time()
+            try:
+                self.func()
+                self.runs += 1
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                log.exception("[%s] background task failed", self.name)
+
+    def status(self):
+        return {
+            'interval_seconds': self.interval,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'runs': self.runs,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'last_started_at': self.last_started_at,
+        }
+
+
+tasks = {}
+
+
+def schedule(name, interval, func):
+    """Register and start a periodic task; returns the existing one if already scheduled."""
+    if name not in tasks:
+        tasks[name] = PeriodicTask(name, interval, func).start()
+    return tasks[name]
@@ -0,0 +1,124 @@
+"""Single-flight coalescing of identical concurrent reads.
+
+When many requests ask for the same data at the same moment (e.g. a burst
+on ``/rooms``), only the first thread runs the query; threads that ask for
+the same normalised query while it is in flight wait for it and get a copy
+of its result (or its exception). Nothing is cached: once the call returns
+the next identical read goes to the database again.
+
+``SingleFlight.coalesce(store)`` applies this to every read method of a
+store. Queries are keyed by ``table.method`` and their bound arguments
+(defaults applied, sets and dicts sorted), so ``get(5)`` and
+``get(homestay_id=5)`` share a flight.
+"""
+
+import copy
+import inspect
+import threading
+from collections import Counter
+from functools import wraps
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'followers')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+def _freeze(value):
+    """Hashable, order-normalised form of a query argument."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(_freeze(v) for v in value))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.calls = 0
+        self.executed = 0
+        self.coalesced = Counter()
+
+    def do(self, key, func):
+        """Run ``func()`` unless an identical ``key`` is already in flight."""
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.executed += 1
+            else:
+                flight.followers += 1
+                self.coalesced[key[0]] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        result = None
+        try:
+            result = func()
+            return result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                shared = flight.followers > 0
+            if shared and flight.error is None:
+                # Followers get their own copy; the leader's caller may mutate ``result``
+                flight.result = copy.deepcopy(result)
+            flight.done.set()
+
+    def coalesce(self, store):
+        store.wrap_methods(self._wrap)
+        return store
+
+    def _wrap(self, table, method, is_write, func):
+        if is_write:
+            return func
+        name = f"{table}.{method}"
+        try:
+            signature = inspect.signature(func)
+        except (TypeError, ValueError):
+            signature = None
+
+        @wraps(func)
+        def call(*args, **kwargs):
+            try:
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                key = (name, _freeze(bound.arguments))
+            except (AttributeError, TypeError):
+                key = (name, _freeze(args), _freeze(kwargs))
+            try:
+                hash(key)
+            except TypeError:
+                return func(*args, **kwargs)
+            return self.do(key, lambda: func(*args, **kwargs))
+        return call
+
+    def stats(self):
+        with self._lock:
+            coalesced = sum(self.coalesced.values())
+            return {
+                'calls': self.calls,
+                'executed': self.executed,
+                'coalesced': coalesced,
+                'coalescing_ratio': round(coalesced / self.calls, 4) if self.calls else 0.0,
+                'in_flight': len(self._flights),
+                'coalesced_by_query': dict(self.coalesced.most_common(20)),
+            }
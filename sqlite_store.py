@@ -0,0 +1,777 @@
+"""Local SQLite backend for the data-access layer.
+
+Mirrors the Supabase tables used by the app with the indexes the hot
+queries need, so the app can be run and load-tested offline with
+``DATA_BACKEND=sqlite``. ``SQLITE_PATH=:memory:`` gives a throwaway
+database shared by all threads of the process.
+"""
+
+import sqlite3
+import threading
+import uuid
+
+from datastore import (
+    DataStore,
+    QueryStats,
+    UsersRepository,
+    HomestaysRepository,
+    BookingsRepository,
+    ArchivedBookingsRepository,
+    PaymentsRepository,
+    InaugurationRepository,
+    PaymentReferencesRepository,
+    PricingRulesRepository,
+    CalendarSourcesRepository,
+    ExternalHoldsRepository,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT,
+    email TEXT,
+    username TEXT,
+    phone_number TEXT,
+    password_hash TEXT,
+    is_admin BOOLEAN DEFAULT 0,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_users_email ON users (email);
+CREATE INDEX IF NOT EXISTS idx_users_username ON users (username);
+CREATE INDEX IF NOT EXISTS idx_users_phone ON users (phone_number);
+
+CREATE TABLE IF NOT EXISTS homestays (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner TEXT,
+    rooms INTEGER,
+    beds INTEGER,
+    floor TEXT,
+    description TEXT,
+    price INTEGER,
+    contact TEXT,
+    image TEXT,
+    created_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS bookings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    homestay_id INTEGER,
+    from_date TEXT,
+    till_date TEXT,
+    nights INTEGER,
+    beds_booked INTEGER DEFAULT 1,
+    amount TEXT,
+    total_amount REAL,
+    status TEXT,
+    payment_reference TEXT,
+    txn_id TEXT,
+    screenshot TEXT,
+    rejection_reason TEXT,
+    user_id INTEGER,
+    user_name TEXT,
+    user_phone TEXT,
+    user_email TEXT,
+    order_id TEXT,
+    bed_assignment TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_bookings_availability ON bookings (homestay_id, status, from_date, till_date);
+CREATE INDEX IF NOT EXISTS idx_bookings_from_date ON bookings (from_date);
+CREATE INDEX IF NOT EXISTS idx_bookings_user_email ON bookings (user_email, from_date);
+CREATE INDEX IF NOT EXISTS idx_bookings_user_phone ON bookings (user_phone, from_date);
+CREATE INDEX IF NOT EXISTS idx_bookings_user_name ON bookings (user_name, from_date);
+CREATE INDEX IF NOT EXISTS idx_bookings_order_id ON bookings (order_id);
+CREATE INDEX IF NOT EXISTS idx_bookings_status ON bookings (status, id);
+
+-- Past stays moved out of bookings (archive.py); ids are kept
+CREATE TABLE IF NOT EXISTS bookings_archive (
+    id INTEGER PRIMARY KEY,
+    homestay_id INTEGER,
+    from_date TEXT,
+    till_date TEXT,
+    nights INTEGER,
+    beds_booked INTEGER DEFAULT 1,
+    amount TEXT,
+    total_amount REAL,
+    status TEXT,
+    payment_reference TEXT,
+    txn_id TEXT,
+    screenshot TEXT,
+    rejection_reason TEXT,
+    user_id INTEGER,
+    user_name TEXT,
+    user_phone TEXT,
+    user_email TEXT,
+    order_id TEXT,
+    bed_assignment TEXT,
+    created_at TEXT,
+    archived_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_bookings_archive_from_date ON bookings_archive (from_date);
+CREATE INDEX IF NOT EXISTS idx_bookings_archive_user_email ON bookings_archive (user_email, from_date);
+CREATE INDEX IF NOT EXISTS idx_bookings_archive_user_phone ON bookings_archive (user_phone, from_date);
+CREATE INDEX IF NOT EXISTS idx_bookings_archive_user_name ON bookings_archive (user_name, from_date);
+
+CREATE TABLE IF NOT EXISTS payments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id TEXT UNIQUE,
+    amount REAL,
+    status TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    reconciled_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_payments_unreconciled ON payments (reconciled_at, status, order_id);
+
+CREATE TABLE IF NOT EXISTS payment_references (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    reference TEXT NOT NULL,
+    booking_id TEXT NOT NULL,
+    created_at TEXT,
+    UNIQUE (kind, reference, booking_id)
+);
+CREATE INDEX IF NOT EXISTS idx_payment_references_booking ON payment_references (booking_id);
+
+CREATE TABLE IF NOT EXISTS pricing_rules (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    homestay_id INTEGER,
+    kind TEXT NOT NULL,
+    name TEXT,
+    start_date TEXT,
+    end_date TEXT,
+    weekdays TEXT,
+    price REAL,
+    multiplier REAL,
+    min_nights INTEGER,
+    discount_percent REAL,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_pricing_rules_homestay ON pricing_rules (homestay_id);
+
+CREATE TABLE IF NOT EXISTS calendar_sources (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    homestay_id INTEGER NOT NULL,
+    name TEXT,
+    url TEXT NOT NULL,
+    beds INTEGER,
+    etag TEXT,
+    last_modified TEXT,
+    last_synced_at TEXT,
+    last_error TEXT,
+    created_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS external_holds (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source_id INTEGER NOT NULL,
+    homestay_id INTEGER NOT NULL,
+    uid TEXT NOT NULL,
+    sequence INTEGER DEFAULT 0,
+    from_date TEXT NOT NULL,
+    till_date TEXT NOT NULL,
+    beds INTEGER NOT NULL,
+    summary TEXT,
+    imported_at TEXT,
+    UNIQUE (source_id, uid)
+);
+CREATE INDEX IF NOT EXISTS idx_external_holds_till ON external_holds (till_date, homestay_id);
+
+CREATE TABLE IF NOT EXISTS inauguration (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    status TEXT
+);
+"""
+
+# Columns added after a table was first created; applied to older database files
+ADDED_COLUMNS = {
+    'bookings': {'order_id': 'TEXT', 'bed_assignment': 'TEXT'},
+    'bookings_archive': {'bed_assignment': 'TEXT'},
+    'payments': {'reconciled_at': 'TEXT'},
+}
+
+# Columns stored as 0/1 that should come back as Python bools
+BOOL_COLUMNS = {'is_admin'}
+
+
+class SQLiteDatabase:
+    """Per-thread SQLite connections to one database file (or shared memory)."""
+
+    def __init__(self, path):
+        self._local = threading.local()
+        self._anchor = None
+        if path == ':memory:':
+            # Named shared-cache memory DB so every thread sees the same data;
+            # the anchor connection keeps it alive for the life of the process.
+            self.uri = f"file:kangundi_{uuid.uuid4().hex}?mode=memory&cache=shared"
+            self._anchor = self._connect()
+        else:
+            self.uri = f"file:{path}"
+        conn = self.connection()
+        if self._anchor is None:
+            conn.execute('PRAGMA journal_mode=WAL')
+        self._add_missing_columns(conn)
+        conn.executescript(SCHEMA)
+
+    def _add_missing_columns(self, conn):
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if not existing:
+                continue  # table is created with every column by SCHEMA
+            for column, column_type in columns.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def query(self, sql, params=()):
+        rows = self.connection().execute(sql, params).fetchall()
+        return [row_to_dict(row) for row in rows]
+
+    def execute(self, sql, params=()):
+        conn = self.connection()
+        with conn:
+            return conn.execute(sql, params)
+
+    def insert(self, table, data):
+        columns = list(data)
+        placeholders = ', '.join('?' for _ in columns)
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+        cursor = self.execute(sql, [data[c] for c in columns])
+        return self.get(table, cursor.lastrowid)
+
+    def update(self, table, row_id, data):
+        if not data:
+            return self.get(table, row_id)
+        assignments = ', '.join(f"{c} = ?" for c in data)
+        cursor = self.execute(f"UPDATE {table} SET {assignments} WHERE id = ?", [*data.values(), row_id])
+        return self.get(table, row_id) if cursor.rowcount else None
+
+    def get(self, table, row_id):
+        rows = self.query(f"SELECT * FROM {table} WHERE id = ?", (row_id,))
+        return rows[0] if rows else None
+
+
+def row_to_dict(row):
+    data = dict(row)
+    for column in BOOL_COLUMNS.intersection(data):
+        data[column] = bool(data[column])
+    return data
+
+
+def _placeholders(values):
+    return ', '.join('?' for _ in values)
+
+
+class SQLiteUsers(UsersRepository):
+    def __init__(self, stats, db):
+        super().__init__(stats)
+        self.db = db
+
+    def _get_by(self, column, value):
+        self._count('select')
+        rows = self.db.query(f"SELECT * FROM users WHERE {column} = ? LIMIT 1", (value,))
+        return rows[0] if rows else None
+
+    def get_by_email(self, email):
+        return self._get_by('email', email)
+
+    def get_by_username(self, username):
+        return self._get_by('username', username)
+
+    def get_by_phone(self, phone_number):
+        return self._get_by('phone_number', phone_number)
+
+    def create(self, data):
+        self._count('insert')
+        return self.db.insert('users', data)
+
+
+class SQLiteHomestays(HomestaysRepository):
+    def __init__(self, stats, db):
+        super().__init__(stats)
+        self.db = db
+
+    def list_all(self):
+        self._count('select')
+        return self.db.query("SELECT * FROM homestays ORDER BY id")
+
+    def get(self, homestay_id):
+        self._count('select')
+        return self.db.get('homestays', homestay_id)
+
+    def get_many(self, homestay_ids):
+        ids = list({i for i in homestay_ids if i is not None})
+        if not ids:
+            return {}
+        self._count('select')
+        rows = self.db.query(f"SELECT * FROM homestays WHERE id IN ({_placeholders(ids)})", ids)
+        return {row['id']: row for row in rows}
+
+    def create(self, data):
+        self._count('insert')
+        return self.db.insert('homestays', data)
+
+    def update(self, homestay_id, data):
+        self._count('update')
+        return self.db.update('homestays', homestay_id, data)
+
+    def delete(self, homestay_id):
+        self._count('delete')
+        self.db.execute("DELETE FROM homestays WHERE id = ?", (homestay_id,))
+
+
+def _page_bookings(db, table, after_id, limit, from_date, till_date, statuses):
+    sql = f"SELECT * FROM {table} WHERE id > ?"
+    params = [after_id if after_id is not None else 0]
+    if from_date:
+        sql += " AND from_date >= ?"
+        params.append(from_date)
+    if till_date:
+        sql += " AND from_date <= ?"
+        params.append(till_date)
+    if statuses:
+        statuses = list(statuses)
+        sql += f" AND status IN ({_placeholders(statuses)})"
+        params.extend(statuses)
+    sql += " ORDER BY id LIMIT ?"
+    params.append(limit)
+    return db.query(sql, params)
+
+
+def _bookings_for_user(db, table, email, phone, name):
+    if email:
+        column, value = 'user_email', email
+    elif phone:
+        column, value = 'user_phone', phone
+    elif name:
+        column, value = 'user_name', name
+    else:
+        return db.query(f"SELECT * FROM {table} ORDER BY from_date ASC")
+    return db.query(f"SELECT * FROM {table} WHERE {column} = ? ORDER BY from_date ASC", (value,))
+
+
+class SQLiteBookings(BookingsRepository):
+    def __init__(self, stats, db):
+        super().__init__(stats)
+        self.db = db
+
+    def get(self, booking_id):
+        self._count('select')
+        return self.db.get('bookings', booking_id)
+
+    def create(self, data):
+        self._count('insert')
+        return self.db.insert('bookings', data)
+
+    def update(self, booking_id, data):
+        self._count('update')
+        return self.db.update('bookings', booking_id, data)
+
+    def set_bed_assignment(self, booking_id, assignment, expected=None):
+        sql = "UPDATE bookings SET bed_assignment = ? WHERE id = ? AND "
+        if expected:
+            sql += "bed_assignment = ?"
+            params = [assignment, booking_id, expected]
+        else:
+            sql += "(bed_assignment IS NULL OR bed_assignment = '')"
+            params = [assignment, booking_id]
+        self._count('update')
+        conn = self.db.connection()
+        with conn:
+            rows = conn.execute(sql + " RETURNING *", params).fetchall()
+        return row_to_dict(rows[0]) if rows else None
+
+    def update_many(self, booking_ids, data, only_statuses=None):
+        ids = list(booking_ids)
+        if not ids:
+            return []
+        sql = f"UPDATE bookings SET {', '.join(f'{c} = ?' for c in data)} WHERE id IN ({_placeholders(ids)})"
+        params = [*data.values(), *ids]
+        if only_statuses:
+            sql += f" AND status IN ({_placeholders(only_statuses)})"
+            params.extend(only_statuses)
+        self._count('update')
+        conn = self.db.connection()
+        with conn:
+            rows = conn.execute(sql + " RETURNING *", params).fetchall()
+        return [row_to_dict(row) for row in rows]
+
+    def list_by_order_ids(self, order_ids):
+        ids = list(order_ids)
+        if not ids:
+            return []
+        self._count('select')
+        return self.db.query(f"SELECT * FROM bookings WHERE order_id IN ({_placeholders(ids)})", ids)
+
+    def list_stale_pending(self, created_before, checkin_before, after_id=None, limit=200):
+        sql = (
+            "SELECT * FROM bookings WHERE status = 'pending' AND id > ? AND ("
+            "(created_at < ? AND txn_id IS NULL AND screenshot IS NULL AND order_id IS NULL) OR from_date < ?"
+            ") ORDER BY id LIMIT ?"
+        )
+        self._count('select')
+        return self.db.query(sql, (after_id if after_id is not None else 0, created_before, checkin_before, limit))
+
+    def get_many(self, booking_ids):
+        ids = list({i for i in booking_ids if i is not None})
+        if not ids:
+            return {}
+        self._count('select')
+        rows = self.db.query(f"SELECT * FROM bookings WHERE id IN ({_placeholders(ids)})", ids)
+        return {row['id']: row for row in rows}
+
+    def page(self, after_id=None, limit=500, from_date=None, till_date=None, statuses=None):
+        self._count('select')
+        return _page_bookings(self.db, 'bookings', after_id, limit, from_date, till_date, statuses)
+
+    def list_all(self, desc=True):
+        self._count('select')
+        order = 'DESC' if desc else 'ASC'
+        return self.db.query(f"SELECT * FROM bookings ORDER BY from_date {order}")
+
+    def list_for_user(self, email=None, phone=None, name=None):
+        self._count('select')
+        return _bookings_for_user(self.db, 'bookings', email, phone, name)
+
+    def list_active_for_homestay(self, homestay_id, statuses, from_date=None, till_date=None):
+        statuses = list(statuses)
+        sql = f"SELECT * FROM bookings WHERE homestay_id = ? AND status IN ({_placeholders(statuses)})"
+        params = [homestay_id, *statuses]
+        if till_date:
+            sql += " AND from_date < ?"
+            params.append(till_date)
+        if from_date:
+            sql += " AND till_date > ?"
+            params.append(from_date)
+        self._count('select')
+        return self.db.query(sql, params)
+
+    def list_archivable(self, till_before, statuses, after_id=None, limit=500):
+        statuses = list(statuses)
+        sql = (f"SELECT * FROM bookings WHERE status IN ({_placeholders(statuses)}) AND till_date < ? AND id > ? "
+               "ORDER BY id LIMIT ?")
+        self._count('select')
+        return self.db.query(sql, [*statuses, till_before, after_id if after_id is not None else 0, limit])
+
+    def delete_many(self, booking_ids):
+        ids = list(booking_ids)
+        if not ids:
+            return []
+        self._count('delete')
+        conn = self.db.connection()
+        with conn:
+            rows = conn.execute(f"DELETE FROM bookings WHERE id IN ({_placeholders(ids)}) RETURNING *", ids).fetchall()
+        return [row_to_dict(row) for row in rows]
+
+    def count(self):
+        self._count('select')
+        return self.db.query("SELECT COUNT(*) AS n FROM bookings")[0]['n']
+
+
+class SQLiteArchivedBookings(ArchivedBookingsRepository):
+    def __init__(self, stats, db):
+        super().__init__(stats)
+        self.db = db
+
+    def insert_many(self, rows):
+        rows = list(rows)
+        if not rows:
+            return []
+        columns = list(rows[0])
+        sql = f"INSERT OR REPLACE INTO bookings_archive ({', '.join(columns)}) VALUES ({_placeholders(columns)})"
+        self._count('upsert')
+        conn = self.db.connection()
+        with conn:
+            conn.executemany(sql, [[row.get(c) for c in columns] for row in rows])
+        return rows
+
+    def get_many(self, booking_ids):
+        ids = list({i for i in booking_ids if i is not None})
+        if not ids:
+            return {}
+        self._count('select')
+        rows = self.db.query(f"SELECT * FROM bookings_archive WHERE id IN ({_placeholders(ids)})", ids)
+        return {row['id']: row for row in rows}
+
+    def page(self, after_id=None, limit=500, from_date=None, till_date=None, statuses=None):
+        self._count('select')
+        return _page_bookings(self.db, 'bookings_archive', after_id, limit, from_date, till_date, statuses)
+
+    def list_all(self, desc=True):
+        self._count('select')
+        order = 'DESC' if desc else 'ASC'
+        return self.db.query(f"SELECT * FROM bookings_archive ORDER BY from_date {order}")
+
+    def list_for_user(self, email=None, phone=None, name=None):
+        self._count('select')
+        return _bookings_for_user(self.db, 'bookings_archive', email, phone, name)
+
+    def count(self):
+        self._count('select')
+        return self.db.query("SELECT COUNT(*) AS n FROM bookings_archive")[0]['n']
+
+
+class SQLitePayments(PaymentsRepository):
+    def __init__(self, stats, db):
+        super().__init__(stats)
+        self.db = db
+
+    def get_status(self, order_id):
+        self._count('select')
+        rows = self.db.query("SELECT status FROM payments WHERE order_id = ? LIMIT 1", (order_id,))
+        return rows[0]['status'] if rows else None
+
+    def create(self, data):
+        self._count('insert')
+        return self.db.insert('payments', data)
+
+    def upsert(self, data):
+        self._count('upsert')
+        columns = list(data)
+        updates = ', '.join(f"{c} = excluded.{c}" for c in columns if c != 'order_id')
+        sql = (
+            f"INSERT INTO payments ({', '.join(columns)}) VALUES ({_placeholders(columns)}) "
+            f"ON CONFLICT(order_id) DO UPDATE SET {updates}"
+        )
+        self.db.execute(sql, [data[c] for c in columns])
+        rows = self.db.query("SELECT * FROM payments WHERE order_id = ?", (data['order_id'],))
+        return rows[0] if rows else None
+
+    def list_unreconciled(self, statuses, after_order_id=None, limit=100):
+        statuses = list(statuses)
+        sql = f"SELECT * FROM payments WHERE reconciled_at IS NULL AND status IN ({_placeholders(statuses)})"
+        params = list(statuses)
+        if after_order_id is not None:
+            sql += " AND order_id > ?"
+            params.append(after_order_id)
+        sql += " ORDER BY order_id LIMIT ?"
+        params.append(limit)
+        self._count('select')
+        return self.db.query(sql, params)
+
+    def mark_reconciled(self, order_ids, reconciled_at):
+        ids = list(order_ids)
+        if not ids:
+            return
+        self._count('update')
+        self.db.execute(
+            f"UPDATE payments SET reconciled_at = ? WHERE order_id IN ({_placeholders(ids)})",
+            [reconciled_at, *ids],
+        )
+
+    def get_many_by_order_ids(self, order_ids):
+        ids = list({i for i in order_ids if i})
+        if not ids:
+            return {}
+        self._count('select')
+        rows = self.db.query(f"SELECT * FROM payments WHERE order_id IN ({_placeholders(ids)})", ids)
+        return {row['order_id']: row for row in rows}
+
+
+class SQLitePaymentReferences(PaymentReferencesRepository):
+    def __init__(self, stats, db):
+        super().__init__(stats)
+        self.db = db
+
+    def register(self, kind, reference, booking_id, created_at=None):
+        booking_id = str(booking_id)
+        # Insert first, then read every holder in the same transaction: of two bookings
+        # registering the same reference at once, the later one always sees the other
+        self._count('insert')
+        self._count('select')
+        conn = self.db.connection()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO payment_references (kind, reference, booking_id, created_at) VALUES (?, ?, ?, ?)",
+                (kind, reference, booking_id, created_at),
+            )
+            rows = conn.execute(
+                "SELECT booking_id FROM payment_references WHERE kind = ? AND reference = ?", (kind, reference)
+            ).fetchall()
+        return sorted({row['booking_id'] for row in rows} - {booking_id})
+
+    def lookup_many(self, kind, references):
+        refs = list(set(references))
+        if not refs:
+            return {}
+        self._count('select')
+        rows = self.db.query(
+            f"SELECT * FROM payment_references WHERE kind = ? AND reference IN ({_placeholders(refs)})", [kind, *refs]
+        )
+        found = {}
+        for row in rows:
+            found.setdefault(row['reference'], []).append(row)
+        return found
+
+    def list_for_bookings(self, booking_ids):
+        ids = [str(i) for i in set(booking_ids)]
+        if not ids:
+            return []
+        self._count('select')
+        return self.db.query(f"SELECT * FROM payment_references WHERE booking_id IN ({_placeholders(ids)})", ids)
+
+
+class SQLiteInauguration(InaugurationRepository):
+    def __init__(self, stats, db):
+        super().__init__(stats)
+        self.db = db
+
+    def get_status(self):
+        self._count('select')
+        rows = self.db.query("SELECT status FROM inauguration ORDER BY id LIMIT 1")
+        return rows[0]['status'] if rows else None
+
+    def set_status(self, status):
+        self._count('select')
+        rows = self.db.query("SELECT id FROM inauguration ORDER BY id LIMIT 1")
+        if rows:
+            self._count('update')
+            self.db.update('inauguration', rows[0]['id'], {'status': status})
+        else:
+            self._count('insert')
+            self.db.insert('inauguration', {'status': status})
+
+    def ensure_row(self, default_status='no'):
+        self._count('select')
+        if not self.db.query("SELECT id FROM inauguration LIMIT 1"):
+            self._count('insert')
+            self.db.insert('inauguration', {'status': default_status})
+
+
+class SQLitePricingRules(PricingRulesRepository):
+    def __init__(self, stats, db):
+        super().__init__(stats)
+        self.db = db
+
+    def list_all(self):
+        self._count('select')
+        return self.db.query("SELECT * FROM pricing_rules ORDER BY id")
+
+    def list_for_homestays(self, homestay_ids):
+        ids = sorted({int(i) for i in homestay_ids if i is not None})
+        self._count('select')
+        return self.db.query(
+            f"SELECT * FROM pricing_rules WHERE homestay_id IS NULL OR homestay_id IN ({_placeholders(ids)}) ORDER BY id",
+            ids,
+        )
+
+    def create(self, data):
+        self._count('insert')
+        return self.db.insert('pricing_rules', data)
+
+    def delete(self, rule_id):
+        self._count('delete')
+        self.db.execute("DELETE FROM pricing_rules WHERE id = ?", (rule_id,))
+
+
+class SQLiteCalendarSources(CalendarSourcesRepository):
+    def __init__(self, stats, db):
+        super().__init__(stats)
+        self.db = db
+
+    def list_all(self):
+        self._count('select')
+        return self.db.query("SELECT * FROM calendar_sources ORDER BY id")
+
+    def get(self, source_id):
+        self._count('select')
+        return self.db.get('calendar_sources', source_id)
+
+    def create(self, data):
+        self._count('insert')
+        return self.db.insert('calendar_sources', data)
+
+    def update(self, source_id, data):
+        self._count('update')
+        return self.db.update('calendar_sources', source_id, data)
+
+    def delete(self, source_id):
+        self._count('delete')
+        self.db.execute("DELETE FROM calendar_sources WHERE id = ?", (source_id,))
+
+
+class SQLiteExternalHolds(ExternalHoldsRepository):
+    COLUMNS = ('source_id', 'homestay_id', 'uid', 'sequence', 'from_date', 'till_date', 'beds', 'summary', 'imported_at')
+
+    def __init__(self, stats, db):
+        super().__init__(stats)
+        self.db = db
+
+    def list_for_source(self, source_id):
+        self._count('select')
+        return self.db.query("SELECT * FROM external_holds WHERE source_id = ?", (source_id,))
+
+    def list_active(self, after_date):
+        self._count('select')
+        return self.db.query("SELECT * FROM external_holds WHERE till_date > ?", (after_date,))
+
+    def upsert_many(self, rows):
+        rows = list(rows)
+        if not rows:
+            return []
+        updates = ', '.join(f"{c} = excluded.{c}" for c in self.COLUMNS if c not in ('source_id', 'uid'))
+        sql = (f"INSERT INTO external_holds ({', '.join(self.COLUMNS)}) VALUES ({_placeholders(self.COLUMNS)}) "
+               f"ON CONFLICT(source_id, uid) DO UPDATE SET {updates}")
+        self._count('upsert')
+        conn = self.db.connection()
+        with conn:
+            conn.executemany(sql, [[row.get(c) for c in self.COLUMNS] for row in rows])
+        written = []
+        by_source = {}
+        for row in rows:
+            by_source.setdefault(row['source_id'], []).append(row['uid'])
+        for source_id, uids in by_source.items():
+            written.extend(self.db.query(
+                f"SELECT * FROM external_holds WHERE source_id = ? AND uid IN ({_placeholders(uids)})",
+                [source_id, *uids],
+            ))
+        return written
+
+    def delete_many(self, hold_ids):
+        ids = list(hold_ids)
+        if not ids:
+            return []
+        self._count('delete')
+        rows = self.db.query(f"SELECT * FROM external_holds WHERE id IN ({_placeholders(ids)})", ids)
+        self.db.execute(f"DELETE FROM external_holds WHERE id IN ({_placeholders(ids)})", ids)
+        return rows
+
+    def delete_for_source(self, source_id):
+        self._count('delete')
+        rows = self.db.query("SELECT * FROM external_holds WHERE source_id = ?", (source_id,))
+        self.db.execute("DELETE FROM external_holds WHERE source_id = ?", (source_id,))
+        return rows
+
+
+def create_sqlite_datastore(path=':memory:'):
+    """Build a store on a local SQLite database, creating the schema if needed."""
+    db = SQLiteDatabase(path)
+    stats = QueryStats()
+    store = DataStore(
+        'sqlite',
+        users=SQLiteUsers(stats, db),
+        homestays=SQLiteHomestays(stats, db),
+        bookings=SQLiteBookings(stats, db),
+        bookings_archive=SQLiteArchivedBookings(stats, db),
+        payments=SQLitePayments(stats, db),
+        payment_refs=SQLitePaymentReferences(stats, db),
+        inauguration=SQLiteInauguration(stats, db),
+        pricing_rules=SQLitePricingRules(stats, db),
+        calendar_sources=SQLiteCalendarSources(stats, db),
+        external_holds=SQLiteExternalHolds(stats, db),
+        stats=stats,
+    )
+    store.db = db
+    return store
@@ -0,0 +1,102 @@
+"""Expire pending bookings that will never be paid.
+
+Pending bookings count against availability, so abandoned UPI
+confirmations would hold beds forever. Each pass expires, in bounded
+batches:
+
+* ``abandoned`` - pending for longer than the TTL with no txn_id, no
+  screenshot and no Cashfree order (orders are settled by reconciliation)
+* ``past_checkin`` - still pending after the check-in date has passed
+
+Updates only touch bookings that are still ``pending``, so a booking
+approved between the scan and the update is left alone.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+EXPIRED_STATUS = 'expired'
+REASONS = {
+    'abandoned': 'Expired: no payment proof was submitted in time',
+    'past_checkin': 'Expired: check-in date passed before payment was confirmed',
+}
+
+
+class SweepStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.scanned = 0
+        self.expired = {reason: 0 for reason in REASONS}
+        self.beds_released = 0
+        self.last_run_at = None
+        self.last_duration_ms = None
+        self.last_expired = 0
+
+    def record(self, summary):
+        with self._lock:
+            self.runs += 1
+            self.scanned += summary['scanned']
+            for reason, count in summary['expired'].items():
+                self.expired[reason] += count
+            self.beds_released += summary['beds_released']
+            self.last_run_at = summary['finished_at']
+            self.last_duration_ms = summary['duration_ms']
+            self.last_expired = sum(summary['expired'].values())
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'runs': self.runs,
+                'scanned': self.scanned,
+                'expired': dict(self.expired),
+                'beds_released': self.beds_released,
+                'last_run_at': self.last_run_at,
+                'last_duration_ms': self.last_duration_ms,
+                'last_expired': self.last_expired,
+            }
+
+
+stats = SweepStats()
+
+
+def _reason(booking, today):
+    return 'past_checkin' if str(booking.get('from_date') or '') < today else 'abandoned'
+
+
+def expire_stale_bookings(store, ttl_seconds, batch_size=200, max_batches=20, now=None):
+    """Run one sweep; returns a summary dict."""
+    started = time.perf_counter()
+    now = now or datetime.now(timezone.utc)
+    created_before = (now - timedelta(seconds=ttl_seconds)).isoformat()
+    today = now.date().isoformat()
+    summary = {'scanned': 0, 'expired': {reason: 0 for reason in REASONS}, 'beds_released': 0, 'batches': 0}
+    cursor = None
+
+    for _ in range(max_batches):
+        bookings = store.bookings.list_stale_pending(created_before, today, after_id=cursor, limit=batch_size)
+        if not bookings:
+            break
+        summary['batches'] += 1
+        summary['scanned'] += len(bookings)
+        cursor = bookings[-1]['id']
+
+        # One bulk update per reason, so each expired booking says why
+        by_reason = {}
+        for booking in bookings:
+            by_reason.setdefault(_reason(booking, today), []).append(booking['id'])
+        for reason, ids in by_reason.items():
+            updated = store.bookings.update_many(
+                ids, {'status': EXPIRED_STATUS, 'rejection_reason': REASONS[reason]}, only_statuses=['pending']
+            )
+            summary['expired'][reason] += len(updated)
+            summary['beds_released'] += sum(int(row.get('beds_booked') or 1) for row in updated)
+
+        if len(bookings) < batch_size:
+            break
+
+    summary['finished_at'] = datetime.now(timezone.utc).isoformat()
+    summary['duration_ms'] = (time.perf_counter() - started) * 1000.0
+    stats.record(summary)
+    return summary
@@ -0,0 +1,18 @@
+import csv
+import io
+import json
+
+import exports
+
+
+def test_csv_escapes_formula_cells_and_ndjson_keeps_them():
+    rows = [{'id': 1, 'user_name': '=HYPERLINK("http://evil","x")', 'utr': '+123', 'amount': 500,
+             'user_email': 'guest@example.com'}]
+    columns = ['id', 'user_name', 'utr', 'amount', 'user_email']
+    [record] = csv.DictReader(io.StringIO(''.join(exports.stream_csv(rows, columns))))
+    assert record['user_name'] == '\'=HYPERLINK("http://evil","x")'
+    assert record['utr'] == "'+123"
+    assert (record['amount'], record['user_email']) == ('500', 'guest@example.com')
+
+    [line] = ''.join(exports.stream_ndjson(rows)).splitlines()
+    assert json.loads(line)['user_name'] == '=HYPERLINK("http://evil","x")'
@@ -0,0 +1,151 @@
+import os
+from datetime import date
+
+import pytest
+
+import ical_import
+from datastore import create_datastore
+
+TODAY = date(2026, 1, 1)
+
+
+def calendar(*events, closed=True):
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//Other Platform//EN']
+    for event in events:
+        lines += ['BEGIN:VEVENT', *event, 'END:VEVENT']
+    if closed:
+        lines.append('END:VCALENDAR')
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def event(uid, start, end, sequence=0):
+    return [f'UID:{uid}', f'SEQUENCE:{sequence}', f'DTSTART;VALUE=DATE:{start}', f'DTEND;VALUE=DATE:{end}']
+
+
+# --- Parsing ---
+
+def test_folded_lines_are_joined():
+    text = calendar([
+        'UID:abc-',
+        ' 123@other.example',
+        'DTSTART;VALUE=DATE:20260310',
+        'DTEND;VALUE=DATE:20260312',
+        'SUMMARY:Reserved by a',
+        '\tguest',
+    ])
+    [parsed] = ical_import.iter_events(text.splitlines(keepends=True))
+    assert parsed['uid'] == 'abc-123@other.example'
+    assert parsed['summary'] == 'Reserved by aguest'
+    assert (parsed['start'], parsed['end']) == (date(2026, 3, 10), date(2026, 3, 12))
+
+
+def test_valarm_properties_do_not_leak_into_the_event():
+    text = calendar([
+        'BEGIN:VALARM',
+        'UID:alarm-uid',
+        'DTSTART:20990101',
+        'DURATION:P9D',
+        'END:VALARM',
+        'UID:event-uid',
+        'DTSTART;VALUE=DATE:20260310',
+        'DURATION:P2D',
+    ])
+    [parsed] = ical_import.iter_events(text.splitlines())
+    assert parsed['uid'] == 'event-uid'
+    assert (parsed['start'], parsed['end']) == (date(2026, 3, 10), date(2026, 3, 12))
+
+
+@pytest.mark.parametrize('duration, nights', [('P3D', 3), ('P1W2D', 9), ('PT12H', 1), ('', 1)])
+def test_duration_sets_the_end_date(duration, nights):
+    props = ['UID:d', 'DTSTART;VALUE=DATE:20260301']
+    if duration:
+        props.append(f'DURATION:{duration}')
+    [parsed] = ical_import.iter_events(calendar(props).splitlines())
+    assert (parsed['end'] - parsed['start']).days == nights
+
+
+def test_html_page_is_not_a_feed():
+    with pytest.raises(ical_import.ICalError):
+        list(ical_import.iter_events(['<html><body>Service Unavailable</body></html>']))
+
+
+def test_truncated_feed_raises_after_its_events():
+    events = ical_import.iter_events(calendar(event('a', '20260310', '20260312'), closed=False).splitlines())
+    assert next(events)['uid'] == 'a'
+    with pytest.raises(ical_import.ICalError):
+        next(events)
+
+
+# --- Sync against a feed file ---
+
+@pytest.fixture
+def feed(tmp_path):
+    store = create_datastore('sqlite')
+    homestay = store.homestays.create({'owner': 'Test', 'rooms': 2, 'beds': 4, 'price': 500})
+    source = store.calendar_sources.create({'homestay_id': homestay['id'], 'url': 'other.ics', 'beds': 2})
+    path = tmp_path / 'other.ics'
+    mtime = [1_700_000_000]
+
+    def write(text):
+        path.write_text(text, newline='')
+        mtime[0] += 10  # a new modification time for every write
+        os.utime(path, (mtime[0], mtime[0]))
+
+    def sync():
+        return ical_import.sync_source(
+            store, store.calendar_sources.get(source['id']), homestay['beds'],
+            import_dir=str(tmp_path), today=TODAY,
+        )
+
+    def holds():
+        return {row['uid']: row for row in store.external_holds.list_for_source(source['id'])}
+
+    return write, sync, holds
+
+
+def test_sync_inserts_then_reports_not_modified(feed):
+    write, sync, holds = feed
+    write(calendar(event('a', '20260310', '20260312'), event('b', '20260401', '20260405')))
+    result = sync()
+    assert result['status'] == 'synced'
+    assert result['inserted'] == 2
+    assert holds()['a']['beds'] == 2
+
+    assert sync()['status'] == 'not_modified'
+
+
+def test_lower_sequence_keeps_the_imported_hold(feed):
+    write, sync, holds = feed
+    write(calendar(event('a', '20260310', '20260312', sequence=2)))
+    sync()
+    write(calendar(event('a', '20260501', '20260503', sequence=1)))
+    result = sync()
+    assert result['status'] == 'synced'
+    assert result['updated'] == 0 and result['deleted'] == 0
+    assert holds()['a']['from_date'] == '2026-03-10'
+
+
+def test_removed_events_are_deleted_after_a_complete_read(feed):
+    write, sync, holds = feed
+    write(calendar(event('a', '20260310', '20260312'), event('b', '20260401', '20260405')))
+    sync()
+    write(calendar(event('a', '20260310', '20260312')))
+    result = sync()
+    assert result['status'] == 'synced'
+    assert result['deleted'] == 1
+    assert set(holds()) == {'a'}
+
+
+@pytest.mark.parametrize('broken', [
+    '<html><head><title>503</title></head><body>Service Unavailable</body></html>\r\n',
+    calendar(event('a', '20260310', '20260312'), closed=False),
+])
+def test_incomplete_feed_fails_without_deleting(feed, broken):
+    write, sync, holds = feed
+    write(calendar(event('a', '20260310', '20260312'), event('b', '20260401', '20260405')))
+    sync()
+    write(broken)
+    result = sync()
+    assert result['status'] == 'failed'
+    assert result['deleted'] == 0
+    assert set(holds()) == {'a', 'b'}
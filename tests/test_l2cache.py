@@ -0,0 +1,27 @@
+import l2cache
+
+
+def test_memory_backend_drops_expired_values(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(l2cache.time, 'monotonic', lambda: clock[0])
+    backend = l2cache.MemoryBackend()
+    backend.set('a', '1', ttl=10)
+    backend.incr('version')
+    clock[0] += 11
+    assert backend.get_many(['a', 'version']) == [None, '1']
+    assert set(backend._data) == {'version'}
+
+    for i in range(backend.PURGE_EVERY - 2):  # "fresh" is the PURGE_EVERY-th set
+        backend.set(f"old:{i}", 'x', ttl=10)
+    clock[0] += 11
+    backend.set('fresh', 'y', ttl=10)
+    assert set(backend._data) == {'version', 'fresh'}
+
+
+def test_memory_backend_is_size_bounded_and_keeps_versions():
+    backend = l2cache.MemoryBackend(max_entries=3)
+    backend.incr('version')
+    for i in range(5):
+        backend.set(f"key:{i}", str(i), ttl=60)
+    assert len(backend._data) == 3
+    assert backend.get_many(['version', 'key:3', 'key:4', 'key:0']) == ['1', '3', '4', None]
@@ -0,0 +1,79 @@
+import hashlib
+import hmac
+import json
+import os
+from datetime import date, timedelta
+
+import pytest
+
+os.environ.setdefault('DATA_BACKEND', 'sqlite')
+os.environ.setdefault('SQLITE_PATH', ':memory:')
+
+import app as app_module  # noqa: E402
+
+SECRET = 'test-cashfree-secret'
+
+
+@pytest.fixture
+def checkout(monkeypatch):
+    monkeypatch.setattr(app_module, 'CASHFREE_SECRET_KEY', SECRET)
+    orders = []
+
+    def create_cashfree_order(order_id, amount, customer_id, phone, return_url=None):
+        orders.append({'order_id': order_id, 'amount': amount, 'return_url': return_url})
+        return f"session-{order_id}"
+    monkeypatch.setattr(app_module, 'create_cashfree_order', create_cashfree_order)
+
+    store = app_module.store
+    store.inauguration.set_status('yes')  # the site is open; otherwise every page is "coming soon"
+    homestay = store.homestays.create({'owner': 'Flow Test', 'rooms': 2, 'beds': 4, 'price': 500})
+    start = date.today() + timedelta(days=20)
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 4242
+        sess['name'] = 'Guest'
+        sess['phone_number'] = '9999999999'
+        sess['pending_booking'] = {
+            'homestay_id': homestay['id'],
+            'from_date': start.isoformat(),
+            'till_date': (start + timedelta(days=2)).isoformat(),
+            'nights': 2,
+            'beds_requested': 2,
+            'total_amount': 2000,
+        }
+    return client, orders, store
+
+
+def own_bookings(store):
+    return [b for b in store.bookings.list_all() if str(b.get('user_id')) == '4242']
+
+
+def webhook(client, order_id, amount):
+    body = json.dumps({
+        'type': 'PAYMENT_SUCCESS_WEBHOOK',
+        'data': {'order': {'order_id': order_id, 'order_amount': amount}, 'payment': {'payment_amount': amount}},
+    })
+    signature = hmac.new(SECRET.encode(), body.encode(), hashlib.sha256).hexdigest()
+    return client.post('/payments/cashfree-webhook', data=body, content_type='application/json',
+                       headers={'x-webhook-signature': signature})
+
+
+def test_order_webhook_and_reconciliation_approve_the_booking(checkout):
+    client, orders, store = checkout
+    order = {'order_id': 'ORDER_1', 'amount': 1, 'customer_id': '4242', 'phone': '9999999999'}
+
+    response = client.post('/payments/create-order', json=order)
+    assert response.status_code == 200
+    [booking] = own_bookings(store)
+    assert (booking['status'], booking['order_id']) == ('pending', 'ORDER_1')
+    assert orders[-1]['amount'] == 2000  # the booking's total, not the client's amount
+    assert orders[-1]['return_url'].endswith(f"/receipt/{booking['id']}")
+
+    # Retrying checkout reuses the staged booking under the new order
+    assert client.post('/payments/create-order', json={**order, 'order_id': 'ORDER_2'}).status_code == 200
+    [booking] = own_bookings(store)
+    assert booking['order_id'] == 'ORDER_2'
+
+    assert webhook(client, 'ORDER_2', 2000).status_code == 200
+    app_module.run_payment_reconciliation()
+    assert store.bookings.get(booking['id'])['status'] == 'approved'
@@ -0,0 +1,9 @@
+from datastore import create_datastore
+
+
+def test_register_returns_the_other_holders_of_a_reference():
+    refs = create_datastore('sqlite').payment_refs
+    assert refs.register('utr', '123456789012', 1) == []
+    assert refs.register('utr', '123456789012', 2) == ['1']
+    assert refs.register('utr', '123456789012', 1) == ['2']  # registering again is harmless
+    assert len(refs.lookup_many('utr', ['123456789012'])['123456789012']) == 2
@@ -0,0 +1,33 @@
+from datetime import date, timedelta
+
+import pricing
+from datastore import create_datastore
+
+
+def engine():
+    store = create_datastore('sqlite')
+    homestay = store.homestays.create({'owner': 'Test', 'rooms': 2, 'beds': 4, 'price': 600})
+    return pricing.PricingEngine(lambda: store), homestay['id']
+
+
+def test_quotes_a_stay_inside_the_window():
+    quotes, homestay_id = engine()
+    start = date.today() + timedelta(days=10)
+    quote = quotes.quote(homestay_id, start, start + timedelta(days=3), beds=2)
+    assert (quote['nights'], quote['total']) == (3, 3600)
+
+
+def test_out_of_window_stays_are_rejected_before_building_a_calendar():
+    quotes, homestay_id = engine()
+    today = date.today()
+    results = quotes.quote_many([
+        {'homestay_id': homestay_id, 'from_date': '0001-01-02', 'till_date': '9999-12-30'},
+        {'homestay_id': homestay_id, 'from_date': today - timedelta(days=pricing.PAST_DAYS + 1),
+         'till_date': today},
+        {'homestay_id': homestay_id, 'from_date': today,
+         'till_date': today + timedelta(days=pricing.HORIZON_DAYS + 1)},
+        {'homestay_id': homestay_id, 'from_date': today,
+         'till_date': today + timedelta(days=pricing.MAX_NIGHTS + 1)},
+    ])
+    assert all('error' in result for result in results)
+    assert quotes.stats()['builds'] == 0
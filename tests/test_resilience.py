@@ -0,0 +1,56 @@
+import threading
+import time
+
+import pytest
+
+import resilience
+
+
+def slow(result, seconds=0.2):
+    def call(*args):
+        time.sleep(seconds)
+        return result
+    return call
+
+
+def test_reads_and_updates_are_abandoned_after_their_timeout():
+    guard = resilience.Resilience(read_timeout=0.05, write_timeout=0.05)
+    with pytest.raises(resilience.CallTimeout):
+        guard._wrap('bookings', 'get', False, slow('row'))(1)
+    with pytest.raises(resilience.CallTimeout):
+        guard._wrap('bookings', 'update', True, slow('row'))(1, {})
+
+
+@pytest.mark.parametrize('table, method', [
+    ('bookings', 'create'),
+    ('payments', 'create'),
+    ('bookings_archive', 'insert_many'),
+    ('bookings', 'set_bed_assignment'),
+    ('bookings', 'update_many'),
+    ('payment_references', 'register'),
+    ('inauguration', 'ensure_row'),
+])
+def test_writes_unsafe_to_repeat_run_to_completion_on_the_callers_thread(table, method):
+    guard = resilience.Resilience(read_timeout=0.05, write_timeout=0.05)
+    threads = []
+
+    def write(*args):
+        threads.append(threading.current_thread())
+        time.sleep(0.2)
+        return {'id': 1}
+
+    assert guard._wrap(table, method, True, write)({'status': 'pending'}) == {'id': 1}
+    assert threads == [threading.current_thread()]
+    assert guard.snapshot()['timeouts'] == 0
+
+
+def test_insert_errors_still_count_against_the_breaker():
+    guard = resilience.Resilience(failure_threshold=1)
+
+    def create(data):
+        raise ConnectionError('down')
+
+    with pytest.raises(ConnectionError):
+        guard._wrap('payments', 'create', True, create)({})
+    with pytest.raises(resilience.BreakerOpen):
+        guard._wrap('payments', 'create', True, create)({})